@@ -3,6 +3,7 @@ use std::vec;
 use anyhow::{anyhow, Result};
 use async_nats::jetstream;
 use bincode;
+use chrono::Utc;
 use clap::Parser;
 use futures::StreamExt;
 use influxdb::Client;
@@ -11,7 +12,7 @@ use tokio::{sync::mpsc, task::JoinSet};
 use consumer::breakout::{self, BreakoutMessage};
 use consumer::cli::{Cli, PartitionSubcommand};
 use consumer::influx::{self, InfluxConfig, InfluxResults};
-use consumer::tick::TickEvent;
+use consumer::tick::{self, TickEvent};
 use consumer::window;
 
 async fn listen(js: jetstream::consumer::PullConsumer, influx_config: InfluxConfig) -> Result<()> {
@@ -47,13 +48,17 @@ async fn listen(js: jetstream::consumer::PullConsumer, influx_config: InfluxConf
                 }
                 for message in messages {
                     if let Ok(m) = message {
+                        let received = Utc::now().timestamp_millis();
+                        let published = tick::publish_time(m.headers.as_ref());
                         let f = m.ack();
                         let tick_event = bincode::deserialize::<TickEvent>(&m.payload)?;
                         if !tick_event.is_valid() {
                             f.await.unwrap();
                             continue;
                         }
-                        if let Some(update) = manager.update(tick_event) {
+                        let stamp = published.map(|p| (p, received));
+                        if let Some(mut update) = manager.update(tick_event, stamp) {
+                            update.record_receive(published, received);
                             if let Some(b) = update.breakout.clone() {
                                 let breakout_message = BreakoutMessage::new(b.id, b.time, b.tags);
                                 breakout_tx.send(breakout_message).await?;
@@ -68,7 +73,11 @@ async fn listen(js: jetstream::consumer::PullConsumer, influx_config: InfluxConf
     }
 }
 
-async fn consumer<T: AsRef<str>>(exchange: T, influx_config: InfluxConfig) -> Result<()> {
+async fn consumer<T: AsRef<str>>(
+    stream_name: String,
+    exchange: T,
+    influx_config: InfluxConfig,
+) -> Result<()> {
     let nats_client = async_nats::connect("localhost:4222").await.map_err(|_| {
         anyhow!("Could not connect to NATS server at localhost:4222, is the server running?")
     })?;
@@ -76,11 +85,12 @@ async fn consumer<T: AsRef<str>>(exchange: T, influx_config: InfluxConfig) -> Re
     let jetstream = async_nats::jetstream::new(nats_client);
 
     println!(
-        "Listening to stream: 'trading-movements', subject: '{}'",
+        "Listening to stream: '{}', subject: '{}'",
+        stream_name,
         exchange.as_ref().to_string()
     );
     let consumer = jetstream
-        .get_stream("trading-movements")
+        .get_stream(stream_name)
         .await?
         .create_consumer(jetstream::consumer::pull::Config {
             ack_policy: jetstream::consumer::AckPolicy::All,
@@ -141,9 +151,13 @@ async fn main() -> Result<()> {
 
     match cli.partition_subcommand {
         PartitionSubcommand::Single => {
-            println!("Spawning single global consumer subscribed to the 'exchange' subject");
-            setup_stream("trading-movements", vec!["exchange"]).await?;
-            consumer("exchange", influx_config).await?
+            let subject = cli.subject("exchange");
+            println!(
+                "Spawning single global consumer subscribed to the '{}' subject",
+                subject
+            );
+            setup_stream(cli.stream_name(), vec![subject.clone()]).await?;
+            consumer(cli.stream_name(), subject, influx_config).await?
         }
         PartitionSubcommand::ByExchange => {
             // Returns three results, when the futures never return
@@ -151,31 +165,32 @@ async fn main() -> Result<()> {
             let config_1 = influx_config.clone();
             let config_2 = influx_config.clone();
             let config_3 = influx_config.clone();
-            setup_stream(
-                "trading-movements",
-                vec!["exchange.FR", "exchange.NL", "exchange.ETR"],
-            )
-            .await?;
+            let (fr, nl, etr) = (
+                cli.subject("exchange.FR"),
+                cli.subject("exchange.NL"),
+                cli.subject("exchange.ETR"),
+            );
+            setup_stream(cli.stream_name(), vec![fr.clone(), nl.clone(), etr.clone()]).await?;
+            let (stream_1, stream_2, stream_3) =
+                (cli.stream_name(), cli.stream_name(), cli.stream_name());
             let (_, _, _) = tokio::join!(
-                tokio::spawn(async move { consumer("exchange.FR", config_1).await }),
-                tokio::spawn(async move { consumer("exchange.NL", config_2).await }),
-                tokio::spawn(async move { consumer("exchange.ETR", config_3).await }),
+                tokio::spawn(async move { consumer(stream_1, fr, config_1).await }),
+                tokio::spawn(async move { consumer(stream_2, nl, config_2).await }),
+                tokio::spawn(async move { consumer(stream_3, etr, config_3).await }),
             );
         }
         PartitionSubcommand::Multi { n } => {
             println!("Spawning {} consumers", n);
             let subjects = (0..n)
-                .map(|i| format!("exchange.{}", i))
+                .map(|i| cli.subject(format!("exchange.{}", i)))
                 .collect::<Vec<String>>();
-            setup_stream("trading-movements", subjects).await?;
+            setup_stream(cli.stream_name(), subjects.clone()).await?;
             let mut set = JoinSet::new();
-            for i in 0..n {
-                println!(
-                    "Spawning consumer subscribed to the 'exchange.{}' subject",
-                    i
-                );
+            for subject in subjects {
+                println!("Spawning consumer subscribed to the '{}' subject", subject);
                 let config = influx_config.clone();
-                set.spawn(async move { consumer(format!("exchange.{}", i), config).await });
+                let stream_name = cli.stream_name();
+                set.spawn(async move { consumer(stream_name, subject, config).await });
             }
             // Wait forever...
             while let Some(_) = set.join_next().await {}
@@ -1,5 +1,6 @@
 use anyhow::{anyhow, Result};
 use bincode;
+use chrono::Utc;
 use clap::Parser;
 use futures::StreamExt;
 use influxdb::Client;
@@ -8,7 +9,7 @@ use tokio::{sync::mpsc, task::JoinSet};
 use consumer::breakout::{self, BreakoutMessage};
 use consumer::cli::{Cli, PartitionSubcommand};
 use consumer::influx::{self, InfluxConfig, InfluxResults};
-use consumer::tick::TickEvent;
+use consumer::tick::{self, TickEvent};
 use consumer::window;
 
 async fn listen<T: AsRef<str>>(
@@ -43,11 +44,15 @@ async fn listen<T: AsRef<str>>(
     let mut manager = window::WindowManager::new();
 
     while let Some(message) = subscriber.next().await {
+        let received = Utc::now().timestamp_millis();
+        let published = tick::publish_time(message.headers.as_ref());
         let tick_event = bincode::deserialize::<TickEvent>(&message.payload)?;
         if !tick_event.is_valid() {
             continue;
         }
-        if let Some(update) = manager.update(tick_event) {
+        let stamp = published.map(|p| (p, received));
+        if let Some(mut update) = manager.update(tick_event, stamp) {
+            update.record_receive(published, received);
             if let Some(b) = update.breakout.clone() {
                 let breakout_message = BreakoutMessage::new(b.id, b.time, b.tags);
                 breakout_tx.send(breakout_message).await?;
@@ -88,8 +93,12 @@ async fn main() -> Result<()> {
 
     match cli.partition_subcommand {
         PartitionSubcommand::Single => {
-            println!("Spawning single global consumer subscribed to the 'exchange' subject");
-            consumer("exchange", influx_config).await?
+            let subject = cli.subject("exchange");
+            println!(
+                "Spawning single global consumer subscribed to the '{}' subject",
+                subject
+            );
+            consumer(subject, influx_config).await?
         }
         PartitionSubcommand::ByExchange => {
             // Returns three results, when the futures never return
@@ -97,21 +106,24 @@ async fn main() -> Result<()> {
             let config_a = influx_config.clone();
             let config_b = influx_config.clone();
             let config_c = influx_config.clone();
+            let (fr, nl, etr) = (
+                cli.subject("exchange.FR"),
+                cli.subject("exchange.NL"),
+                cli.subject("exchange.ETR"),
+            );
             let (_, _, _) = tokio::join!(
-                tokio::spawn(async move { consumer("exchange.FR", config_a).await }),
-                tokio::spawn(async move { consumer("exchange.NL", config_b).await }),
-                tokio::spawn(async move { consumer("exchange.ETR", config_c).await }),
+                tokio::spawn(async move { consumer(fr, config_a).await }),
+                tokio::spawn(async move { consumer(nl, config_b).await }),
+                tokio::spawn(async move { consumer(etr, config_c).await }),
             );
         }
         PartitionSubcommand::Multi { n } => {
             let mut set = JoinSet::new();
             for i in 0..n {
-                println!(
-                    "Spawning consumer subscribed to the 'exchange.{}' subject",
-                    i
-                );
+                let subject = cli.subject(format!("exchange.{}", i));
+                println!("Spawning consumer subscribed to the '{}' subject", subject);
                 let config = influx_config.clone();
-                set.spawn(async move { consumer(format!("exchange.{}", i), config.clone()).await });
+                set.spawn(async move { consumer(subject, config.clone()).await });
             }
             // Wait forever...
             while let Some(_) = set.join_next().await {}
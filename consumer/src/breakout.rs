@@ -22,6 +22,7 @@ pub async fn start_core_nats_breakout_producer(mut receiver: Receiver<BreakoutMe
     let client = async_nats::connect("localhost:4222")
         .await
         .expect("Could not create NATS producer for breakout event");
+    // Per-ID subjects let watchers filter on the server, the header is kept for older watchers
     while let Some(breakout) = receiver.recv().await {
         let mut headers = async_nats::HeaderMap::new();
         headers.insert("ID", breakout.id.clone());
@@ -29,7 +30,7 @@ pub async fn start_core_nats_breakout_producer(mut receiver: Receiver<BreakoutMe
             "bullish" => {
                 client
                     .publish_with_headers(
-                        "breakouts",
+                        format!("breakouts.{}", breakout.id),
                         headers,
                         format!("Bullish event at {}", breakout.ts)
                             .bytes()
@@ -41,7 +42,7 @@ pub async fn start_core_nats_breakout_producer(mut receiver: Receiver<BreakoutMe
             "bearish" => {
                 client
                     .publish_with_headers(
-                        "breakouts",
+                        format!("breakouts.{}", breakout.id),
                         headers,
                         format!("Bearish event at {}", breakout.ts)
                             .bytes()
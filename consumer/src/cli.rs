@@ -37,4 +37,26 @@ pub struct Cli {
 
     #[arg(long, default_value_t = 300)]
     pub profile_duration: u64,
+
+    /// Listen on '<prefix>.exchange...' instead of 'exchange...', where the ingester publishes
+    /// a day with `--parallel-days`. Run one consumer per day, e.g. `--subject-prefix 2021-11-08`
+    #[arg(long)]
+    pub subject_prefix: Option<String>,
+}
+
+impl Cli {
+    pub fn subject<T: AsRef<str>>(&self, subject: T) -> String {
+        match &self.subject_prefix {
+            Some(prefix) => format!("{}.{}", prefix, subject.as_ref()),
+            None => subject.as_ref().to_string(),
+        }
+    }
+
+    /// JetStream streams cannot share subjects, every prefix gets its own stream
+    pub fn stream_name(&self) -> String {
+        match &self.subject_prefix {
+            Some(prefix) => format!("trading-movements-{}", prefix),
+            None => "trading-movements".to_string(),
+        }
+    }
 }
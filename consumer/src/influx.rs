@@ -85,6 +85,12 @@ pub struct Performance {
     #[influxdb(tag)]
     window_number: u32,
     time: DateTime<Utc>,
+    // 0 when the tick that closed the window was not stamped by the ingester
+    publish_time: i64,
+    receive_time: i64,
+    // Latest tick of the window the ingester stamped, 0 when it stamped none
+    stamped_publish_time: i64,
+    stamped_receive_time: i64,
     window_creation_start: i64,
     window_creation_end: i64,
     // Invariant: window_creation_end = influx_write_start
@@ -98,6 +104,10 @@ impl Performance {
             id: id.into(),
             window_number,
             time: Utc::now(),
+            publish_time: 0,
+            receive_time: 0,
+            stamped_publish_time: 0,
+            stamped_receive_time: 0,
             window_creation_start: 0,
             window_creation_end: 0,
             influx_write_end: 0,
@@ -156,6 +166,17 @@ impl InfluxResults {
         }
     }
 
+    pub fn record_receive(&mut self, published: Option<i64>, received: i64) {
+        self.perf.publish_time = published.unwrap_or(0);
+        self.perf.receive_time = received;
+    }
+
+    pub fn record_stamp(&mut self, stamp: Option<(i64, i64)>) {
+        let (published, received) = stamp.unwrap_or((0, 0));
+        self.perf.stamped_publish_time = published;
+        self.perf.stamped_receive_time = received;
+    }
+
     pub fn record_window_start(&mut self, ts: i64) {
         self.perf.window_creation_start = ts;
     }
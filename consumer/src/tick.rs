@@ -1,6 +1,14 @@
+use async_nats::HeaderMap;
 use chrono::{TimeZone, Timelike, Utc};
 use serde::{Deserialize, Serialize};
 
+// The ingester stamps (a sample of) its messages with the unix time in ms at which they were published
+pub const PUBLISH_TIME_HEADER: &str = "Published-At";
+
+pub fn publish_time(headers: Option<&HeaderMap>) -> Option<i64> {
+    headers?.get(PUBLISH_TIME_HEADER)?.as_str().parse().ok()
+}
+
 #[derive(Debug, Serialize, Deserialize)]
 pub struct TickEvent {
     pub last: Option<f64>,
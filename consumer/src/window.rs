@@ -48,6 +48,8 @@ pub struct Window {
     pub max: f64,   // Max value of window
     pub min: f64,   // Min value of window
     pub movements: u32,
+    // Publish and receive time of the latest tick of the window the ingester stamped
+    pub stamp: Option<(i64, i64)>,
 }
 
 impl Window {
@@ -64,6 +66,7 @@ impl Window {
             max: price,
             min: price,
             movements: 0,
+            stamp: None,
         }
     }
 
@@ -84,6 +87,7 @@ impl Window {
         self.max = last_price;
         self.min = last_price;
         self.movements = 0;
+        self.stamp = None;
 
         // A bearish breakout event occurs when:
         // - Current window: EMA_38 < EMA_100
@@ -118,7 +122,12 @@ impl WindowManager {
         }
     }
 
-    pub fn update(&mut self, tick_event: TickEvent) -> Option<InfluxResults> {
+    /// `stamp` holds the publish and receive time of a tick the ingester stamped
+    pub fn update(
+        &mut self,
+        tick_event: TickEvent,
+        stamp: Option<(i64, i64)>,
+    ) -> Option<InfluxResults> {
         let trading_timestamp = tick_event
             .trading_timestamp
             .expect("Got invalid tick event");
@@ -135,6 +144,9 @@ impl WindowManager {
         }
 
         if window.end_time >= trading_timestamp {
+            if stamp.is_some() {
+                window.stamp = stamp;
+            }
             if window.max < last {
                 window.max = last;
             }
@@ -156,6 +168,8 @@ impl WindowManager {
         let window_min = window.min;
         let movements = window.movements;
         let window_start_time = window.start_time;
+        // With --stamp-every N only some ticks are stamped, rarely the one closing the window
+        let window_stamp = stamp.or(window.stamp);
 
         let breakout = window.tumble(round_down(trading_timestamp as i64, 300 * 1000), last);
         let mut result = InfluxResults::new(
@@ -170,6 +184,7 @@ impl WindowManager {
             breakout,
             movements,
         );
+        result.record_stamp(window_stamp);
         result.record_window_start(start);
         result.record_window_end(Utc::now().timestamp_millis());
         window.last = last;
@@ -0,0 +1,199 @@
+import numpy as np
+import polars as pl
+
+# Python version of the consumer's WindowManager (consumer/src/window.rs), vectorised over every ID.
+# It follows the consumer to the bit, quirks included:
+# - the first window of an ID starts at its first tick rounded to the *nearest* 5 minutes
+# - a window ends 5 minutes after its start, a tick at exactly the end still belongs to it
+# - the tick that tumbles a window opens the next one, it sets first, max, min and last but is no movement
+# - ticks older than the start of the current window are dropped
+# - the EMAs of a window are computed from the price of the tick that tumbled it
+# - the last window of every ID is never written, nothing tumbles it
+
+WINDOW_MS = 300 * 1000
+DAY_MS = 24 * 60 * 60 * 1000
+EMA_38 = 38.0
+EMA_100 = 100.0
+
+# Same operations as EMA::calc, so both sides round the same way
+ALPHA_38 = 2.0 / (1.0 + EMA_38)
+ALPHA_100 = 2.0 / (1.0 + EMA_100)
+DECAY_38 = 1.0 - 2.0 / (1.0 + EMA_38)
+DECAY_100 = 1.0 - 2.0 / (1.0 + EMA_100)
+
+SCHEMA = {
+    "ID": pl.String,
+    "SecType": pl.String,
+    "window_start": pl.Datetime("ms", "UTC"),
+    "First": pl.Float64,
+    "Last": pl.Float64,
+    "Max": pl.Float64,
+    "Min": pl.Float64,
+    "Movements": pl.Int64,
+    "EMA38": pl.Float64,
+    "EMA100": pl.Float64,
+    "Breakout": pl.String,
+}
+
+
+def valid_ticks(ticks: pl.LazyFrame) -> pl.LazyFrame:
+    """TickEvent::is_valid, ticks without a price or time, or stamped at midnight, are ignored."""
+    return ticks.filter(
+        pl.col("Last").is_not_null()
+        & pl.col("Timestamp").is_not_null()
+        & (pl.col("Timestamp") % DAY_MS >= 1000)
+    )
+
+
+def _round(timestamps: np.ndarray) -> np.ndarray:
+    # round_down in window.rs rounds to the nearest multiple
+    return (timestamps + WINDOW_MS // 2) // WINDOW_MS * WINDOW_MS
+
+
+def _window_opens(group: np.ndarray, t: np.ndarray, running_max: np.ndarray):
+    """
+    Indices of the ticks that open a window. The next window of an ID opens at the first later
+    tick past the end of the current one. No tick before the opening one is past that end, so
+    it is also the first tick whose running maximum is past it, which is a binary search over
+    (ID, running maximum) for all IDs at once, one round per window.
+    """
+    n = len(t)
+    t_min = int(t.min())
+    key = (group << 40) | (running_max - t_min)
+    current = np.flatnonzero(np.diff(group, prepend=-1))
+    opens = [current]
+    while len(current):
+        end = _round(t[current]) + WINDOW_MS
+        following = np.searchsorted(
+            key, (group[current] << 40) | (end - t_min), side="right"
+        )
+        same = following < n
+        same[same] = group[following[same]] == group[current[same]]
+        current = following[same]
+        opens.append(current)
+    return np.sort(np.concatenate(opens))
+
+
+def _emas(group: np.ndarray, price: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """EMA::calc over the windows of every ID, one round per window number."""
+    ema_38 = np.zeros(len(price))
+    ema_100 = np.zeros(len(price))
+    firsts = np.flatnonzero(np.diff(group, prepend=-1))
+    counts = np.diff(np.append(firsts, len(price)))
+    for k in range(counts.max(initial=0)):
+        rows = firsts[counts > k] + k
+        if k == 0:
+            previous_38, previous_100 = 0.0, 0.0
+        else:
+            previous_38, previous_100 = ema_38[rows - 1], ema_100[rows - 1]
+        ema_38[rows] = price[rows] * ALPHA_38 + previous_38 * DECAY_38
+        ema_100[rows] = price[rows] * ALPHA_100 + previous_100 * DECAY_100
+    return ema_38, ema_100
+
+
+def windows(ticks: pl.LazyFrame | pl.DataFrame) -> pl.DataFrame:
+    """
+    Every window the consumer writes for `ticks`, with its EMAs and breakout. `ticks` holds
+    ID, SecType, Last and Timestamp (unix ms), grouped by ID and in the order the consumer
+    receives them within an ID, as `load_ticks` returns them.
+    """
+    ticks = (
+        valid_ticks(ticks.lazy())
+        .select(
+            "ID",
+            "SecType",
+            "Last",
+            "Timestamp",
+            pl.col("Timestamp").cum_max().over("ID").alias("running_max"),
+        )
+        .collect()
+    )
+    if ticks.is_empty():
+        return pl.DataFrame(schema=SCHEMA)
+
+    group = (ticks["ID"] != ticks["ID"].shift()).fill_null(True).cum_sum().to_numpy()
+    group = group.astype(np.int64)
+    t = ticks["Timestamp"].to_numpy()
+    opens = _window_opens(group, t, ticks["running_max"].to_numpy())
+
+    is_open = np.zeros(len(t), dtype=bool)
+    is_open[opens] = True
+    window = np.cumsum(is_open) - 1
+    start = _round(t[opens])
+    id_first = np.diff(group, prepend=-1) != 0
+    # The first tick of an ID counts as a movement unless it was rounded up into the window
+    member = (t >= start[window]) & (~is_open | id_first)
+
+    per_tick = ticks.select(
+        "ID",
+        "SecType",
+        "Last",
+        pl.Series("window", window),
+        pl.Series("member", member),
+    )
+    opened = per_tick[opens]
+    members = per_tick.filter("member")
+    aggregated = members.group_by("window").agg(
+        pl.col("Last").last().alias("member_last"),
+        pl.col("Last").max().alias("member_max"),
+        pl.col("Last").min().alias("member_min"),
+        pl.len().alias("Movements"),
+    )
+    df = (
+        pl.DataFrame(
+            {
+                "window": np.arange(len(opens)),
+                "ID": opened["ID"],
+                "window_start": start,
+                "First": opened["Last"],
+                # The first window of an ID starts with last = 0, later ones with the price that opened them
+                "opening_last": np.where(
+                    id_first[opens], 0.0, opened["Last"].to_numpy()
+                ),
+                # The tick opening the next window of the same ID tumbles this one
+                "tumble_price": opened["Last"].shift(-1),
+                "SecType": opened["SecType"].shift(-1),
+            }
+        )
+        .join(aggregated, on="window", how="left")
+        .sort("window")
+        .filter(pl.col("ID").shift(-1) == pl.col("ID"))
+    )
+    if df.is_empty():
+        return pl.DataFrame(schema=SCHEMA)
+
+    written_group = (df["ID"] != df["ID"].shift()).fill_null(True).cum_sum()
+    written_group = written_group.to_numpy().astype(np.int64)
+    ema_38, ema_100 = _emas(written_group, df["tumble_price"].to_numpy())
+    first_written = np.diff(written_group, prepend=-1) != 0
+    previous_38 = np.roll(ema_38, 1)
+    previous_100 = np.roll(ema_100, 1)
+    # No breakout on the first window of an ID (sequence_number == 0)
+    bearish = ~first_written & (ema_38 < ema_100) & (previous_38 >= previous_100)
+    bullish = ~first_written & (ema_38 > ema_100) & (previous_38 <= previous_100)
+    return df.select(
+        "ID",
+        "SecType",
+        pl.from_epoch("window_start", time_unit="ms")
+        .dt.replace_time_zone("UTC")
+        .alias("window_start"),
+        "First",
+        pl.col("member_last").fill_null(pl.col("opening_last")).alias("Last"),
+        pl.max_horizontal("First", "member_max").alias("Max"),
+        pl.min_horizontal("First", "member_min").alias("Min"),
+        pl.col("Movements").fill_null(0).cast(pl.Int64),
+        pl.Series("EMA38", ema_38),
+        pl.Series("EMA100", ema_100),
+        pl.when(pl.Series(bearish))
+        .then(pl.lit("bearish"))
+        .when(pl.Series(bullish))
+        .then(pl.lit("bullish"))
+        .alias("Breakout"),
+    )
+
+
+def breakouts(windows: pl.DataFrame) -> pl.DataFrame:
+    """The breakout stream, one event per window whose EMAs crossed, at the start of that window."""
+    return windows.filter(pl.col("Breakout").is_not_null()).select(
+        "ID", "window_start", "Breakout", "EMA38", "EMA100"
+    )
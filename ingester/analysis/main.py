@@ -1,28 +1,39 @@
-from io import StringIO
-from urllib.parse import urlencode
 import polars as pl
 import requests
 import typer
-import datetime
+import functools
 import pathlib
-from alive_progress import alive_bar
 import re
+import sys
+import time
+from collections.abc import Callable
+
+from engine import SCHEMA, breakouts, windows
+
+# The columnar store of the data files is shared with the ingester
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "ingester"))
+from influx import INFLUX_BUCKET, InfluxQueryClient  # noqa: E402
+from store import scan_day  # noqa: E402
+from utils import trading_date  # noqa: E402
 
 # Print all rows by default
 pl.Config.set_tbl_rows(-1)
 
 app = typer.Typer()
 
+DATA_DIR = "../../data"
+
+
+@functools.cache
+def influx() -> InfluxQueryClient:
+    """The client of the commands that query InfluxDB, created on first use."""
+    return InfluxQueryClient()
 
-def process_influx_data(csv_data: str) -> pl.DataFrame:
-    df = pl.read_csv(
-        StringIO(csv_data),
-        null_values=[""],
-    )
 
+def process_influx_data(df: pl.DataFrame) -> pl.DataFrame:
     df = df.select(
         [
-            pl.col("_time").cast(pl.Datetime).dt.time().alias("time"),
+            pl.col("_time").str.to_datetime(time_zone="UTC").dt.time().alias("time"),
             pl.col("_value").round(0).cast(pl.Int64).alias("value"),
             pl.col("_field").alias("field"),
         ]
@@ -38,69 +49,33 @@ def process_influx_data(csv_data: str) -> pl.DataFrame:
 
 
 def load_our_solution(entity: str, date: str):
-    query_api_url = "http://localhost:8086/api/v2/query"
-    headers = {
-        "Authorization": "Token token",
-        "Accept": "application/csv",
-        "Content-type": "application/vnd.flux",
-    }
-    params = {"org": "trading-org"}
     flux_query = (
-        'from(bucket: "trading_bucket")'
+        f'from(bucket: "{INFLUX_BUCKET}")'
         f'|> range(start: time(v: "{date}T00:00:00Z"), stop: time(v: "{date}T23:59:59Z")) '
         '|> filter(fn: (r) => r["_measurement"] == "trading_bucket")'
         '|> filter(fn: (r) => r["_field"] == "first" or r["_field"] == "last" or r["_field"] == "max" or r["_field"] == "min" or r["_field"] == "movements")'
         f'|> filter(fn: (r) => r["id"] == "{entity}")'
         '|> keep(columns: ["_time", "_value", "_field"])'
-        '|> drop(columns: ["result", "table", "_measurement", "equity_type", "id"])'
-        '|> yield(name: "last")'
     )
 
     try:
-        response = requests.post(
-            f"{query_api_url}?{urlencode(params)}", headers=headers, data=flux_query
-        )
-
-        if response.status_code != 200:
-            error_message = response.text
-            raise Exception(
-                f"InfluxDB Error (Status {response.status_code}): {error_message}"
-            )
-
-        # https://github.com/influxdata/influxdb/issues/6415
-        # Shit from Influx is fucked, why add a , to the first character in the line!
-        csv_data = [x.strip()[1:] for x in response.text.split("\n")]
-        csv_data = [
-            x for x in csv_data if x != "" and x != "result,table,_time,_value,_field"
-        ]
-        csv_data.insert(0, "table,trash,_time,_value,_field")
-        return process_influx_data("\n".join(csv_data))
-
+        return process_influx_data(influx().query(flux_query))
     except requests.exceptions.RequestException as e:
         raise Exception(f"Error querying InfluxDB: {str(e)}")
 
 
 def load_actual_solution(file: str, entity: str) -> pl.DataFrame:
     df = (
-        pl.scan_csv(
-            file,
-            separator=",",
-            comment_prefix="#",
+        scan_day(file, entity)
+        .sort("Row")
+        .select(
+            "ID",
+            "Last",
+            pl.from_epoch("Timestamp", time_unit="ms").alias("Trading time"),
         )
-        .select("ID", "Last", "Trading time")
-        .filter(pl.col("ID") == entity)
         .collect()
     )
-    df = df.drop_nulls()
-    # Sometimes, the data is messed up
-    df = df.with_columns([pl.col("Last").cast(pl.Float64)])
-    df = df.with_columns(
-        [
-            pl.col("Trading time")
-            .str.strptime(pl.Datetime, format="%H:%M:%S.%3f")
-            .alias("Trading time")
-        ]
-    )[1:]
+    df = df.drop_nulls()[1:]
     # First row is always midnight, also skip some invalid events
     # The consumer drops them
     df = df.with_columns(
@@ -138,106 +113,331 @@ def analytical(data_file: str, entity: str):
 
 @app.command()
 def compare(data_file: str, entity: str):
-    pattern = r".*debs\d{4}-gc-trading-day-(\d{2})-(\d{2})-(\d{2})\.csv"
-    re_match = re.search(pattern, data_file)
-    if not re_match:
-        raise ValueError(f"No date found in supplied data file {data_file}")
-    day, month, year = re_match.groups()
     print(f"Reading file {data_file}")
-    date_str = f"20{year}-{month}-{day}"  # Assuming 20xx for the year
-    dt = str(datetime.datetime.strptime(date_str, "%Y-%m-%d").date())
+    dt = str(trading_date(data_file))
     our = load_our_solution(entity, dt)
     actual = load_actual_solution(data_file, entity)
     actual = actual.drop("Last update")
-    # TODO: Empty windows
     print(f"Running comparison for {dt}")
-    difference = pl.DataFrame().with_columns(
-        [
-            pl.Series(name="Time", values=our["time"]),
-            pl.Series(name="First", values=our["first"] - actual["First"]),
-            pl.Series(name="Last", values=our["last"] - actual["Last"]),
-            pl.Series(name="Max", values=our["max"] - actual["Max"]),
-            pl.Series(name="Min", values=our["min"] - actual["Min"]),
-            # Movements is offset by 1 for the analytical solution for some reason
-            pl.Series(
-                name="Movements", values=our["movements"] - actual["Movements"] + 1
-            ),
-        ]
+    # Windows without events are missing on one side, so line them up by start time
+    joined = our.join(
+        actual, left_on="time", right_on="window_start", how="full", coalesce=True
     )
+    difference = joined.select(
+        pl.col("time").alias("Time"),
+        (pl.col("first") - pl.col("First")).alias("First"),
+        (pl.col("last") - pl.col("Last")).alias("Last"),
+        (pl.col("max") - pl.col("Max")).alias("Max"),
+        (pl.col("min") - pl.col("Min")).alias("Min"),
+        # Movements is offset by 1 for the analytical solution for some reason
+        (pl.col("movements") - pl.col("Movements") + 1).alias("Movements"),
+    ).sort("Time")
 
     print(difference)
 
 
+WINDOW_FIELDS = [
+    "First",
+    "Last",
+    "Max",
+    "Min",
+    "Movements",
+    "EMA38",
+    "EMA100",
+    "Breakout",
+]
+
+
+def load_ticks(files: list[str]) -> pl.LazyFrame:
+    """
+    The ticks of the data files grouped by ID, in the order one consumer receives them when
+    the files are ingested one after the other. Windows and EMAs carry over from one day to the next.
+    """
+    return (
+        pl.concat(
+            [
+                scan_day(file).with_columns(pl.lit(day, pl.UInt32).alias("Day"))
+                for day, file in enumerate(files)
+            ]
+        )
+        .sort("ID", "Day", "Row")
+        .select("ID", "SecType", "Last", "Timestamp")
+    )
+
+
+def _flux_range(files: list[str]) -> str:
+    dates = [str(trading_date(file)) for file in files]
+    return f'|> range(start: time(v: "{min(dates)}T00:00:00Z"), stop: time(v: "{max(dates)}T23:59:59Z")) '
+
+
+def load_consumer_windows(files: list[str]) -> pl.DataFrame:
+    """Every window and breakout the consumer wrote for the days of `files`, fetched in two streamed queries."""
+    windows_query = (
+        f'from(bucket: "{INFLUX_BUCKET}")'
+        + _flux_range(files)
+        + '|> filter(fn: (r) => r["_measurement"] == "trading_bucket")'
+        '|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")'
+        "|> group()"
+        '|> keep(columns: ["_time", "id", "first", "last", "max", "min", "movements", "calc_38", "calc_100"])'
+    )
+    breakouts_query = (
+        f'from(bucket: "{INFLUX_BUCKET}")'
+        + _flux_range(files)
+        + '|> filter(fn: (r) => r["_measurement"] == "breakout" and r["_field"] == "title")'
+        "|> group()"
+        '|> keep(columns: ["_time", "id", "tags"])'
+    )
+    schema = {name: dtype for name, dtype in SCHEMA.items() if name != "SecType"}
+    df = influx().query(windows_query, schema_overrides={"id": pl.String})
+    if df.is_empty():
+        return pl.DataFrame(schema=schema)
+    breakouts = influx().query(breakouts_query, schema_overrides={"id": pl.String})
+    if breakouts.is_empty():
+        breakouts = pl.DataFrame(
+            schema={"_time": pl.String, "id": pl.String, "tags": pl.String}
+        )
+    return (
+        df.join(breakouts, on=["_time", "id"], how="left")
+        .select(
+            pl.col("id").alias("ID"),
+            pl.col("_time").str.to_datetime(time_zone="UTC").alias("window_start"),
+            pl.col("first").alias("First"),
+            pl.col("last").alias("Last"),
+            pl.col("max").alias("Max"),
+            pl.col("min").alias("Min"),
+            pl.col("movements").alias("Movements"),
+            pl.col("calc_38").alias("EMA38"),
+            pl.col("calc_100").alias("EMA100"),
+            pl.col("tags").alias("Breakout"),
+        )
+        .cast(schema)
+    )
+
+
 @app.command()
-def print_event_count(limit: int = 10):
-    previous = None
-    paths = sorted(pathlib.Path("../../data").glob("*.csv"))
-    reversed(paths)
-    with alive_bar(len(paths)) as bar:
-        for path in sorted(pathlib.Path("../../data").glob("*.csv")):
-            counts = (
-                pl.scan_csv(path, separator=",", comment_prefix="#")
-                .select("ID")
-                .group_by("ID")
-                .len("Event Count")
-                .collect()
+def reference(
+    data_files: list[str],
+    output: str = "reference.parquet",
+    breakouts_only: bool = False,
+):
+    """
+    Runs the reference engine over the data files, ingested in the given order, and writes
+    the windows the consumer should produce, or only its breakouts, to a CSV or Parquet file.
+    """
+    start = time.time()
+    df = windows(load_ticks(data_files))
+    print(
+        f"{len(df)} windows and {df['Breakout'].is_not_null().sum()} breakouts "
+        f"in {round(time.time() - start, 2)} seconds"
+    )
+    if breakouts_only:
+        df = breakouts(df)
+    if output.endswith(".parquet"):
+        df.write_parquet(output)
+    else:
+        df.write_csv(output)
+    print(f"File written successfully as {output}")
+
+
+MISMATCH_FLAGS = [
+    "missing_in_reference",
+    "missing_in_consumer",
+    *[f"{field}_mismatch" for field in WINDOW_FIELDS],
+]
+
+
+def compare_windows(reference: pl.DataFrame, consumer: pl.DataFrame) -> pl.DataFrame:
+    """
+    Lines up the reference and consumer windows by ID and start, with a flag per field in
+    `MISMATCH_FLAGS` and `mismatch` set on every window that differs.
+    """
+    joined = reference.join(
+        consumer,
+        on=["ID", "window_start"],
+        how="full",
+        coalesce=True,
+        suffix="_consumer",
+    ).with_columns(
+        pl.col("First").is_null().alias("missing_in_reference"),
+        pl.col("First_consumer").is_null().alias("missing_in_consumer"),
+        *[
+            # The engine repeats the consumer's float operations, so the values match exactly
+            pl.col(field)
+            .ne_missing(pl.col(f"{field}_consumer"))
+            .and_(
+                pl.col("First").is_not_null() & pl.col("First_consumer").is_not_null()
             )
-            if previous is None:
-                previous = counts
-            else:
-                previous = previous.join(counts, on="ID").select(
-                    pl.col("ID"), pl.col("Event Count") + pl.col("Event Count_right")
-                )
-            bar()
-    if previous is not None:
-        print(previous.sort(by="Event Count", descending=True).head(limit))
-        print(f"Total events = {previous.sum()}")
+            .alias(f"{field}_mismatch")
+            for field in WINDOW_FIELDS
+        ],
+    )
+    return joined.with_columns(pl.any_horizontal(MISMATCH_FLAGS).alias("mismatch"))
 
 
 @app.command()
-def print_event_count_window(window: str = "5m", limit: int = 5):
-    previous = None
-    # For some reason, the data in the weekend files is messed up
-    paths = sorted(pathlib.Path("../../data").glob("*.csv"))[:5]
-    reversed(paths)
-    with alive_bar(len(paths)) as bar:
-        for path in paths:
-            df = (
-                pl.scan_csv(path, separator=",", comment_prefix="#")
-                .select("ID", "Trading time")
-                .collect()
-                .drop_nulls()
-            )
-            df = df.with_columns(
-                [
-                    pl.col("Trading time")
-                    .str.strptime(pl.Datetime, format="%H:%M:%S.%3f")
-                    .alias("Trading time")
-                ]
-            )[1:]
-
-            df = df.with_columns(
-                [
-                    pl.col("Trading time")
-                    .dt.truncate(window)
-                    .cast(pl.Time)
-                    .alias("window_start")
-                    .cast(pl.Time)
-                ]
+def verify(data_files: list[str], limit: int = 20, output: str | None = None):
+    """
+    Compares the windows, EMAs and breakouts of every ID in the data files, ingested in the given
+    order, with what the consumer wrote to InfluxDB and summarises the mismatches per field and per
+    ID. Exits with 1 if anything differs.
+    """
+    print(f"Computing reference windows of {', '.join(data_files)}")
+    reference = windows(load_ticks(data_files)).drop("SecType")
+    print("Fetching consumer windows")
+    consumer = load_consumer_windows(data_files)
+
+    joined = compare_windows(reference, consumer)
+    print(
+        f"Reference windows: {len(reference)}, consumer windows: {len(consumer)}, "
+        f"IDs: {joined['ID'].n_unique()}"
+    )
+    print(joined.select(pl.col(MISMATCH_FLAGS).sum()))
+    mismatches = joined.filter(pl.col("mismatch"))
+    if mismatches.is_empty():
+        print("All windows match")
+        return
+
+    per_id = (
+        mismatches.group_by("ID")
+        .agg(pl.len().alias("windows"), pl.col(MISMATCH_FLAGS).sum())
+        .sort("windows", descending=True)
+    )
+    print(f"{len(per_id)} IDs with mismatching windows, the worst {limit}:")
+    print(per_id.head(limit))
+    if output:
+        if output.endswith(".parquet"):
+            mismatches.write_parquet(output)
+        else:
+            mismatches.write_csv(output)
+        print(f"Mismatching windows written to {output}")
+    raise typer.Exit(1)
+
+
+def _cached(path: pathlib.Path, summary: str) -> pathlib.Path:
+    # A day is summarised again as soon as its file changes
+    stat = path.stat()
+    return (
+        path.parent
+        / ".cache"
+        / f"{path.stem}-{summary}-{stat.st_mtime_ns}-{stat.st_size}.parquet"
+    )
+
+
+def _day_event_counts(path: pathlib.Path) -> pl.LazyFrame:
+    return (
+        pl.scan_csv(path, separator=",", comment_prefix="#")
+        .select("ID")
+        .group_by("ID")
+        .len("Event Count")
+    )
+
+
+def _day_event_seconds(path: pathlib.Path) -> pl.LazyFrame:
+    return (
+        pl.scan_csv(path, separator=",", comment_prefix="#")
+        .select("ID", "Trading time")
+        .drop_nulls()
+        # First row is always midnight
+        .slice(1)
+        .select(
+            pl.col("Trading time")
+            .str.strptime(pl.Datetime, format="%H:%M:%S.%3f")
+            .dt.truncate("1s")
+            .alias("second")
+        )
+        .group_by("second")
+        .len("Events")
+    )
+
+
+def load_summaries(
+    paths: list[pathlib.Path],
+    summary: str,
+    summarise: Callable[[pathlib.Path], pl.LazyFrame],
+) -> pl.LazyFrame:
+    """
+    Union of the per-day summaries of `paths`, numbered by their `Day`. Days without a cached
+    summary are scanned in parallel and cached as Parquet in `.cache` next to the data files.
+    """
+    missing = [path for path in paths if not _cached(path, summary).exists()]
+    if missing:
+        print(f"Summarising {len(missing)} of {len(paths)} files")
+        for path, df in zip(
+            missing, pl.collect_all([summarise(path) for path in missing])
+        ):
+            cached = _cached(path, summary)
+            cached.parent.mkdir(exist_ok=True)
+            for stale in cached.parent.glob(f"{path.stem}-{summary}-*.parquet"):
+                stale.unlink()
+            df.write_parquet(cached)
+    return pl.concat(
+        [
+            pl.scan_parquet(_cached(path, summary)).with_columns(
+                pl.lit(day, pl.UInt32).alias("Day")
             )
-            df = df.group_by("window_start").len("Events in window")
-            if previous is None:
-                previous = df
-            else:
-                previous = previous.join(df, on="window_start").select(
-                    pl.col("window_start"),
-                    pl.col("Events in window") + pl.col("Events in window_right"),
-                )
-            bar()
-
-    if previous is not None:
-        print(previous.sort("Events in window", descending=True).head(limit))
-        print(previous.describe())
+            for day, path in enumerate(paths)
+        ]
+    )
+
+
+# Units of the Polars duration language, calendar units are whole seconds in any case
+DURATION_UNITS_NS = {"ns": 1, "us": 1_000, "ms": 1_000_000}
+DURATION = re.compile(r"(\d+)(ns|us|ms|mo|[smhdwqy])")
+
+
+def _whole_seconds(window: str) -> bool:
+    """Whether `window` is a Polars duration like 5m or 1500ms that spans whole seconds."""
+    parts = DURATION.findall(window)
+    if not parts or "".join(n + unit for n, unit in parts) != window:
+        return False
+    sub_second = sum(int(n) * DURATION_UNITS_NS.get(unit, 0) for n, unit in parts)
+    seconds = any(unit not in DURATION_UNITS_NS and int(n) for n, unit in parts)
+    return sub_second % 1_000_000_000 == 0 and (seconds or sub_second > 0)
+
+
+@app.command()
+def print_event_count(limit: int = 10, data_dir: str = DATA_DIR):
+    """Events per ID over the data files, of the IDs that have events on every day."""
+    paths = sorted(pathlib.Path(data_dir).glob("*.csv"))
+    counts = (
+        load_summaries(paths, "event-count", _day_event_counts)
+        .group_by("ID")
+        .agg(pl.col("Event Count").sum(), pl.len().alias("Days"))
+        .filter(pl.col("Days") == len(paths))
+        .drop("Days")
+        .collect()
+    )
+    print(counts.sort(by="Event Count", descending=True).head(limit))
+    print(f"Total events = {counts.sum()}")
+
+
+@app.command()
+def print_event_count_window(
+    window: str = "5m", limit: int = 5, data_dir: str = DATA_DIR
+):
+    """Events per window of the day over the data files, of the windows with events on every day."""
+    # Summaries count events per second, so any window of whole seconds is answered from them
+    if not _whole_seconds(window):
+        raise typer.BadParameter(
+            f"{window} is not a window of whole seconds, e.g. 1s, 90s or 5m"
+        )
+    # For some reason, the data in the weekend files is messed up
+    paths = sorted(pathlib.Path(data_dir).glob("*.csv"))[:5]
+    counts = (
+        load_summaries(paths, "event-seconds", _day_event_seconds)
+        .group_by(
+            pl.col("second").dt.truncate(window).cast(pl.Time).alias("window_start")
+        )
+        .agg(
+            pl.col("Events").sum().alias("Events in window"),
+            pl.col("Day").n_unique().alias("Days"),
+        )
+        .filter(pl.col("Days") == len(paths))
+        .drop("Days")
+        .collect()
+    )
+    print(counts.sort("Events in window", descending=True).head(limit))
+    print(counts.describe())
 
 
 if __name__ == "__main__":
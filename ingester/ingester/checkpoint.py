@@ -0,0 +1,172 @@
+import fcntl
+import json
+import os
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+
+import numpy as np
+import polars as pl
+
+from partitioner import id_hashes, stripe
+
+CHECKPOINT_FILE = ".ingest-checkpoint.json"
+
+
+@dataclass(frozen=True)
+class CheckpointConfig:
+    path: str = CHECKPOINT_FILE
+    # Seconds between two checkpoints of a worker
+    interval: float = 1.0
+    # Data file and partition a worker publishes, with the messages of every connection an
+    # interrupted run already sent
+    file: str = ""
+    partition: str = ""
+    sent: tuple[int, ...] = ()
+
+    def worker(
+        self, file: str, partition: str, sent: Sequence[int]
+    ) -> "CheckpointConfig":
+        return replace(self, file=file, partition=partition, sent=tuple(sent))
+
+
+class Checkpoint:
+    """
+    Progress of an `ingest` run in a small JSON file. For every data file it records whether
+    it was sent completely and, per partition and connection, how many messages were sent (acked
+    with JetStream, flushed or written to the socket with Core NATS) and the last acked stream sequence.
+    Workers of other processes update it side by side, every update holds a lock file.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_FILE):
+        self.path = path
+
+    @contextmanager
+    def _locked(self, fresh: bool = False) -> Iterator[dict]:
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = {} if fresh else self.load()
+            yield state
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(state, f, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+
+    def load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            if isinstance(state, dict):
+                return state
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            pass
+        raise ValueError(
+            f"{self.path} is not a checkpoint, start over without --resume"
+        )
+
+    def _update(self, change: Callable[[dict], None]):
+        with self._locked() as state:
+            change(state)
+
+    def start(self, run: dict, resume: bool):
+        """
+        Starts recording a run with the settings `run`. Resuming keeps the progress of the
+        interrupted run, which is only possible when it partitioned the data the same way.
+        Starting over overwrites the checkpoint, even one that cannot be read.
+        """
+        with self._locked(fresh=not resume) as state:
+            if state and state.get("run") != run:
+                raise ValueError(
+                    f"{self.path} was written by a run with other settings {state.get('run')}, "
+                    "resume with the same settings or start over without --resume"
+                )
+            state["run"] = run
+            state.setdefault("files", {})
+
+    def completed(self, file: str) -> bool:
+        return self.load().get("files", {}).get(_key(file), {}).get("done", False)
+
+    def sent(self, file: str, partition: str, connections: int) -> list[int]:
+        """Messages of every connection of `partition` that were already sent."""
+        state = self.load().get("files", {}).get(_key(file), {})
+        entry = state.get("partitions", {}).get(partition)
+        if entry is None:
+            return [0] * connections
+        return entry["sent"]
+
+    def record(
+        self,
+        file: str,
+        partition: str,
+        sent: list[int],
+        sequences: list[int | None],
+    ):
+        def change(state: dict):
+            partitions = (
+                state["files"]
+                .setdefault(_key(file), {"done": False})
+                .setdefault("partitions", {})
+            )
+            previous = partitions.get(partition, {}).get(
+                "sequences", [None] * len(sent)
+            )
+            partitions[partition] = {
+                "sent": sent,
+                # Nothing acked yet in this run, the sequence of the interrupted run still holds
+                "sequences": [
+                    new if new is not None else old
+                    for new, old in zip(sequences, previous)
+                ],
+            }
+
+        self._update(change)
+
+    def complete(self, file: str):
+        def change(state: dict):
+            state["files"][_key(file)] = {"done": True}
+
+        self._update(change)
+
+
+def _key(file: str) -> str:
+    return os.path.abspath(file)
+
+
+class SentRows:
+    """
+    Drops the messages of a partition that an interrupted run already sent, batch after batch.
+    Connections send the IDs of their stripe in order, so the first `sent[c]` messages of
+    stripe `c` are the ones to drop.
+    """
+
+    def __init__(self, sent: Sequence[int]):
+        self.remaining = np.array(sent, dtype=np.int64)
+
+    def mask(self, id_hash: np.ndarray) -> np.ndarray | None:
+        """Which of the next messages, given their ID hashes, are left to send, `None` for all."""
+        if not self.remaining.any():
+            return None
+        mask = np.ones(len(id_hash), dtype=bool)
+        if len(self.remaining) == 1:
+            skipped = min(int(self.remaining[0]), len(id_hash))
+            mask[:skipped] = False
+            self.remaining[0] -= skipped
+            return mask
+        stripes = stripe(id_hash, len(self.remaining))
+        for connection in np.flatnonzero(self.remaining):
+            skipped = np.flatnonzero(stripes == connection)[
+                : self.remaining[connection]
+            ]
+            mask[skipped] = False
+            self.remaining[connection] -= len(skipped)
+        return mask
+
+    def skip(self, df: pl.DataFrame) -> pl.DataFrame:
+        if len(self.remaining) == 1:
+            # Same as the mask without hashing the IDs
+            skipped = min(int(self.remaining[0]), len(df))
+            self.remaining[0] -= skipped
+            return df.slice(skipped)
+        mask = self.mask(id_hashes(df))
+        return df if mask is None else df.filter(pl.Series(mask))
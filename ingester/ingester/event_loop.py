@@ -0,0 +1,23 @@
+import asyncio
+from collections.abc import Coroutine
+from enum import Enum
+
+
+class EventLoop(Enum):
+    ASYNCIO = "asyncio"
+    UVLOOP = "uvloop"
+
+
+def run(main: Coroutine, event_loop: EventLoop = EventLoop.ASYNCIO):
+    """`asyncio.run` on the selected event loop implementation."""
+    if event_loop == EventLoop.UVLOOP:
+        try:
+            import uvloop
+        except ImportError as e:
+            main.close()
+            raise RuntimeError(
+                "uvloop is not installed, install the `uvloop` extra to use it"
+            ) from e
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            return runner.run(main)
+    return asyncio.run(main)
@@ -0,0 +1,112 @@
+from collections.abc import Iterator
+from io import BytesIO
+
+import polars as pl
+import requests
+
+INFLUX_URL = "http://localhost:8086"
+INFLUX_ORG = "trading-org"
+INFLUX_BUCKET = "trading_bucket"
+INFLUX_TOKEN = "token"
+
+# Columns every table of a Flux CSV result starts with
+ANNOTATION_COLUMNS = ["", "result", "table"]
+
+
+class InfluxQueryError(requests.HTTPError):
+    """InfluxDB answered a query with an error status, `response.text` holds its message."""
+
+
+class InfluxQueryClient:
+    """
+    Runs Flux queries over one pooled HTTP session and streams the CSV result as Polars frames
+    of about `batch_bytes` each, so a full day of results is never held as text in memory.
+    """
+
+    def __init__(
+        self,
+        url: str = INFLUX_URL,
+        org: str = INFLUX_ORG,
+        token: str = INFLUX_TOKEN,
+        batch_bytes: int = 16 << 20,
+        timeout: float = 300.0,
+    ):
+        self.url = f"{url}/api/v2/query"
+        self.org = org
+        self.batch_bytes = batch_bytes
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Authorization": f"Token {token}", "Accept": "application/csv"}
+        )
+
+    def _frame(
+        self, header: bytes, lines: list[bytes], schema_overrides: dict | None
+    ) -> pl.DataFrame:
+        df = pl.read_csv(
+            BytesIO(header + b"\n" + b"\n".join(lines)),
+            schema_overrides=schema_overrides,
+        )
+        return df.drop([c for c in ANNOTATION_COLUMNS if c in df.columns])
+
+    def query_batches(
+        self, flux: str, schema_overrides: dict | None = None
+    ) -> Iterator[pl.DataFrame]:
+        """
+        Yields the result of `flux` in frames as it arrives. Every table of the result repeats
+        its header and ends with an empty line, both are skipped like `#` annotation rows,
+        a frame never mixes tables with different columns.
+        """
+        response = self.session.post(
+            self.url,
+            params={"org": self.org},
+            json={"query": flux, "dialect": {"header": True, "annotations": []}},
+            stream=True,
+            timeout=self.timeout,
+        )
+        with response:
+            if response.status_code != 200:
+                raise InfluxQueryError(
+                    f"InfluxDB Error (Status {response.status_code}): {response.text}",
+                    response=response,
+                )
+            header = None
+            lines: list[bytes] = []
+            size = 0
+            rest = b""
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                chunk = rest + chunk
+                end = chunk.rfind(b"\n") + 1
+                rest = chunk[end:]
+                for line in chunk[:end].split(b"\n"):
+                    line = line.rstrip(b"\r")
+                    if not line or line.startswith(b"#"):
+                        continue
+                    if header is None or line.startswith(b",result,table,"):
+                        if line == header:
+                            continue
+                        if lines:
+                            yield self._frame(header, lines, schema_overrides)
+                            lines, size = [], 0
+                        header = line
+                        continue
+                    lines.append(line)
+                    size += len(line)
+                if size >= self.batch_bytes:
+                    yield self._frame(header, lines, schema_overrides)
+                    lines, size = [], 0
+            rest = rest.rstrip(b"\r")
+            if rest and not rest.startswith((b",result,table,", b"#")):
+                lines.append(rest)
+            if lines:
+                yield self._frame(header, lines, schema_overrides)
+
+    def query(self, flux: str, schema_overrides: dict | None = None) -> pl.DataFrame:
+        """The whole result of `flux` as one frame, empty when the query matched nothing."""
+        frames = list(self.query_batches(flux, schema_overrides))
+        if not frames:
+            return pl.DataFrame()
+        return pl.concat(frames, how="diagonal_relaxed")
+
+    def close(self):
+        self.session.close()
@@ -1,15 +1,40 @@
 import asyncio
 import time
 import gc
+import os
+import tempfile
+import json
+import pathlib
 from enum import Enum
 import concurrent.futures
-from concurrent.futures import ProcessPoolExecutor  # Change this import
+import multiprocessing
+import queue
+from collections import deque
+from collections.abc import Hashable, Iterable
+from contextlib import suppress
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
 
+import numpy as np
 import polars as pl
 from alive_progress import alive_bar
 import typer
 
-from utils import preprocess_csv_file
+from utils import (
+    encode_nats_messages,
+    message_timestamps,
+    read_csv_batches,
+    read_shared_frame,
+    share_frames,
+    shared_directory,
+    trading_date,
+)
+from partitioner import EXCHANGES, exchange_key, hash_key, id_hashes, split_frame
+from pacing import DUE_COLUMN, Timeline, scheduled_offsets
+from checkpoint import CHECKPOINT_FILE, Checkpoint, CheckpointConfig, SentRows
+from replay import REPLAY_SUFFIX, ReplayFile, compile_replay_file
+from store import convert_day, load_day
+from metrics import MetricsConfig, MetricsExport, collect_reports, merge_reports
 import producer
 
 
@@ -26,183 +51,839 @@ class Partition(Enum):
 
 app = typer.Typer(pretty_exceptions_enable=False)
 
+# Polars' thread pool deadlocks in forked children, workers now run Polars/NumPy code
+# https://docs.pola.rs/user-guide/misc/multiprocessing/
+mp_context = multiprocessing.get_context("spawn")
+
 
 def async_wrapped(
     mode: IngestionMode,
-    df: pl.DataFrame,
+    path: str,
     exchange: str,
-    flush_interval: int = 1000,
+    config: producer.PublishConfig = producer.PublishConfig(),
     show_progress_bar: bool = False,
 ):
+    # Partitions are handed over as memory-mapped Arrow files instead of pickled frames
+    df = read_shared_frame(path)
     if mode == IngestionMode.NATS_CORE:
-        asyncio.run(
-            producer.nats_core_ingest(df, exchange, flush_interval, show_progress_bar)
+        producer.run(
+            producer.nats_core_ingest(df, exchange, config, show_progress_bar),
+            config.event_loop,
         )
     elif mode == IngestionMode.JETSTREAM:
-        asyncio.run(
-            producer.jetstream_ingest(df, exchange, flush_interval, show_progress_bar)
+        producer.run(
+            producer.jetstream_ingest(df, exchange, config, show_progress_bar),
+            config.event_loop,
         )
     else:
         raise ValueError("Invalid ingestion mode specified")
 
 
-@app.command()
-def ingest(
+def replay_wrapped(
     mode: IngestionMode,
+    file: str,
     partition: Partition,
-    files: list[str],
-    entity: str | None = None,
-    consumer_count: int = 1,
+    key: str | int,
+    consumer_count: int,
+    exchange: str,
+    config: producer.PublishConfig = producer.PublishConfig(),
 ):
-    total_message_count = 0
+    # Each worker maps the replay file itself, nothing but the partition key is pickled
+    replay = ReplayFile(file)
+    rows = _unsent(
+        _replay_rows(replay, partition, key, consumer_count), replay.id_hash, config
+    )
+    if mode == IngestionMode.NATS_CORE:
+        producer.run(
+            producer.nats_core_publish(
+                replay.payloads,
+                replay.offsets,
+                exchange,
+                config,
+                rows=rows,
+                id_hash=replay.id_hash,
+            ),
+            config.event_loop,
+        )
+    elif mode == IngestionMode.JETSTREAM:
+        producer.run(
+            producer.jetstream_publish(
+                replay.payloads,
+                replay.offsets,
+                exchange,
+                config,
+                rows=rows,
+                id_hash=replay.id_hash,
+            ),
+            config.event_loop,
+        )
+    else:
+        raise ValueError("Invalid ingestion mode specified")
+
+
+def _replay_rows(
+    replay: ReplayFile, partition: Partition, key: str | int, consumer_count: int
+) -> np.ndarray:
+    if partition == Partition.EXCHANGE:
+        return replay.exchange_rows(str(key))
+    return replay.hash_rows(consumer_count, int(key))
+
+
+def _skipped_ms(parts: Iterable[pl.DataFrame]) -> int:
+    """Offset in the day of the first message left to send, parts of a day keep its order."""
+    return min((int(part[DUE_COLUMN][0]) for part in parts if len(part)), default=0)
+
 
+def _unsent(
+    rows: np.ndarray, id_hash: np.ndarray, config: producer.PublishConfig
+) -> np.ndarray:
+    if config.checkpoint is None:
+        return rows
+    mask = SentRows(config.checkpoint.sent).mask(id_hash[rows])
+    return rows if mask is None else rows[mask]
+
+
+async def _queued_batches(batches: multiprocessing.Queue):
+    loop = asyncio.get_running_loop()
+    # `None` marks the end of the stream
+    while (df := await loop.run_in_executor(None, batches.get)) is not None:
+        yield *encode_nats_messages(df), id_hashes(df), scheduled_offsets(df)
+
+
+def stream_wrapped(
+    mode: IngestionMode,
+    batches: multiprocessing.Queue,
+    exchange: str,
+    config: producer.PublishConfig = producer.PublishConfig(),
+):
     if mode == IngestionMode.NATS_CORE:
-        ingestion_method = producer.nats_core_ingest
+        producer.run(
+            producer.nats_core_publish_stream(
+                _queued_batches(batches), exchange, config
+            ),
+            config.event_loop,
+        )
+    elif mode == IngestionMode.JETSTREAM:
+        producer.run(
+            producer.jetstream_publish_stream(
+                _queued_batches(batches), exchange, config
+            ),
+            config.event_loop,
+        )
     else:
-        ingestion_method = producer.jetstream_ingest
+        raise ValueError("Invalid ingestion mode specified")
 
-    def single_consumer(file: str, entity: str | None, consumer_count: int | None = 1):
-        if consumer_count and consumer_count > 1:
-            df = preprocess_csv_file(file)
-            # Split dataframes by number of consumers
-            ingesters: dict[int, pl.DataFrame] = dict.fromkeys(
-                range(consumer_count), pl.DataFrame()
-            )
-            print(f"Pre processing into {consumer_count} partitions")
-            with alive_bar(total=consumer_count) as bar:
-                for i in range(consumer_count):
-                    ingesters[i] = df.filter(
-                        pl.col("ID").hash(42) % consumer_count == i
-                    )
-                    bar()
-            del df
-            gc.collect()
-
-            message_count = 0
-
-            start = time.time()
-            with ProcessPoolExecutor(max_workers=consumer_count) as executor:
-                futures = []
-                for id, df in list(ingesters.items()):
-                    print(f"Spawning task for {id} - ingesting {len(df)} events")
-                    message_count += len(df)
-                    future = executor.submit(async_wrapped, mode, df, "exchange")
-                    futures.append(future)
-                print(f"Sending {message_count} message")
-                with alive_bar(len(futures)) as bar:
-                    for f in concurrent.futures.as_completed(futures):
-                        _ = f.result()
-                        bar()
-
-            end = time.time()
-            time_taken = round(end - start, 2)
-            print(
-                f"Sent {message_count} messages took {time_taken} seconds, {round(message_count / time_taken, 2)} message/s"
-            )
-            nonlocal total_message_count
-            total_message_count += message_count
-            print(f"Total messages sent: {total_message_count}")
-        else:
-            print("Starting ingestion into NATS server")
-            df = preprocess_csv_file(file, entity=entity)
-            asyncio.run(ingestion_method(df, "exchange", 1000, show_progress_bar=True))
 
-    def exchange_consumer(file: str):
-        df = preprocess_csv_file(file)
-        exchanges = {}
+def route_batch(
+    df: pl.DataFrame, partition: Partition, consumer_count: int
+) -> dict[Hashable, pl.DataFrame]:
+    if partition == Partition.EXCHANGE:
+        return split_frame(df, exchange_key())
+    elif partition == Partition.MULTI or consumer_count > 1:
+        return split_frame(df, hash_key(consumer_count))
+    return {0: df}
+
+
+def _put(batches: multiprocessing.Queue, df: pl.DataFrame, worker):
+    # Blocks while the worker is behind, which is what bounds memory usage
+    while True:
+        try:
+            batches.put(df, timeout=1)
+            return
+        except queue.Full:
+            if not worker.is_alive():
+                raise RuntimeError(f"Streaming worker {worker.name} died")
+
+
+def partition_subjects(
+    partition: Partition, consumer_count: int, prefix: str = ""
+) -> dict[Hashable, str]:
+    """Subject of every partition, `prefix` separates days published side by side."""
+    if partition == Partition.EXCHANGE:
+        subjects = {id: f"exchange.{id}" for id in EXCHANGES}
+    elif partition == Partition.MULTI:
+        subjects = {i: f"exchange.{i}" for i in range(consumer_count)}
+    else:
+        subjects = {i: "exchange" for i in range(consumer_count)}
+    if prefix:
+        return {key: f"{prefix}.{subject}" for key, subject in subjects.items()}
+    return subjects
+
+
+@dataclass
+class PreparedDay:
+    """A day loaded, partitioned and written to shared memory, ready for the publishers."""
+
+    file: str
+    shared: tempfile.TemporaryDirectory
+    # Path of the shared frame and number of events per partition
+    partitions: dict[Hashable, tuple[str, int]]
+    subjects: dict[Hashable, str]
+    prefix: str
+    seconds: float
+    # Messages of every partition an interrupted run already sent
+    sent: dict[str, list[int]]
+    # Offset in the paced day of its first message left to send
+    skipped_ms: int = 0
+
+    @property
+    def message_count(self) -> int:
+        return sum(events for _, events in self.partitions.values())
+
+
+def prepare_day(
+    file: str,
+    partition: Partition,
+    consumer_count: int,
+    entity: str | None = None,
+    prefix: str = "",
+    sent: dict[str, list[int]] | None = None,
+    timeline: Timeline | None = None,
+) -> PreparedDay:
+    """
+    `sent` holds the messages of every partition an interrupted run already sent, they are dropped.
+    Paced replays schedule the whole day with `timeline` before it is partitioned.
+    """
+    start = time.time()
+    df = load_day(file, entity=entity)
+    if timeline:
+        df = timeline.schedule(df)
+    if partition == Partition.EXCHANGE:
         print("Splitting dataframe by exchange...")
-        exchanges["ETR"] = df.filter(pl.col("ID").str.ends_with("ETR"))
-        exchanges["FR"] = df.filter(pl.col("ID").str.ends_with("FR"))
-        exchanges["NL"] = df.filter(pl.col("ID").str.ends_with("NL"))
-        del df
-        gc.collect()
+        frames = split_frame(df, exchange_key(), EXCHANGES)
+    else:
+        # Split dataframes by number of consumers
+        print(f"Pre processing into {consumer_count} partitions")
+        frames = split_frame(df, hash_key(consumer_count), range(consumer_count))
+    del df
+    if sent:
+        frames = {key: SentRows(sent[str(key)]).skip(f) for key, f in frames.items()}
+    skipped_ms = _skipped_ms(frames.values()) if timeline else 0
+    shared = shared_directory()
+    partitions = share_frames(frames, shared.name)
+    del frames
+    gc.collect()
+    return PreparedDay(
+        file=file,
+        shared=shared,
+        partitions=partitions,
+        subjects=partition_subjects(partition, consumer_count, prefix),
+        prefix=prefix,
+        seconds=round(time.time() - start, 3),
+        sent=sent or {},
+        skipped_ms=skipped_ms,
+    )
+
+
+@app.command()
+def convert(files: list[str]):
+    """Converts CSV files to the typed Parquet store next to them, `ingest` reads it from then on."""
+    for file in files:
+        convert_day(file)
 
-        message_count = 0
+
+@app.command("compile")
+def compile_files(files: list[str], output_dir: str | None = None):
+    for file in files:
         start = time.time()
-        with ProcessPoolExecutor(max_workers=len(exchanges)) as executor:
-            futures = []
-            for id, df in list(exchanges.items()):
-                print(f"Spawning task for {id} - ingesting {len(df)} events")
-                message_count += len(df)
-                future = executor.submit(async_wrapped, mode, df, f"exchange.{id}")
-                futures.append(future)
-            print(f"Sending {message_count} message")
-            with alive_bar(len(futures)) as bar:
-                for f in concurrent.futures.as_completed(futures):
-                    _ = f.result()
-                    bar()
+        path = pathlib.Path(file)
+        if output_dir:
+            output = pathlib.Path(output_dir) / path.with_suffix(REPLAY_SUFFIX).name
+        else:
+            output = path.with_suffix(REPLAY_SUFFIX)
+        df = load_day(file)
+        size = compile_replay_file(df, str(output))
+        del df
+        gc.collect()
         end = time.time()
-        time_taken = round(end - start, 2)
+        print(
+            f"Compiled {file} into {output} ({round(size / 1_000_000, 2)} MB) in {round(end - start, 2)} seconds"
+        )
+
 
+@dataclass
+class IngestRun:
+    """Settings of an `ingest` run and the files it sent so far."""
+
+    mode: IngestionMode
+    partition: Partition
+    config: producer.PublishConfig
+    # Only recorded with --checkpoint or --resume
+    state: Checkpoint | None
+    # Workers leave their reports here, they are merged after every file
+    metrics_dir: str
+    consumer_count: int = 1
+    entity: str | None = None
+    preload_days: int = 0
+    parallel_days: int = 1
+    batch_size: int = 250_000
+    queue_depth: int = 4
+    resume: bool = False
+    message_count: int = 0
+    runs: list[dict] = field(default_factory=list)
+    worker_reports: list[dict] = field(default_factory=list)
+    unclaimed_reports: list[dict] = field(default_factory=list)
+    skipped_files: list[str] = field(default_factory=list)
+
+    def sent_total(self, file: str, message_count: int, start: float):
+        self.message_count += message_count
+        time_taken = round(time.time() - start, 2)
         print(
-            f"Sent {message_count} messages took {time_taken} seconds, {round(message_count / time_taken, 2)} message/s"
+            f"Sent {message_count} messages of {file} took {time_taken} seconds, {round(message_count / max(time_taken, 1e-9), 2)} message/s"
         )
+        print(f"Total messages sent: {self.message_count}")
 
-        nonlocal total_message_count
-        total_message_count += message_count
-        print(f"Total messages sent: {total_message_count}")
 
-    def multi_consumer(file: str, consumer_count: int):
-        df = preprocess_csv_file(file)
-        # Split dataframes by number of consumers
-        # Helping with typing issues
-        ingesters: dict[int, pl.DataFrame] = dict.fromkeys(
-            range(consumer_count), pl.DataFrame()
+def _completed(run: IngestRun, file: str) -> bool:
+    if run.resume and run.state.completed(file):
+        print(f"Skipping {file}, the interrupted run sent all of it")
+        run.skipped_files.append(file)
+        return True
+    return False
+
+
+def _sent(run: IngestRun, file: str, keys) -> dict[str, list[int]]:
+    """Messages of every partition of `file` that were already sent, none unless resuming."""
+    if not run.resume:
+        return {str(key): [0] * run.config.connections for key in keys}
+    counts = {
+        str(key): run.state.sent(file, str(key), run.config.connections) for key in keys
+    }
+    for key, sent_counts in counts.items():
+        if any(sent_counts):
+            print(
+                f"Resuming partition {key} of {file} after {sum(sent_counts)} messages"
+            )
+    return counts
+
+
+def _worker_config(
+    config: producer.PublishConfig, file: str, key: Hashable, sent_counts
+) -> producer.PublishConfig:
+    if config.checkpoint is None:
+        return config
+    return replace(
+        config, checkpoint=config.checkpoint.worker(file, str(key), sent_counts)
+    )
+
+
+def _load_next(
+    run: IngestRun, loader: ThreadPoolExecutor, pending: deque, loading: deque
+):
+    if not pending:
+        return
+    file = pending.popleft()
+    # Days published side by side go to distinct subjects, e.g. 2021-11-08.exchange.0
+    prefix = trading_date(file).isoformat() if run.parallel_days > 1 else ""
+    keys = partition_subjects(run.partition, run.consumer_count)
+    loading.append(
+        loader.submit(
+            prepare_day,
+            file,
+            run.partition,
+            run.consumer_count,
+            run.entity,
+            prefix,
+            _sent(run, file, keys),
+            run.config.timeline(),
         )
+    )
 
-        print(f"Pre processing into {consumer_count} partitions")
-        with alive_bar(total=consumer_count) as bar:
-            for i in range(consumer_count):
-                ingesters[i] = df.filter(pl.col("ID").hash(42) % consumer_count == i)
+
+def finish_day(run: IngestRun, day: PreparedDay, start: float):
+    """Releases a published day and records its run with the reports of its workers."""
+    day.shared.cleanup()
+    if run.state:
+        run.state.complete(day.file)
+    end = time.time()
+    run.sent_total(day.file, day.message_count, start)
+    run.unclaimed_reports.extend(collect_reports(run.metrics_dir))
+    reports = [
+        report
+        for report in run.unclaimed_reports
+        if report["subject"].startswith(day.prefix)
+    ]
+    for report in reports:
+        run.unclaimed_reports.remove(report)
+    run.worker_reports.extend(reports)
+    run.runs.append(
+        {
+            "file": day.file,
+            "messages": day.message_count,
+            "seconds": round(end - start, 3),
+            "load_seconds": day.seconds,
+            "report": merge_reports(reports),
+        }
+    )
+
+
+def publish_days(run: IngestRun, day_files: list[str]):
+    """
+    Publishes the partitioned days through one pool of workers. Up to `preload_days` days are
+    loaded and partitioned ahead while up to `parallel_days` days are published, so at most
+    `preload_days + parallel_days` days are held in memory.
+    """
+    subject_count = len(partition_subjects(run.partition, run.consumer_count))
+    pending = deque(file for file in day_files if not _completed(run, file))
+    loading = deque()
+    # File -> (publish start, unfinished futures, prepared day)
+    publishing = {}
+
+    with (
+        ThreadPoolExecutor(max_workers=1) as loader,
+        ProcessPoolExecutor(
+            max_workers=subject_count * run.parallel_days, mp_context=mp_context
+        ) as executor,
+        alive_bar(len(pending) * subject_count) as bar,
+    ):
+        for _ in range(run.parallel_days + run.preload_days):
+            _load_next(run, loader, pending, loading)
+        while loading or publishing:
+            while loading and len(publishing) < run.parallel_days:
+                day = loading.popleft().result()
+                print(
+                    f"Loaded {day.file} in {day.seconds} seconds, sending {day.message_count} messages"
+                )
+                # Paced replays share one wall clock start across all workers of a day
+                config = run.config.scheduled(skipped_ms=day.skipped_ms)
+                futures = set()
+                for id, (path, events) in day.partitions.items():
+                    print(f"Spawning task for {id} - ingesting {events} events")
+                    futures.add(
+                        executor.submit(
+                            async_wrapped,
+                            run.mode,
+                            path,
+                            day.subjects[id],
+                            _worker_config(
+                                config, day.file, id, day.sent.get(str(id), ())
+                            ),
+                        )
+                    )
+                publishing[day.file] = (time.time(), futures, day)
+
+            done, _ = concurrent.futures.wait(
+                [f for _, futures, _ in publishing.values() for f in futures],
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for f in done:
+                _ = f.result()
                 bar()
-        del df
-        gc.collect()
+            for file, (start, futures, day) in list(publishing.items()):
+                futures -= done
+                if not futures:
+                    del publishing[file]
+                    finish_day(run, day, start)
+                    # Only load another day once this one is out of memory
+                    _load_next(run, loader, pending, loading)
 
-        message_count = 0
 
-        start = time.time()
-        with ProcessPoolExecutor(max_workers=consumer_count) as executor:
-            futures = []
-            for id, df in list(ingesters.items()):
-                print(f"Spawning task for {id} - ingesting {len(df)} events")
-                message_count += len(df)
-                future = executor.submit(async_wrapped, mode, df, f"exchange.{id}")
-                futures.append(future)
-            print(f"Sending {message_count} message")
-            with alive_bar(len(futures)) as bar:
-                for f in concurrent.futures.as_completed(futures):
-                    _ = f.result()
-                    bar()
+def single_consumer(run: IngestRun, file: str):
+    print("Starting ingestion into NATS server")
+    start = time.time()
+    sent_counts = _sent(run, file, [0])["0"]
+    df = load_day(file, entity=run.entity)
+    if timeline := run.config.timeline():
+        df = timeline.schedule(df)
+    df = SentRows(sent_counts).skip(df)
+    config = run.config.scheduled(skipped_ms=_skipped_ms([df]) if timeline else 0)
+    if run.mode == IngestionMode.NATS_CORE:
+        ingestion_method = producer.nats_core_ingest
+    else:
+        ingestion_method = producer.jetstream_ingest
+    producer.run(
+        ingestion_method(
+            df,
+            "exchange",
+            _worker_config(config, file, 0, sent_counts),
+            show_progress_bar=True,
+        ),
+        config.event_loop,
+    )
+    run.sent_total(file, len(df), start)
 
-        end = time.time()
-        time_taken = round(end - start, 2)
-        print(
-            f"Sent {message_count} messages took {time_taken} seconds, {round(message_count / time_taken, 2)} message/s"
+
+def stream_consumer(run: IngestRun, file: str):
+    subjects = partition_subjects(run.partition, run.consumer_count)
+    sent_counts = _sent(run, file, subjects)
+    unsent = {key: SentRows(sent_counts[str(key)]) for key in subjects}
+
+    # Publishers start right away and consume batches while the file is still being parsed
+    queues = {key: mp_context.Queue(maxsize=run.queue_depth) for key in subjects}
+    config = run.config.scheduled()
+    workers = {
+        key: mp_context.Process(
+            target=stream_wrapped,
+            args=(
+                run.mode,
+                queues[key],
+                subject,
+                _worker_config(config, file, key, sent_counts[str(key)]),
+            ),
         )
-        nonlocal total_message_count
-        total_message_count += message_count
-        print(f"Total messages sent: {total_message_count}")
+        for key, subject in subjects.items()
+    }
+    print(f"Spawning {len(workers)} streaming tasks")
+    for worker in workers.values():
+        worker.start()
 
-    if consumer_count > 5504:
-        raise ValueError("consumer_count cannot exceed the number of exchanges (5504)")
-    # Run the async function
-    for file in files:
-        start = time.time()
-        if partition == Partition.SINGLE:
+    message_count = 0
+    # Paced streams schedule every batch before it is partitioned, the first message left to
+    # send is due at the start of the replay
+    timeline = run.config.timeline()
+    skipped_ms = None
+    start = time.time()
+    try:
+        with alive_bar() as bar:
+            for df in read_csv_batches(file, run.batch_size, run.entity):
+                if timeline:
+                    df = timeline.schedule(df)
+                parts = {
+                    key: unsent[key].skip(part)
+                    for key, part in route_batch(
+                        df, run.partition, run.consumer_count
+                    ).items()
+                }
+                if timeline and skipped_ms is None and any(map(len, parts.values())):
+                    skipped_ms = _skipped_ms(parts.values())
+                for key, part in parts.items():
+                    if part.is_empty():
+                        continue
+                    if skipped_ms:
+                        part = part.with_columns(pl.col(DUE_COLUMN) - skipped_ms)
+                    _put(queues[key], part, workers[key])
+                    message_count += len(part)
+                    bar(len(part))
+    finally:
+        for key, worker in workers.items():
+            # A worker can die while its queue is full, e.g. on Ctrl+C
+            with suppress(RuntimeError):
+                _put(queues[key], None, worker)
+        for key, worker in workers.items():
+            worker.join()
+            # Batches left for a worker that died would keep this process from exiting
+            queues[key].cancel_join_thread()
+    if any(worker.exitcode != 0 for worker in workers.values()):
+        raise RuntimeError("One or more streaming workers failed")
+    run.sent_total(file, message_count, start)
+
+
+def replay_consumer(run: IngestRun, file: str):
+    if run.entity:
+        raise ValueError("--entity cannot be used with pre-encoded replay files")
+    replay = ReplayFile(file)
+    print(
+        f"Replaying {replay.message_count} pre-encoded messages of {replay.date} from {file}"
+    )
+    start = time.time()
+    timeline = run.config.timeline()
+    if run.partition == Partition.SINGLE and run.consumer_count == 1:
+        sent_counts = _sent(run, file, [0])["0"]
+        rows = None
+        if any(sent_counts):
+            rows = _unsent(
+                np.arange(replay.message_count),
+                replay.id_hash,
+                _worker_config(run.config, file, 0, sent_counts),
+            )
+        due_ms = None
+        skipped_ms = 0
+        if timeline:
+            due_ms = timeline.offsets(
+                message_timestamps(replay.payloads, replay.offsets)
+            )
+            if rows is not None and len(rows):
+                skipped_ms = int(due_ms[rows[0]])
+        config = _worker_config(
+            run.config.scheduled(skipped_ms=skipped_ms), file, 0, sent_counts
+        )
+        if run.mode == IngestionMode.NATS_CORE:
+            publish_method = producer.nats_core_publish
+        else:
+            publish_method = producer.jetstream_publish
+        producer.run(
+            publish_method(
+                replay.payloads,
+                replay.offsets,
+                "exchange",
+                config,
+                True,
+                rows=rows,
+                id_hash=replay.id_hash,
+                due_ms=due_ms,
+            ),
+            config.event_loop,
+        )
+        run.sent_total(file, replay.message_count if rows is None else len(rows), start)
+        return
+
+    if run.partition == Partition.EXCHANGE:
+        counts = np.bincount(replay.exchange, minlength=len(EXCHANGES))
+        tasks = {
+            id: (int(counts[i]), f"exchange.{id}") for i, id in enumerate(EXCHANGES)
+        }
+    else:
+        counts = np.bincount(
+            (replay.id_hash % run.consumer_count).astype(np.int64),
+            minlength=run.consumer_count,
+        )
+        subject = "exchange" if run.partition == Partition.SINGLE else "exchange.{}"
+        tasks = {
+            i: (int(counts[i]), subject.format(i)) for i in range(run.consumer_count)
+        }
+    sent_counts = _sent(run, file, tasks)
+    skipped_ms = 0
+    if timeline and any(map(any, sent_counts.values())):
+        # Workers schedule the whole day too, before they select their rows
+        due_ms = timeline.offsets(message_timestamps(replay.payloads, replay.offsets))
+        firsts = []
+        for id in tasks:
+            rows = _unsent(
+                _replay_rows(replay, run.partition, id, run.consumer_count),
+                replay.id_hash,
+                _worker_config(run.config, file, id, sent_counts[str(id)]),
+            )
+            if len(rows):
+                firsts.append(int(due_ms[rows[0]]))
+        skipped_ms = min(firsts, default=0)
+    del replay
+
+    message_count = 0
+    # Paced replays share one wall clock start across all workers
+    config = run.config.scheduled(skipped_ms=skipped_ms)
+    with ProcessPoolExecutor(max_workers=len(tasks), mp_context=mp_context) as executor:
+        futures = []
+        for id, (count, subject) in tasks.items():
+            count -= sum(sent_counts[str(id)])
+            print(f"Spawning task for {id} - replaying {count} events")
+            message_count += count
+            future = executor.submit(
+                replay_wrapped,
+                run.mode,
+                file,
+                run.partition,
+                id,
+                run.consumer_count,
+                subject,
+                _worker_config(config, file, id, sent_counts[str(id)]),
+            )
+            futures.append(future)
+        print(f"Sending {message_count} message")
+        with alive_bar(len(futures)) as bar:
+            for f in concurrent.futures.as_completed(futures):
+                _ = f.result()
+                bar()
+    run.sent_total(file, message_count, start)
+
+
+def ingest_file(run: IngestRun, file: str, stream: bool = False):
+    """Publishes one file, pre-encoded replays and streamed CSV files included."""
+    if _completed(run, file):
+        return
+    start = time.time()
+    sent_before = run.message_count
+    if file.endswith(REPLAY_SUFFIX):
+        replay_consumer(run, file)
+    elif stream:
+        print(f"Streaming {file} to {run.partition.value} partitions")
+        stream_consumer(run, file)
+    elif run.partition == Partition.SINGLE and run.consumer_count == 1:
+        single_consumer(run, file)
+    else:
+        if run.partition == Partition.SINGLE:
             print(
-                f"Running against single consumer, {consumer_count} tasks will be spawned"
+                f"Running against single consumer, {run.consumer_count} tasks will be spawned"
             )
-            single_consumer(file, entity=entity, consumer_count=consumer_count)
-        elif partition == Partition.EXCHANGE:
+        elif run.partition == Partition.EXCHANGE:
             print("Running 3 producers, 3 tasks will be created: [ETR, FR, NL]")
-            exchange_consumer(file)
-        elif partition == Partition.MULTI:
-            print(f"Running as {consumer_count} ingesters")
-            multi_consumer(file, consumer_count)
         else:
-            raise ValueError("Invalid ingestion_mode")
-        end = time.time()
-        print(f"It took {round(end - start, 2)} seconds to process {file}")
+            print(f"Running as {run.consumer_count} ingesters")
+        # Records the run of the file itself
+        publish_days(run, [file])
+        print(f"It took {round(time.time() - start, 2)} seconds to process {file}")
+        return
+    end = time.time()
+    if run.state:
+        run.state.complete(file)
+    print(f"It took {round(end - start, 2)} seconds to process {file}")
+    reports = collect_reports(run.metrics_dir)
+    run.worker_reports.extend(reports)
+    run.runs.append(
+        {
+            "file": file,
+            "messages": run.message_count - sent_before,
+            "seconds": round(end - start, 3),
+            "report": merge_reports(reports),
+        }
+    )
+
+
+@app.command()
+def ingest(
+    mode: IngestionMode,
+    partition: Partition,
+    files: list[str],
+    entity: str | None = None,
+    consumer_count: int = 1,
+    stream: bool = False,
+    preload_days: int = 0,
+    parallel_days: int = 1,
+    batch_size: int = 250_000,
+    queue_depth: int = 4,
+    speed: str = "max",
+    slice_ms: int = 10,
+    max_gap_ms: int = 1_000,
+    window: int = 1000,
+    batch_messages: int = 1,
+    batch_bytes: int = 1 << 20,
+    connections: int = 1,
+    pending_size: int = 2 << 20,
+    stamp_every: int = 0,
+    event_loop: producer.EventLoop = producer.EventLoop.ASYNCIO,
+    adaptive: producer.AdaptiveTarget = producer.AdaptiveTarget.NONE,
+    target_latency_ms: float = 5.0,
+    target_throughput: float = 0.0,
+    summary: str | None = None,
+    metrics: MetricsExport = MetricsExport.NONE,
+    metrics_interval: float = 1.0,
+    metrics_dir: str | None = None,
+    resume: bool = False,
+    checkpoint: str | None = None,
+    checkpoint_interval: float = 1.0,
+):
+    # Resuming reads the checkpoint of the interrupted run and keeps recording to it
+    if resume and checkpoint is None:
+        checkpoint = CHECKPOINT_FILE
+    if consumer_count > 5504:
+        raise ValueError("consumer_count cannot exceed the number of exchanges (5504)")
+    if preload_days < 0 or parallel_days < 1:
+        raise ValueError("--preload-days must be >= 0 and --parallel-days >= 1")
+    pipelined = preload_days > 0 or parallel_days > 1
+    if pipelined and (stream or any(f.endswith(REPLAY_SUFFIX) for f in files)):
+        raise ValueError(
+            "--preload-days and --parallel-days only apply to data files without --stream"
+        )
+
+    # Workers leave their reports in the metrics directory, they are merged after every file
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        reports_directory = None
+    else:
+        reports_directory = tempfile.TemporaryDirectory(prefix="ingester-metrics-")
+        metrics_dir = reports_directory.name
+    metrics_config = MetricsConfig(
+        run=f"{mode.value}-{partition.value}-{int(time.time())}",
+        directory=metrics_dir,
+        export=metrics,
+        interval=metrics_interval,
+    )
+    # "max" publishes as fast as possible, a number replays at that multiple of trading time
+    config = producer.PublishConfig(
+        window=window,
+        batch_messages=batch_messages,
+        batch_bytes=batch_bytes,
+        connections=connections,
+        pending_size=pending_size,
+        stamp_every=stamp_every,
+        event_loop=event_loop,
+        metrics=metrics_config,
+        speed=None if speed == "max" else float(speed),
+        slice_ms=slice_ms,
+        # 0 keeps the idle periods of the trading data
+        max_gap_ms=max_gap_ms or None,
+        checkpoint=CheckpointConfig(checkpoint, checkpoint_interval)
+        if checkpoint
+        else None,
+        adaptive=adaptive,
+        target_latency_ms=target_latency_ms,
+        target_throughput=target_throughput,
+    )
+    run = IngestRun(
+        mode=mode,
+        partition=partition,
+        config=config,
+        state=Checkpoint(checkpoint) if checkpoint else None,
+        metrics_dir=metrics_dir,
+        consumer_count=consumer_count,
+        entity=entity,
+        preload_days=preload_days,
+        parallel_days=parallel_days,
+        batch_size=batch_size,
+        queue_depth=queue_depth,
+        resume=resume,
+    )
+
+    if run.state:
+        # Resuming only works with partitions holding the same messages in the same order
+        run.state.start(
+            {
+                "mode": mode.value,
+                "partition": partition.value,
+                "consumer_count": consumer_count,
+                "connections": connections,
+                "entity": entity,
+                "parallel_days": parallel_days,
+            },
+            resume,
+        )
+    run_start = time.time()
+    if pipelined:
+        print(
+            f"Publishing {parallel_days} day(s) at once, preloading {preload_days} day(s) ahead"
+        )
+        publish_days(run, files)
+    else:
+        for file in files:
+            ingest_file(run, file, stream)
+    # Loading overlaps publishing when pipelined, so the run takes less than its files together
+    run_seconds = time.time() - run_start
+
+    run_summary = {
+        "mode": mode.value,
+        "partition": partition.value,
+        "consumer_count": consumer_count,
+        "event_loop": event_loop.value,
+        "stream": stream,
+        "speed": speed,
+        "max_gap_ms": max_gap_ms,
+        "adaptive": adaptive.value,
+        "target_latency_ms": target_latency_ms,
+        "target_throughput": target_throughput,
+        "preload_days": preload_days,
+        "parallel_days": parallel_days,
+        "resume": resume,
+        "skipped_files": run.skipped_files,
+        "messages": run.message_count,
+        "seconds": round(run_seconds, 3),
+        "run": metrics_config.run,
+        "files": run.runs,
+        "report": merge_reports(
+            run.worker_reports,
+            # Days published side by side overlap
+            sum(file_run["report"]["seconds"] for file_run in run.runs)
+            if parallel_days == 1
+            else run_seconds,
+        ),
+    }
+    run_summary["messages_per_second"] = round(
+        run_summary["messages"] / max(run_summary["seconds"], 1e-9), 2
+    )
+    print(
+        f"Run summary: {run_summary['messages']} messages in {run_summary['seconds']} seconds "
+        f"({run_summary['messages_per_second']} message/s) on the {event_loop.value} event loop"
+    )
+    report = run_summary["report"]
+    print(
+        f"Publishers: {report['messages_per_second']} message/s, "
+        f"{round(report['bytes_per_second'] / 1_000_000, 2)} MB/s, "
+        f"flush p99 {report['flush_latency']['p99_ms']} ms, "
+        f"ack p99 {report['ack_latency']['p99_ms']} ms, {report['retries']} retries"
+    )
+    if summary:
+        with open(summary, "w") as f:
+            json.dump(run_summary, f, indent=2)
+    if reports_directory:
+        reports_directory.cleanup()
 
 
 if __name__ == "__main__":
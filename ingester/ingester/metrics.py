@@ -0,0 +1,354 @@
+import asyncio
+import glob
+import json
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+
+import requests
+
+from influx import INFLUX_BUCKET, INFLUX_ORG, INFLUX_TOKEN, INFLUX_URL
+
+BUCKET_COUNT = 32
+
+INFLUX_WRITE_URL = f"{INFLUX_URL}/api/v2/write"
+INFLUX_MEASUREMENT = "ingestion"
+
+
+class LatencyHistogram:
+    """
+    Latency histogram with power of two microsecond buckets, bucket `i` holds samples
+    in [2^(i - 1), 2^i) µs. Memory use is constant no matter how many samples are recorded.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        bucket = min(int(seconds * 1_000_000).bit_length(), BUCKET_COUNT - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "LatencyHistogram"):
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p: float) -> float:
+        """Upper bound in seconds of the bucket holding the `p`th percentile."""
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min((1 << i) / 1_000_000, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": self.buckets,
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "LatencyHistogram":
+        histogram = cls()
+        histogram.buckets = list(values["buckets"])
+        histogram.count = values["count"]
+        histogram.total = values["total"]
+        histogram.max = values["max"]
+        return histogram
+
+    def prometheus(self, name: str, labels: str) -> list[str]:
+        lines = [f"# TYPE {name} histogram"]
+        seen = 0
+        for i, n in enumerate(self.buckets[:-1]):
+            seen += n
+            lines.append(
+                f'{name}_bucket{{{labels},le="{(1 << i) / 1_000_000}"}} {seen}'
+            )
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+    def summary(self) -> str:
+        if self.count == 0:
+            return "no samples"
+        return (
+            f"avg={self.total / self.count * 1000:.2f} ms, "
+            f"p50<={self.percentile(50) * 1000:.2f} ms, "
+            f"p99<={self.percentile(99) * 1000:.2f} ms, "
+            f"max={self.max * 1000:.2f} ms"
+        )
+
+
+class PublisherMetrics:
+    """Counters of one publisher, updated as messages are sent or acknowledged."""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.retries = 0
+        self.flush_latency = LatencyHistogram()
+        self.ack_latency = LatencyHistogram()
+        # Summaries of the sizes adapted while publishing, one per connection
+        self.tuning: list[dict] = []
+
+    def sent(self, messages: int, size: int):
+        self.messages += messages
+        self.bytes += size
+
+    @classmethod
+    def merged(cls, parts: list["PublisherMetrics"]) -> "PublisherMetrics":
+        metrics = cls()
+        for part in parts:
+            metrics.sent(part.messages, part.bytes)
+            metrics.retries += part.retries
+            metrics.flush_latency.merge(part.flush_latency)
+            metrics.ack_latency.merge(part.ack_latency)
+            metrics.tuning += part.tuning
+        return metrics
+
+
+class MetricsExport(Enum):
+    NONE = "none"
+    INFLUX = "influx"
+    PROMETHEUS = "prometheus"
+
+
+@dataclass(frozen=True)
+class MetricsConfig:
+    # Tag shared by every point of one `ingest` run
+    run: str
+    # Workers write their final report here, and their Prometheus text files when exporting to Prometheus
+    directory: str
+    export: MetricsExport = MetricsExport.NONE
+    interval: float = 1.0
+
+
+class MetricsExporter:
+    """
+    Exports the metrics of one worker every `config.interval` seconds while it publishes,
+    as InfluxDB line protocol into `trading_bucket` or as a Prometheus text file in `config.directory`.
+    `stop` exports one last time and writes the worker report that `collect_reports` picks up.
+    """
+
+    def __init__(
+        self,
+        config: MetricsConfig,
+        subject: str,
+        source: Callable[[], PublisherMetrics],
+        total: int | None = None,
+    ):
+        self.config = config
+        self.subject = subject
+        self.worker = f"{subject}-{os.getpid()}"
+        self.source = source
+        self.total = total
+        self.start = time.time()
+        self._last = (self.start, 0, 0)
+        self._task: asyncio.Task | None = None
+        self._influx_failed = False
+        # Exports write off the event loop, one at a time and in order, so a write still
+        # running when `stop` cancels the exporting task finishes before the last one
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="metrics")
+
+    def start_exporting(self):
+        if self.config.export != MetricsExport.NONE:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.config.interval)
+            await self.export()
+
+    def _rates(self, now: float, metrics: PublisherMetrics) -> tuple[float, float]:
+        last_time, last_messages, last_bytes = self._last
+        elapsed = max(now - last_time, 1e-9)
+        self._last = (now, metrics.messages, metrics.bytes)
+        return (
+            (metrics.messages - last_messages) / elapsed,
+            (metrics.bytes - last_bytes) / elapsed,
+        )
+
+    def _line_protocol(self, now: float, metrics: PublisherMetrics) -> str:
+        messages_per_second, bytes_per_second = self._rates(now, metrics)
+        fields = {
+            "messages": f"{metrics.messages}i",
+            "bytes": f"{metrics.bytes}i",
+            "messages_per_second": messages_per_second,
+            "bytes_per_second": bytes_per_second,
+            "retries": f"{metrics.retries}i",
+            "flush_p50": metrics.flush_latency.percentile(50),
+            "flush_p99": metrics.flush_latency.percentile(99),
+            "ack_p50": metrics.ack_latency.percentile(50),
+            "ack_p99": metrics.ack_latency.percentile(99),
+        }
+        if self.total:
+            fields["progress"] = metrics.messages / self.total
+        tags = f"run={self.config.run},subject={self.subject},worker={self.worker}"
+        values = ",".join(f"{key}={value}" for key, value in fields.items())
+        return f"{INFLUX_MEASUREMENT},{tags} {values} {int(now * 1000)}"
+
+    def _prometheus(self, now: float, metrics: PublisherMetrics) -> str:
+        messages_per_second, bytes_per_second = self._rates(now, metrics)
+        labels = (
+            f'run="{self.config.run}",subject="{self.subject}",worker="{self.worker}"'
+        )
+        lines = [
+            "# TYPE ingester_messages_total counter",
+            f"ingester_messages_total{{{labels}}} {metrics.messages}",
+            "# TYPE ingester_bytes_total counter",
+            f"ingester_bytes_total{{{labels}}} {metrics.bytes}",
+            "# TYPE ingester_retries_total counter",
+            f"ingester_retries_total{{{labels}}} {metrics.retries}",
+            "# TYPE ingester_messages_per_second gauge",
+            f"ingester_messages_per_second{{{labels}}} {messages_per_second}",
+            "# TYPE ingester_bytes_per_second gauge",
+            f"ingester_bytes_per_second{{{labels}}} {bytes_per_second}",
+        ]
+        if self.total:
+            lines += [
+                "# TYPE ingester_progress_ratio gauge",
+                f"ingester_progress_ratio{{{labels}}} {metrics.messages / self.total}",
+            ]
+        lines += metrics.flush_latency.prometheus(
+            "ingester_flush_duration_seconds", labels
+        )
+        lines += metrics.ack_latency.prometheus("ingester_ack_latency_seconds", labels)
+        return "\n".join(lines) + "\n"
+
+    def _write_influx(self, line: str):
+        if self._influx_failed:
+            return
+        try:
+            response = requests.post(
+                INFLUX_WRITE_URL,
+                params={"org": INFLUX_ORG, "bucket": INFLUX_BUCKET, "precision": "ms"},
+                headers={"Authorization": f"Token {INFLUX_TOKEN}"},
+                data=line,
+                timeout=5,
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            # Metrics are best effort, the run goes on without them
+            self._influx_failed = True
+            print(f"Could not export metrics to InfluxDB, giving up: {e}")
+
+    def _write_prometheus(self, text: str):
+        path = os.path.join(self.config.directory, f"{self.worker}.prom")
+        with open(path + ".tmp", "w") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+    async def _write(self, write: Callable[[str], None], text: str):
+        await asyncio.get_running_loop().run_in_executor(self._writer, write, text)
+
+    async def export(self):
+        now = time.time()
+        metrics = self.source()
+        if self.config.export == MetricsExport.INFLUX:
+            line = self._line_protocol(now, metrics)
+            await self._write(self._write_influx, line)
+        elif self.config.export == MetricsExport.PROMETHEUS:
+            await self._write(self._write_prometheus, self._prometheus(now, metrics))
+
+    def report(self) -> dict:
+        metrics = self.source()
+        seconds = max(time.time() - self.start, 1e-9)
+        return {
+            "subject": self.subject,
+            "worker": self.worker,
+            "total": self.total,
+            "messages": metrics.messages,
+            "bytes": metrics.bytes,
+            "retries": metrics.retries,
+            "seconds": round(seconds, 3),
+            "messages_per_second": round(metrics.messages / seconds, 2),
+            "bytes_per_second": round(metrics.bytes / seconds, 2),
+            "flush_latency": metrics.flush_latency.to_dict(),
+            "ack_latency": metrics.ack_latency.to_dict(),
+            "tuning": metrics.tuning,
+        }
+
+    def _write_report(self, report: str):
+        path = os.path.join(self.config.directory, f"{self.worker}.json")
+        with open(path, "w") as f:
+            f.write(report)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await self.export()
+        await self._write(self._write_report, json.dumps(self.report()))
+        self._writer.shutdown(wait=False)
+
+
+def collect_reports(directory: str) -> list[dict]:
+    """Reads and removes the worker reports written to `directory` since the last call."""
+    reports = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as f:
+            reports.append(json.load(f))
+        os.remove(path)
+    return reports
+
+
+def _latency_summary(histogram: LatencyHistogram) -> dict:
+    return {
+        "count": histogram.count,
+        "p50_ms": round(histogram.percentile(50) * 1000, 3),
+        "p99_ms": round(histogram.percentile(99) * 1000, 3),
+        "max_ms": round(histogram.max * 1000, 3),
+    }
+
+
+def merge_reports(reports: list[dict], seconds: float | None = None) -> dict:
+    """
+    Combines worker reports into one. Rates are over `seconds`, by default the duration of
+    the slowest worker, which is right for workers that ran side by side.
+    """
+    flush_latency = LatencyHistogram()
+    ack_latency = LatencyHistogram()
+    for report in reports:
+        flush_latency.merge(LatencyHistogram.from_dict(report["flush_latency"]))
+        ack_latency.merge(LatencyHistogram.from_dict(report["ack_latency"]))
+    messages = sum(report["messages"] for report in reports)
+    size = sum(report["bytes"] for report in reports)
+    if seconds is None:
+        seconds = max((report["seconds"] for report in reports), default=0)
+    return {
+        "workers": len(reports),
+        "messages": messages,
+        "bytes": size,
+        "retries": sum(report["retries"] for report in reports),
+        "seconds": round(seconds, 3),
+        "messages_per_second": round(messages / max(seconds, 1e-9), 2),
+        "bytes_per_second": round(size / max(seconds, 1e-9), 2),
+        "flush_latency": _latency_summary(flush_latency),
+        "ack_latency": _latency_summary(ack_latency),
+        "partitions": {
+            report["worker"]: {
+                "messages": report["messages"],
+                "total": report["total"],
+                "messages_per_second": report["messages_per_second"],
+                "tuning": report.get("tuning", []),
+            }
+            for report in reports
+        },
+    }
@@ -0,0 +1,128 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+
+import numpy as np
+import polars as pl
+
+from utils import frame_timestamps
+
+# How long before a slice is due the scheduler stops sleeping and starts polling the loop clock
+SPIN_SECONDS = 0.002
+# Column of a frame holding the milliseconds after the start of its day a row is due at
+DUE_COLUMN = "Due"
+
+
+class Timeline:
+    """
+    Maps the trading timestamps of a day to the milliseconds after its first message at which they
+    are due. Idle periods longer than `max_gap_ms` (e.g. the night before the market opens at 09:00)
+    are shortened to `max_gap_ms`.
+
+    A timeline has to see every message of the day in order, before the day is partitioned or
+    striped, so that all workers release the same trading timestamp at the same wall clock offset.
+    It carries over between calls to `offsets`, for days read in batches.
+    """
+
+    def __init__(self, max_gap_ms: int | None = None):
+        self.max_gap_ms = max_gap_ms
+        self._last_timestamp: int | None = None
+        self._elapsed_ms = 0
+
+    def offsets(self, timestamps: np.ndarray) -> np.ndarray:
+        """Milliseconds after the start of the day at which each message is due."""
+        if self._last_timestamp is None:
+            valid = timestamps[timestamps >= 0]
+            self._last_timestamp = int(valid[0]) if len(valid) else 0
+        # Missing or out of order timestamps are sent together with the message before them
+        timestamps = np.maximum.accumulate(np.maximum(timestamps, self._last_timestamp))
+        gaps = np.diff(timestamps, prepend=self._last_timestamp)
+        if self.max_gap_ms is not None:
+            gaps = np.minimum(gaps, self.max_gap_ms)
+        elapsed_ms = self._elapsed_ms + np.cumsum(gaps, dtype=np.int64)
+        if len(timestamps):
+            self._last_timestamp = int(timestamps[-1])
+            self._elapsed_ms = int(elapsed_ms[-1])
+        return elapsed_ms
+
+    def schedule(self, df: pl.DataFrame) -> pl.DataFrame:
+        """Adds the offset of every row as `DUE_COLUMN`, partitions of the frame keep it."""
+        timestamps = frame_timestamps(df).fill_null(-1).to_numpy()
+        return df.with_columns(pl.Series(DUE_COLUMN, self.offsets(timestamps)))
+
+
+def scheduled_offsets(df: pl.DataFrame) -> np.ndarray | None:
+    """Offsets a `Timeline` added to the frame, `None` when it was not scheduled."""
+    if DUE_COLUMN not in df.columns:
+        return None
+    return df[DUE_COLUMN].to_numpy()
+
+
+class Pacer:
+    """
+    Releases messages at the wall clock time given by their offset in the day (see `Timeline`),
+    divided by `speed`.
+
+    Messages are released in batches, one per `slice_ms` of wall clock time. Workers given the same
+    `start_time` (unix time) share the same wall clock origin, the offsets of a day are the same
+    for all of them.
+    """
+
+    def __init__(
+        self,
+        speed: float,
+        slice_ms: int = 10,
+        start_time: float | None = None,
+    ):
+        if speed <= 0:
+            raise ValueError("Replay speed must be positive")
+        self.speed = speed
+        self.slice_seconds = slice_ms / 1000
+        self.start_time = start_time
+        self._origin: float | None = None
+        self._next_report = 0.0
+        self.lags: list[float] = []
+
+    async def _sleep_until(self, deadline: float):
+        loop = asyncio.get_running_loop()
+        remaining = deadline - loop.time()
+        if remaining > SPIN_SECONDS:
+            await asyncio.sleep(remaining - SPIN_SECONDS)
+        # asyncio.sleep overshoots by up to a scheduler tick, finish by yielding to the loop
+        while loop.time() < deadline:
+            await asyncio.sleep(0)
+
+    async def run(
+        self, offsets_ms: np.ndarray, send: Callable[[slice], Awaitable[None]]
+    ):
+        """Calls `send` with the positions of the messages due in every slice, when it is due."""
+        loop = asyncio.get_running_loop()
+        if self._origin is None:
+            self._origin = loop.time()
+            if self.start_time is not None:
+                self._origin += self.start_time - time.time()
+            self._next_report = self._origin + 10
+        due = offsets_ms / 1000 / self.speed
+        slices = np.floor(due / self.slice_seconds).astype(np.int64)
+        bounds = np.flatnonzero(np.diff(slices)) + 1
+        starts = np.concatenate(([0], bounds)).tolist() if len(slices) else []
+        ends = np.concatenate((bounds, [len(slices)])).tolist() if len(slices) else []
+
+        for start, end in zip(starts, ends):
+            deadline = self._origin + slices[start] * self.slice_seconds
+            await self._sleep_until(deadline)
+            self.lags.append(loop.time() - deadline)
+            await send(slice(start, end))
+            if loop.time() >= self._next_report:
+                self._next_report = loop.time() + 10
+                print(f"Replay is {round(self.lags[-1] * 1000, 2)} ms behind schedule")
+
+    def report(self) -> str:
+        if not self.lags:
+            return "No messages were paced"
+        lags = np.array(self.lags) * 1000
+        return (
+            f"Paced {len(lags)} slices at {self.speed}x: "
+            f"lag p50={np.percentile(lags, 50):.2f} ms, p99={np.percentile(lags, 99):.2f} ms, "
+            f"max={lags.max():.2f} ms, final={lags[-1]:.2f} ms"
+        )
@@ -0,0 +1,74 @@
+from collections.abc import Callable, Hashable, Iterable
+
+import numpy as np
+import polars as pl
+
+# Seed used for hash partitioning, consumers and replay files rely on it staying the same
+HASH_SEED = 42
+EXCHANGES = ["ETR", "FR", "NL"]
+
+KEY_COLUMN = "__partition"
+
+# Either an expression evaluated against the frame or a function computing the key column
+PartitionKey = pl.Expr | Callable[[pl.DataFrame], pl.Series]
+
+
+def hash_key(consumer_count: int) -> pl.Expr:
+    return pl.col("ID").hash(HASH_SEED) % consumer_count
+
+
+def exchange_key() -> pl.Expr:
+    # IDs that do not belong to any known exchange get a null key and are dropped
+    key = pl.lit(None, dtype=pl.String)
+    for exchange in reversed(EXCHANGES):
+        key = (
+            pl.when(pl.col("ID").str.ends_with(exchange))
+            .then(pl.lit(exchange))
+            .otherwise(key)
+        )
+    return key
+
+
+def id_hashes(df: pl.DataFrame) -> np.ndarray:
+    """Same hash as `hash_key` and `ReplayFile.id_hash`, one value per row."""
+    return df["ID"].hash(HASH_SEED).to_numpy()
+
+
+def hash_probe() -> int:
+    """
+    Hash of a known ID. Polars does not promise stable hashes across versions, hashes stored
+    with a different probe route IDs to other partitions than this version does.
+    """
+    return int(id_hashes(pl.DataFrame({"ID": ["ALE.FR"]}))[0])
+
+
+def stripe(id_hash: np.ndarray, count: int) -> np.ndarray:
+    """
+    Assigns every ID to one of `count` connections of a worker. Takes the high bits of a
+    multiplicative hash, so stripes stay balanced within a hash partition (`id_hash % consumer_count`).
+    """
+    mixed = (id_hash.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+    return (mixed % np.uint64(count)).astype(np.int64)
+
+
+def split_frame(
+    df: pl.DataFrame,
+    key: PartitionKey,
+    partitions: Iterable[Hashable] | None = None,
+) -> dict[Hashable, pl.DataFrame]:
+    """
+    Computes the partition key once and splits `df` in a single pass, row order is kept within each partition.
+    If `partitions` is given the result has exactly those keys, missing partitions are empty frames.
+    """
+    if isinstance(key, pl.Expr):
+        values = df.select(key.alias(KEY_COLUMN)).to_series()
+    else:
+        values = key(df).alias(KEY_COLUMN)
+    parts = df.with_columns(values).partition_by(
+        KEY_COLUMN, as_dict=True, maintain_order=True, include_key=False
+    )
+    result = {value: part for (value,), part in parts.items() if value is not None}
+    if partitions is None:
+        return result
+    empty = df.clear()
+    return {partition: result.get(partition, empty) for partition in partitions}
@@ -1,74 +1,967 @@
 import polars as pl
+import numpy as np
 import nats
 import asyncio
+import functools
+import time
+from importlib.metadata import version
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from enum import Enum
+from typing import Protocol
+from dataclasses import dataclass, replace
 from alive_progress import alive_bar
 
-from utils import create_nats_message
+from checkpoint import Checkpoint, CheckpointConfig
+
+# Re-exported, the ingest command selects the event loop of its publishers through this module
+from event_loop import EventLoop, run  # noqa: F401
+from metrics import MetricsConfig, MetricsExporter, PublisherMetrics
+from pacing import Pacer, Timeline, scheduled_offsets
+from partitioner import id_hashes, stripe
+from utils import encode_nats_messages, iter_nats_messages, message_timestamps
 
 NATS_SERVER = "nats://localhost:4222"
 
+RETRYABLE_ERRORS = (nats.errors.TimeoutError, nats.js.errors.NoStreamResponseError)
+RETRY_BACKOFF = 0.05
 
-async def jetstream_ingest(
-    df: pl.DataFrame,
+# Read by the consumer and carried into the `perf` measurement
+PUBLISH_TIME_HEADER = "Published-At"
+
+
+class AdaptiveTarget(Enum):
+    NONE = "none"
+    LATENCY = "latency"
+    THROUGHPUT = "throughput"
+
+
+@dataclass(frozen=True)
+class PublishConfig:
+    # Core NATS flushes after this many messages when publishing one message at a time
+    flush_interval: int = 1000
+    # Core NATS publishes one message at a time through `nc.publish` by default, above 1 it opts
+    # into `CoreBatchWriter`, which writes up to this many PUB frames / bytes to the socket at once
+    batch_messages: int = 1
+    batch_bytes: int = 1 << 20
+    # JetStream publishes that may be waiting for an ack at the same time
+    window: int = 1000
+    max_retries: int = 3
+    # Connections opened by every worker, messages are striped across them by ID
+    connections: int = 1
+    # Every `stamp_every`th message carries the time it was published at in a header, 0 disables it
+    stamp_every: int = 0
+    # Replay speed relative to the trading timestamps, `None` publishes as fast as possible
+    speed: float | None = None
+    # Paced replays release one batch of messages per slice of wall clock time
+    slice_ms: int = 10
+    # Idle periods in the trading data are shortened to this when pacing, `None` keeps them
+    max_gap_ms: int | None = 1_000
+    # Unix time at which a paced replay starts, shared by all workers of a run
+    start_time: float | None = None
+    event_loop: EventLoop = EventLoop.ASYNCIO
+    # Workers export their metrics and write a report when set
+    metrics: MetricsConfig | None = None
+    # Workers record how far they got when set, to resume an interrupted run
+    checkpoint: CheckpointConfig | None = None
+    # Bytes a connection buffers before publishing waits for the socket, passed to `nats.connect`
+    pending_size: int = 2 << 20
+    # Tunes the flush interval, batch size or JetStream window while publishing
+    adaptive: AdaptiveTarget = AdaptiveTarget.NONE
+    target_latency_ms: float = 5.0
+    # Messages per second of one connection, 0 aims for the highest throughput
+    target_throughput: float = 0.0
+
+    def scheduled(self, delay: float = 2.0, skipped_ms: int = 0) -> "PublishConfig":
+        """
+        Starts a paced replay in `delay` seconds. `skipped_ms` of the day that were already sent
+        by an interrupted run are skipped, so its first unsent message is due at the start.
+        """
+        if self.speed is None:
+            return self
+        start_time = time.time() + delay - skipped_ms / 1000 / self.speed
+        return replace(self, start_time=start_time)
+
+    def timeline(self) -> Timeline | None:
+        if self.speed is None:
+            return None
+        return Timeline(self.max_gap_ms)
+
+    def pacer(self) -> Pacer | None:
+        if self.speed is None:
+            return None
+        return Pacer(self.speed, self.slice_ms, self.start_time)
+
+    def controller(
+        self, name: str, value: int, minimum: int, maximum: int
+    ) -> "FlushController | None":
+        if self.adaptive == AdaptiveTarget.NONE:
+            return None
+        return FlushController(
+            name,
+            value,
+            minimum,
+            maximum,
+            self.adaptive,
+            self.target_latency_ms / 1000,
+            self.target_throughput,
+            # Past half of the client's buffer the socket is not keeping up
+            pending_limit=self.pending_size // 2,
+        )
+
+
+class FlushController:
+    """
+    Tunes one size of a publisher while it runs: the messages per Core NATS flush or batch, or
+    the JetStream publishes in flight. Every `period` seconds it compares the latency the
+    publisher saw (flush or batch duration with Core NATS, ack round trip with JetStream) and
+    its throughput with the target and scales the size by `STEP`:
+    - latency: shrinks in proportion while the average latency is over the target (latency grows
+      with the size), grows while it is under half of it
+    - throughput: grows while below the target and shrinks while well above it, without a target it
+      keeps moving in the direction that raised the throughput and turns around when it fell
+    More than `pending_limit` bytes waiting in the client's buffer always shrinks it.
+    """
+
+    STEP = 1.25
+
+    def __init__(
+        self,
+        name: str,
+        value: int,
+        minimum: int,
+        maximum: int,
+        target: AdaptiveTarget,
+        target_latency: float,
+        target_throughput: float = 0.0,
+        pending_limit: int = 1 << 20,
+        period: float = 0.1,
+    ):
+        self.name = name
+        self.initial = value
+        self.value = value
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.target_latency = target_latency
+        self.target_throughput = target_throughput
+        self.pending_limit = pending_limit
+        self.period = period
+        self.low = value
+        self.high = value
+        self.changes = 0
+        self._direction = 1
+        self._last_throughput: float | None = None
+        self._start = time.perf_counter()
+        self._weighted = 0.0
+        self._reset(self._start)
+
+    def _reset(self, now: float):
+        self._period_start = now
+        self._messages = 0
+        self._latency = 0.0
+        self._samples = 0
+        self._pending = 0
+
+    def observe(self, messages: int, latency: float, pending_bytes: int):
+        """Records one flush, batch or ack, adjusting the size once a period is over."""
+        self._messages += messages
+        self._latency += latency
+        self._samples += 1
+        self._pending = max(self._pending, pending_bytes)
+        now = time.perf_counter()
+        if now - self._period_start >= self.period:
+            self._adjust(now)
+
+    def _factor(self, latency: float, throughput: float) -> float:
+        if self._pending > self.pending_limit:
+            return 1 / self.STEP
+        if self.target == AdaptiveTarget.LATENCY:
+            if latency > self.target_latency:
+                return max(self.target_latency / latency, 1 / 4)
+            if latency < self.target_latency / 2:
+                return self.STEP
+            return 1.0
+        if self.target_throughput:
+            if throughput < self.target_throughput:
+                return self.STEP
+            if throughput > self.target_throughput * self.STEP:
+                return 1 / self.STEP
+            return 1.0
+        if self._last_throughput is not None and throughput < self._last_throughput:
+            self._direction = -self._direction
+        self._last_throughput = throughput
+        return self.STEP**self._direction
+
+    def _adjust(self, now: float):
+        elapsed = now - self._period_start
+        factor = self._factor(self._latency / self._samples, self._messages / elapsed)
+        self._weighted += self.value * elapsed
+        value = min(max(round(self.value * factor), self.minimum), self.maximum)
+        if value != self.value:
+            self.value = value
+            self.changes += 1
+            self.low = min(self.low, value)
+            self.high = max(self.high, value)
+        self._reset(now)
+
+    def summary(self) -> dict:
+        seconds = time.perf_counter() - self._start
+        weighted = self._weighted + self.value * (
+            seconds - (self._period_start - self._start)
+        )
+        return {
+            "name": self.name,
+            "target": self.target.value,
+            "initial": self.initial,
+            "final": self.value,
+            "low": self.low,
+            "high": self.high,
+            # Average over time, the setting that compares with a static one
+            "mean": round(weighted / max(seconds, 1e-9), 1),
+            "changes": self.changes,
+        }
+
+    def report(self) -> str:
+        summary = self.summary()
+        return (
+            f"Adapted {self.name} for {self.target.value}: {summary['initial']} -> {summary['final']}, "
+            f"mean {summary['mean']}, range {summary['low']}-{summary['high']}, {summary['changes']} changes"
+        )
+
+
+async def _dispatch(
+    pool: "ConnectionPool",
+    buffer: np.ndarray,
+    offsets: np.ndarray,
+    rows: np.ndarray | None,
+    pacer: Pacer | None,
+    stripes: np.ndarray | None = None,
+    bar: Callable | None = None,
+    due_ms: np.ndarray | None = None,
+):
+    """`due_ms` holds the offset in the day of every message of the buffer, paced replays need it."""
+    if pacer is None:
+        await pool.send(buffer, offsets, rows, stripes, bar)
+        return
+    if rows is None:
+        rows = np.arange(len(offsets) - 1)
+    else:
+        due_ms = due_ms[rows]
+
+    async def send(due: slice):
+        await pool.send(
+            buffer, offsets, rows[due], None if stripes is None else stripes[due], bar
+        )
+
+    await pacer.run(due_ms, send)
+
+
+def publish_time_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+class Stamper:
+    """Picks the messages of a publisher that get a publish time header, every `every`th one."""
+
+    def __init__(self, every: int):
+        self.every = every
+        self._count = 0
+
+    def due(self) -> bool:
+        if not self.every:
+            return False
+        self._count += 1
+        return self._count % self.every == 0
+
+
+class AckWindow:
+    """
+    Keeps up to `config.window` JetStream publishes in flight and refills the window as soon
+    as individual acks arrive, instead of draining the whole pipeline every batch.
+    Failed publishes are retried up to `config.max_retries` times, a message is only dropped
+    from the window once it has been acknowledged, so delivery stays at least once.
+    Acks arrive out of order, `sent` counts the messages acked without a gap before them.
+    """
+
+    def __init__(self, nc: nats.NATS, exchange: str, config: PublishConfig):
+        self.nc = nc
+        self.js = nc.jetstream()
+        self.exchange = exchange
+        self.config = config
+        self.metrics = PublisherMetrics()
+        self.stamper = Stamper(config.stamp_every)
+        self._window = asyncio.Semaphore(config.window)
+        self._in_flight: set[asyncio.Task] = set()
+        self._failures: list[BaseException] = []
+        self.sent = 0
+        # Stream sequence of the last message counted in `sent`
+        self.sequence: int | None = None
+        self._published = 0
+        self._acked: dict[int, int] = {}
+        self.window = config.window
+        # Permits kept back as publishes complete after the window shrank
+        self._withheld = 0
+        self.controller = config.controller(
+            "window", config.window, 16, max(config.window, 1 << 16)
+        )
+
+    def _ack(self, index: int, sequence: int):
+        self._acked[index] = sequence
+        while self.sent in self._acked:
+            self.sequence = self._acked.pop(self.sent)
+            self.sent += 1
+
+    async def _publish(self, message: memoryview, stamped: bool, index: int):
+        # Retries keep the first publish time, the time spent retrying is part of the latency
+        headers = {PUBLISH_TIME_HEADER: str(publish_time_ms())} if stamped else None
+        try:
+            for attempt in range(self.config.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    ack = await self.js.publish(self.exchange, message, headers=headers)
+                    latency = time.perf_counter() - start
+                    self.metrics.ack_latency.record(latency)
+                    self.metrics.sent(1, len(message))
+                    self._ack(index, ack.seq)
+                    if self.controller:
+                        self.controller.observe(1, latency, self.nc.pending_data_size)
+                        if self.controller.value != self.window:
+                            await self._resize(self.controller.value)
+                    return
+                except RETRYABLE_ERRORS:
+                    if attempt == self.config.max_retries:
+                        raise
+                    # A retried message can land behind messages sent after it
+                    self.metrics.retries += 1
+                    await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+        except Exception as e:
+            self._failures.append(e)
+        finally:
+            if self._withheld:
+                self._withheld -= 1
+            else:
+                self._window.release()
+
+    async def _resize(self, window: int):
+        change = window - self.window
+        self.window = window
+        if change > 0:
+            repaid = min(change, self._withheld)
+            self._withheld -= repaid
+            for _ in range(change - repaid):
+                self._window.release()
+            return
+        self._withheld -= change
+        # Free permits are taken right away, the others as publishes complete
+        while self._withheld and not self._window.locked():
+            await self._window.acquire()
+            self._withheld -= 1
+
+    async def send(self, messages: Iterable[memoryview], bar: Callable | None = None):
+        for message in messages:
+            await self._window.acquire()
+            if self._failures:
+                self._window.release()
+                break
+            task = asyncio.create_task(
+                self._publish(message, self.stamper.due(), self._published)
+            )
+            self._published += 1
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            if bar:
+                bar()
+        if self._failures:
+            await self.drain()
+
+    async def drain(self):
+        if self._in_flight:
+            await asyncio.wait(self._in_flight)
+        if self._failures:
+            raise self._failures[0]
+
+    async def finish(self):
+        await self.drain()
+        await self.nc.flush()
+        if self.controller:
+            self.metrics.tuning.append(self.controller.summary())
+
+    def report(self) -> str:
+        report = (
+            f"Acked {self.metrics.messages} messages with {self.window} in flight, "
+            f"{self.metrics.retries} retries, ack latency {self.metrics.ack_latency.summary()}"
+        )
+        if self.controller:
+            report += f". {self.controller.report()}"
+        return report
+
+
+async def _timed_flush(
+    nc: nats.NATS,
+    metrics: PublisherMetrics | None,
+    messages: int,
+    size: int,
+    controller: FlushController | None = None,
+):
+    pending = nc.pending_data_size
+    start = time.perf_counter()
+    await nc.flush()
+    latency = time.perf_counter() - start
+    if metrics:
+        metrics.flush_latency.record(latency)
+        metrics.sent(messages, size)
+    if controller:
+        controller.observe(messages, latency, pending)
+
+
+def _core_sender(
+    nc: nats.NATS, exchange: str, stamper: Stamper | None = None
+) -> Callable[[memoryview], Awaitable[None]]:
+    """`nc.publish` to `exchange`, adding the publish time header to the messages `stamper` picks."""
+    if not (stamper and stamper.every):
+        return functools.partial(nc.publish, exchange)
+
+    async def send(message: memoryview):
+        if stamper.due():
+            headers = {PUBLISH_TIME_HEADER: str(publish_time_ms())}
+            await nc.publish(exchange, message, headers=headers)
+        else:
+            await nc.publish(exchange, message)
+
+    return send
+
+
+async def _nats_core_send(
+    nc: nats.NATS,
+    messages: Iterable[memoryview],
+    send: Callable[[memoryview], Awaitable[None]],
+    flush_interval: int,
+    bar: Callable | None = None,
+    metrics: PublisherMetrics | None = None,
+    controller: FlushController | None = None,
+):
+    counter = 0
+    size = 0
+    for message in messages:
+        await send(message)
+        counter += 1
+        size += len(message)
+        if counter > flush_interval:
+            await _timed_flush(nc, metrics, counter, size, controller)
+            counter = 0
+            size = 0
+            if controller:
+                flush_interval = controller.value
+        if bar:
+            bar()
+
+    await _timed_flush(nc, metrics, counter, size, controller)
+
+
+class CorePublisher:
+    """Publishes to Core NATS one `nc.publish` at a time, flushing every `config.flush_interval` messages."""
+
+    def __init__(self, nc: nats.NATS, exchange: str, config: PublishConfig):
+        self.nc = nc
+        self.exchange = exchange
+        self.config = config
+        self.metrics = PublisherMetrics()
+        self.stamper = Stamper(config.stamp_every)
+        self._send = _core_sender(nc, exchange, self.stamper)
+        self.sequence = None
+        self.controller = config.controller(
+            "flush_interval", config.flush_interval, 10, 1 << 17
+        )
+
+    @property
+    def sent(self) -> int:
+        # Messages are counted once the server answered the flush, in the order they were published
+        return self.metrics.messages
+
+    async def send(self, messages: Iterable[memoryview], bar: Callable | None = None):
+        await _nats_core_send(
+            self.nc,
+            messages,
+            self._send,
+            self.controller.value if self.controller else self.config.flush_interval,
+            bar,
+            self.metrics,
+            self.controller,
+        )
+
+    async def finish(self):
+        if self.controller:
+            self.metrics.tuning.append(self.controller.summary())
+
+    def report(self) -> str | None:
+        return self.controller.report() if self.controller else None
+
+
+class FrameWriter:
+    """
+    Writes pre-built PUB frames to the outgoing buffer of a client and waits until its flusher
+    task wrote them to the socket. nats-py has no public API for this, so this is the only place
+    that uses its internals, on the versions they were checked against. `supported` is false on
+    any other, publishers then fall back to `nc.publish`.
+    """
+
+    # nats-py releases whose `_send_command` and `_flush_pending(force_flush=True)` were checked
+    TESTED_VERSIONS = ((2, 9), (2, 16))
+
+    def __init__(self, nc: nats.NATS):
+        self.nc = nc
+
+    @classmethod
+    def supported(cls, nats_version: str | None = None) -> bool:
+        try:
+            release = tuple(
+                int(part)
+                for part in (nats_version or version("nats-py")).split(".")[:2]
+            )
+        except ValueError:
+            return False
+        oldest, newest = cls.TESTED_VERSIONS
+        return oldest <= release <= newest and all(
+            hasattr(nats.NATS, name) for name in ("_send_command", "_flush_pending")
+        )
+
+    async def write(self, frames: bytes, message_count: int, size: int):
+        await self.nc._send_command(frames)
+        await self.nc._flush_pending(force_flush=True)
+        # Counted like `nc.publish` does, payload bytes only
+        self.nc.stats["out_msgs"] += message_count
+        self.nc.stats["out_bytes"] += size
+
+
+class CoreBatchWriter:
+    """
+    Publishes to Core NATS by writing many pre-built PUB frames into the client's outgoing
+    buffer at once, so the cost of a coroutine round trip is paid once per batch instead of
+    once per message. A batch is closed after `config.batch_messages` messages or
+    `config.batch_bytes` bytes, whichever comes first, and waits until it is written to the socket.
+    """
+
+    def __init__(self, nc: nats.NATS, exchange: str, config: PublishConfig):
+        self.nc = nc
+        self.writer = FrameWriter(nc)
+        self.config = config
+        self._subject = exchange.encode()
+        # PUB headers only differ by payload size, which takes few distinct values
+        self._headers: dict[int, bytes] = {}
+        self._batch_stats: list[tuple[int, int, float]] = []
+        self.metrics = PublisherMetrics()
+        self.stamper = Stamper(config.stamp_every)
+        self.sequence = None
+        self.batch_messages = config.batch_messages
+        self.controller = config.controller(
+            "batch_messages", config.batch_messages, 100, 1 << 18
+        )
+
+    @property
+    def sent(self) -> int:
+        # Written to the socket, Core NATS does not confirm anything
+        return self.metrics.messages
+
+    def _header(self, size: int) -> bytes:
+        header = self._headers.get(size)
+        if header is None:
+            if size > self.nc.max_payload:
+                raise nats.errors.MaxPayloadError
+            header = b"PUB %s %d\r\n" % (self._subject, size)
+            self._headers[size] = header
+        return header
+
+    def _stamped_frame(self, message: memoryview) -> tuple:
+        headers = b"NATS/1.0\r\n%s: %d\r\n\r\n" % (
+            PUBLISH_TIME_HEADER.encode(),
+            publish_time_ms(),
+        )
+        command = b"HPUB %s %d %d\r\n" % (
+            self._subject,
+            len(headers),
+            len(headers) + len(message),
+        )
+        return command, headers, message, b"\r\n"
+
+    async def _write(self, frames: list, message_count: int, size: int, start: float):
+        if not self.nc.is_connected:
+            raise nats.errors.ConnectionClosedError
+        pending = self.nc.pending_data_size
+        write_start = time.perf_counter()
+        await self.writer.write(b"".join(frames), message_count, size)
+        self.metrics.flush_latency.record(time.perf_counter() - write_start)
+        self.metrics.sent(message_count, size)
+        duration = time.perf_counter() - start
+        self._batch_stats.append((message_count, size, duration))
+        if self.controller:
+            # The first message of a batch waits for all of it to be built and written
+            self.controller.observe(message_count, duration, pending)
+            self.batch_messages = self.controller.value
+
+    async def send(self, messages: Iterable[memoryview], bar: Callable | None = None):
+        frames = []
+        message_count = 0
+        size = 0
+        start = time.perf_counter()
+        for message in messages:
+            if self.stamper.due():
+                frames += self._stamped_frame(message)
+            else:
+                frames += (self._header(len(message)), message, b"\r\n")
+            message_count += 1
+            size += len(message)
+            if message_count >= self.batch_messages or size >= self.config.batch_bytes:
+                await self._write(frames, message_count, size, start)
+                if bar:
+                    bar(message_count)
+                frames = []
+                message_count = 0
+                size = 0
+                start = time.perf_counter()
+        if message_count:
+            await self._write(frames, message_count, size, start)
+            if bar:
+                bar(message_count)
+
+    async def finish(self):
+        await self.nc.flush()
+        if self.controller:
+            self.metrics.tuning.append(self.controller.summary())
+
+    def report(self) -> str:
+        if not self._batch_stats:
+            return "No batches were written"
+        stats = np.array(self._batch_stats)
+        rates = stats[:, 0] / np.maximum(stats[:, 2], 1e-9)
+        report = (
+            f"Wrote {len(stats)} batches of {stats[:, 0].mean():.0f} messages / "
+            f"{stats[:, 1].mean() / 1024:.1f} KiB on average, batch throughput "
+            f"p50={np.percentile(rates, 50):.0f} msg/s, p10={np.percentile(rates, 10):.0f} msg/s, "
+            f"batch duration p99={np.percentile(stats[:, 2], 99) * 1000:.2f} ms"
+        )
+        if self.controller:
+            report += f". {self.controller.report()}"
+        return report
+
+
+class Publisher(Protocol):
+    metrics: PublisherMetrics
+    # Messages that do not have to be sent again, in the order they were handed over:
+    # acked with JetStream, flushed or written to the socket with Core NATS
+    sent: int
+    # JetStream sequence of the last acked message
+    sequence: int | None
+
+    async def send(
+        self, messages: Iterable[memoryview], bar: Callable | None = None
+    ): ...
+
+    async def finish(self): ...
+
+    def report(self) -> str | None: ...
+
+
+def jetstream_publisher(
+    nc: nats.NATS, exchange: str, config: PublishConfig
+) -> Publisher:
+    return AckWindow(nc, exchange, config)
+
+
+def nats_core_publisher(
+    nc: nats.NATS, exchange: str, config: PublishConfig
+) -> Publisher:
+    if config.batch_messages > 1:
+        if FrameWriter.supported():
+            return CoreBatchWriter(nc, exchange, config)
+        print(
+            f"Batched publishing is not supported with nats-py {version('nats-py')}, "
+            "publishing one message at a time"
+        )
+    return CorePublisher(nc, exchange, config)
+
+
+class ConnectionPool:
+    """
+    The `config.connections` connections of one worker, each with its own publisher and
+    flush schedule. With more than one connection `send` takes the stripe of every message,
+    every ID is always sent on the same connection so its messages keep their order.
+    """
+
+    def __init__(self, connections: list[nats.NATS], publishers: list[Publisher]):
+        self.connections = connections
+        self.publishers = publishers
+        self.exporter: MetricsExporter | None = None
+        self.checkpoint: CheckpointConfig | None = None
+        self._checkpoints: asyncio.Task | None = None
+
+    def metrics(self) -> PublisherMetrics:
+        return PublisherMetrics.merged([p.metrics for p in self.publishers])
+
+    @classmethod
+    async def open(
+        cls,
+        new_publisher: Callable[[nats.NATS, str, PublishConfig], Publisher],
+        exchange: str,
+        config: PublishConfig,
+        total: int | None = None,
+    ) -> "ConnectionPool":
+        connections = [
+            await nats.connect(NATS_SERVER, pending_size=config.pending_size)
+            for _ in range(config.connections)
+        ]
+        publishers = [new_publisher(nc, exchange, config) for nc in connections]
+        pool = cls(connections, publishers)
+        if config.metrics:
+            pool.exporter = MetricsExporter(
+                config.metrics, exchange, pool.metrics, total
+            )
+            pool.exporter.start_exporting()
+        if config.checkpoint and config.checkpoint.file:
+            pool.checkpoint = config.checkpoint
+            pool._checkpoints = asyncio.create_task(pool._record_periodically())
+        return pool
+
+    def record_checkpoint(self):
+        """Adds what this run sent to what the interrupted run had already sent."""
+        if self.checkpoint is None:
+            return
+        sent = self.checkpoint.sent or (0,) * len(self.publishers)
+        Checkpoint(self.checkpoint.path).record(
+            self.checkpoint.file,
+            self.checkpoint.partition,
+            [base + p.sent for base, p in zip(sent, self.publishers)],
+            [p.sequence for p in self.publishers],
+        )
+
+    async def _record_periodically(self):
+        while True:
+            await asyncio.sleep(self.checkpoint.interval)
+            self.record_checkpoint()
+
+    def stripes(
+        self, id_hash: np.ndarray | None, rows: np.ndarray | None = None
+    ) -> np.ndarray | None:
+        if len(self.publishers) == 1:
+            return None
+        if id_hash is None:
+            raise ValueError("Striping messages across connections needs their ID hash")
+        return stripe(id_hash if rows is None else id_hash[rows], len(self.publishers))
+
+    async def send(
+        self,
+        buffer: np.ndarray,
+        offsets: np.ndarray,
+        rows: np.ndarray | None,
+        stripes: np.ndarray | None,
+        bar: Callable | None = None,
+    ):
+        """Sends the messages of `buffer` (only `rows` if given), each on the connection of its stripe."""
+        if len(self.publishers) == 1:
+            await self.publishers[0].send(
+                iter_nats_messages(buffer, offsets, rows), bar
+            )
+            return
+        if rows is None:
+            rows = np.arange(len(offsets) - 1)
+        parts = [
+            rows[stripes == connection] for connection in range(len(self.publishers))
+        ]
+        await asyncio.gather(
+            *(
+                publisher.send(iter_nats_messages(buffer, offsets, part), bar)
+                for publisher, part in zip(self.publishers, parts)
+                if len(part)
+            )
+        )
+
+    async def close(self):
+        await asyncio.gather(*(publisher.finish() for publisher in self.publishers))
+        if self._checkpoints:
+            self._checkpoints.cancel()
+            self.record_checkpoint()
+        for i, publisher in enumerate(self.publishers):
+            if report := publisher.report():
+                prefix = f"Connection {i}: " if len(self.publishers) > 1 else ""
+                print(prefix + report)
+        if self.exporter:
+            await self.exporter.stop()
+        for nc in self.connections:
+            await nc.close()
+
+
+async def _publish(
+    new_publisher: Callable[[nats.NATS, str, PublishConfig], Publisher],
+    buffer: np.ndarray,
+    offsets: np.ndarray,
+    exchange: str,
+    config: PublishConfig,
+    show_progress_bar: bool,
+    rows: np.ndarray | None,
+    id_hash: np.ndarray | None,
+    due_ms: np.ndarray | None,
+):
+    message_count = len(offsets) - 1 if rows is None else len(rows)
+    pool = await ConnectionPool.open(new_publisher, exchange, config, message_count)
+    stripes = pool.stripes(id_hash, rows)
+    pacer = config.pacer()
+    if pacer and due_ms is None:
+        # The buffer holds the whole day, e.g. a replay file, before its rows are selected
+        due_ms = config.timeline().offsets(message_timestamps(buffer, offsets))
+
+    try:
+        if show_progress_bar:
+            with alive_bar(message_count) as bar:
+                await _dispatch(
+                    pool, buffer, offsets, rows, pacer, stripes, bar, due_ms
+                )
+                await pool.close()
+        else:
+            await _dispatch(pool, buffer, offsets, rows, pacer, stripes, None, due_ms)
+            await pool.close()
+    except BaseException:
+        # Whatever was sent before the failure does not have to be sent again
+        pool.record_checkpoint()
+        raise
+    if pacer:
+        print(pacer.report())
+
+
+async def _publish_stream(
+    new_publisher: Callable[[nats.NATS, str, PublishConfig], Publisher],
+    batches: AsyncIterator[
+        tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray | None]
+    ],
+    exchange: str,
+    config: PublishConfig,
+) -> int:
+    """Batches hold a buffer, its offsets, ID hashes and offsets in the day, if they were scheduled."""
+    pool = await ConnectionPool.open(new_publisher, exchange, config)
+    pacer = config.pacer()
+    # Only paces the batches of this stream together when they were not scheduled as a day
+    timeline = config.timeline()
+
+    message_count = 0
+    try:
+        async for buffer, offsets, id_hash, due_ms in batches:
+            if pacer and due_ms is None:
+                due_ms = timeline.offsets(message_timestamps(buffer, offsets))
+            await _dispatch(
+                pool,
+                buffer,
+                offsets,
+                None,
+                pacer,
+                pool.stripes(id_hash),
+                due_ms=due_ms,
+            )
+            message_count += len(offsets) - 1
+        await pool.close()
+    except BaseException:
+        pool.record_checkpoint()
+        raise
+    if pacer:
+        print(pacer.report())
+    return message_count
+
+
+async def jetstream_publish(
+    buffer: np.ndarray,
+    offsets: np.ndarray,
     exchange: str,
-    flush_interval: int = 1000,
+    config: PublishConfig = PublishConfig(),
     show_progress_bar: bool = False,
+    rows: np.ndarray | None = None,
+    id_hash: np.ndarray | None = None,
+    due_ms: np.ndarray | None = None,
 ):
     # https://stackoverflow.com/questions/70550060/performance-of-nats-jetstream
-    nc = await nats.connect(NATS_SERVER)
-    js = nc.jetstream()
-
-    acks = []
-    if show_progress_bar:
-        with alive_bar(len(df)) as bar:
-            for i, event in enumerate(df.iter_rows(named=False, buffer_size=1024)):
-                acks.append(js.publish(exchange, create_nats_message(*event)))
-                if len(acks) > flush_interval:
-                    await asyncio.gather(*acks)
-                    acks.clear()
-                    await nc.flush()
-                bar()
-    else:
-        for i, event in enumerate(df.iter_rows(named=False, buffer_size=1024)):
-            acks.append(js.publish(exchange, create_nats_message(*event)))
-            if len(acks) > flush_interval:
-                await asyncio.gather(*acks)
-                acks.clear()
-                await nc.flush()
+    await _publish(
+        jetstream_publisher,
+        buffer,
+        offsets,
+        exchange,
+        config,
+        show_progress_bar,
+        rows,
+        id_hash,
+        due_ms,
+    )
 
-    try:
-        await asyncio.gather(*acks)
-    finally:
-        acks.clear()
-    await nc.flush()
-    await nc.close()
 
+async def jetstream_publish_stream(
+    batches: AsyncIterator[
+        tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray | None]
+    ],
+    exchange: str,
+    config: PublishConfig = PublishConfig(),
+) -> int:
+    return await _publish_stream(jetstream_publisher, batches, exchange, config)
 
-async def nats_core_ingest(
+
+async def jetstream_ingest(
     df: pl.DataFrame,
     exchange: str,
-    flush_interval: int = 1000,
+    config: PublishConfig = PublishConfig(),
     show_progress_bar: bool = False,
 ):
-    nc = await nats.connect(NATS_SERVER)
+    buffer, offsets = encode_nats_messages(df)
+    await jetstream_publish(
+        buffer,
+        offsets,
+        exchange,
+        config,
+        show_progress_bar,
+        id_hash=id_hashes(df),
+        due_ms=scheduled_offsets(df),
+    )
 
-    counter = 0
-    if show_progress_bar:
-        with alive_bar(len(df)) as bar:
-            for event in df.iter_rows(named=False, buffer_size=1024):
-                await nc.publish(exchange, create_nats_message(*event))
-                counter += 1
-                if counter > flush_interval:
-                    counter = 0
-                    await nc.flush()
-                bar()
-    else:
-        for event in df.iter_rows(named=False, buffer_size=1024):
-            await nc.publish(exchange, create_nats_message(*event))
-            counter += 1
-            if counter > flush_interval:
-                counter = 0
-                await nc.flush()
 
-    await nc.flush()
-    await nc.close()
+async def nats_core_publish(
+    buffer: np.ndarray,
+    offsets: np.ndarray,
+    exchange: str,
+    config: PublishConfig = PublishConfig(),
+    show_progress_bar: bool = False,
+    rows: np.ndarray | None = None,
+    id_hash: np.ndarray | None = None,
+    due_ms: np.ndarray | None = None,
+):
+    await _publish(
+        nats_core_publisher,
+        buffer,
+        offsets,
+        exchange,
+        config,
+        show_progress_bar,
+        rows,
+        id_hash,
+        due_ms,
+    )
+
+
+async def nats_core_publish_stream(
+    batches: AsyncIterator[
+        tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray | None]
+    ],
+    exchange: str,
+    config: PublishConfig = PublishConfig(),
+) -> int:
+    return await _publish_stream(nats_core_publisher, batches, exchange, config)
+
+
+async def nats_core_ingest(
+    df: pl.DataFrame,
+    exchange: str,
+    config: PublishConfig = PublishConfig(),
+    show_progress_bar: bool = False,
+):
+    buffer, offsets = encode_nats_messages(df)
+    await nats_core_publish(
+        buffer,
+        offsets,
+        exchange,
+        config,
+        show_progress_bar,
+        id_hash=id_hashes(df),
+        due_ms=scheduled_offsets(df),
+    )
@@ -0,0 +1,138 @@
+import json
+import mmap
+import struct
+
+import numpy as np
+import polars as pl
+
+from partitioner import EXCHANGES, HASH_SEED, hash_probe
+from utils import encode_nats_messages
+
+# Layout of a replay file, every section starts on a 64 byte boundary
+# [magic: 8 bytes][header length: u64][header: JSON][payloads][offsets][exchange][id_hash]
+MAGIC = b"DEBSRPL1"
+# Version 2 records the hash probe
+VERSION = 2
+ALIGNMENT = 64
+REPLAY_SUFFIX = ".replay"
+
+UNKNOWN_EXCHANGE = 255
+
+
+def _aligned(position: int) -> int:
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def compile_replay_file(df: pl.DataFrame, output: str) -> int:
+    """
+    Encodes a dataframe from `preprocess_csv_file` and writes it to `output` as a replay file.
+    Returns the number of bytes written.
+    """
+    buffer, offsets = encode_nats_messages(df)
+    exchange = pl.lit(UNKNOWN_EXCHANGE)
+    for i, suffix in reversed(list(enumerate(EXCHANGES))):
+        exchange = (
+            pl.when(pl.col("ID").str.ends_with(suffix)).then(i).otherwise(exchange)
+        )
+    keys = df.select(
+        pl.col("ID").hash(HASH_SEED).alias("id_hash"),
+        exchange.cast(pl.UInt8).alias("exchange"),
+    )
+    arrays = {
+        "payloads": buffer,
+        "offsets": offsets.astype("<i8"),
+        "exchange": keys["exchange"].to_numpy(),
+        "id_hash": keys["id_hash"].to_numpy().astype("<u8"),
+    }
+
+    # The header size depends on the section offsets, so reserve a fixed amount of room
+    header_size = 4096
+    position = _aligned(len(MAGIC) + 8 + header_size)
+    sections = {}
+    for name, array in arrays.items():
+        sections[name] = {
+            "offset": position,
+            "dtype": array.dtype.str,
+            "length": len(array),
+        }
+        position = _aligned(position + array.nbytes)
+
+    header = json.dumps(
+        {
+            "version": VERSION,
+            "date": str(df["Trading date"][0]) if len(df) > 0 else None,
+            "messages": len(df),
+            "hash_seed": HASH_SEED,
+            "hash_probe": hash_probe(),
+            "polars": pl.__version__,
+            "exchanges": EXCHANGES,
+            "sections": sections,
+        }
+    ).encode("utf-8")
+    if len(header) > header_size:
+        raise ValueError("Replay file header does not fit in the reserved space")
+
+    with open(output, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(sections[name]["offset"])
+            f.write(memoryview(np.ascontiguousarray(array)).cast("B"))
+        f.truncate(position)
+    return position
+
+
+class ReplayFile:
+    """
+    Read-only, memory-mapped view of a file written by `compile_replay_file`.
+    Payloads are never copied, slices of `payloads` can be published as-is.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a replay file")
+        (header_length,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(self._mmap[start : start + header_length])
+        if self.header["version"] != VERSION:
+            raise ValueError(
+                f"Unsupported replay file version {self.header['version']} in {path}, "
+                "compile it again"
+            )
+        # Partitions and stripes are chosen from the stored hashes, they must match the hashes of
+        # data files and streams
+        if (
+            self.header["hash_seed"] != HASH_SEED
+            or self.header["hash_probe"] != hash_probe()
+        ):
+            raise ValueError(
+                f"{path} was compiled with Polars {self.header['polars']}, which hashes IDs "
+                f"differently than Polars {pl.__version__}, compile it again"
+            )
+        self.date: str | None = self.header["date"]
+        self.message_count: int = self.header["messages"]
+        self.payloads = self._section("payloads")
+        self.offsets = self._section("offsets")
+        self.exchange = self._section("exchange")
+        self.id_hash = self._section("id_hash")
+
+    def _section(self, name: str) -> np.ndarray:
+        section = self.header["sections"][name]
+        return np.frombuffer(
+            self._mmap,
+            dtype=np.dtype(section["dtype"]),
+            count=section["length"],
+            offset=section["offset"],
+        )
+
+    def exchange_rows(self, exchange: str) -> np.ndarray:
+        """Row numbers of all messages whose ID ends with `exchange`."""
+        return np.flatnonzero(self.exchange == EXCHANGES.index(exchange))
+
+    def hash_rows(self, partitions: int, partition: int) -> np.ndarray:
+        """Row numbers of all messages in hash partition `partition` out of `partitions`."""
+        return np.flatnonzero(self.id_hash % partitions == partition)
@@ -0,0 +1,120 @@
+import os
+import time
+
+import polars as pl
+
+from partitioner import exchange_key
+from utils import trading_date, unix_ms, unix_us
+
+STORE_SUFFIX = ".parquet"
+ROW_GROUP_SIZE = 64 * 1024
+
+# Columns of a day in the store
+# Row: position of the event in the CSV, the store is sorted by exchange and ID instead
+# Timestamp: trading time as unix ms (UTC), null when the CSV has none
+SCHEMA = {
+    "Row": pl.UInt32,
+    "Exchange": pl.String,
+    "ID": pl.String,
+    "SecType": pl.String,
+    "Last": pl.Float64,
+    "Timestamp": pl.Int64,
+}
+
+
+def store_path(file: str) -> str:
+    root, _ = os.path.splitext(file)
+    return root + STORE_SUFFIX
+
+
+def _scan_csv(file: str) -> pl.LazyFrame:
+    """A day of DEBS CSV data with the columns of the store, in CSV order."""
+    dt = trading_date(file)
+    return (
+        pl.scan_csv(file, comment_prefix="#", separator=",")
+        .select("ID", "SecType", "Last", "Trading time")
+        .with_row_index("Row")
+        .select(
+            "Row",
+            exchange_key().alias("Exchange"),
+            "ID",
+            "SecType",
+            # Sometimes, the data is messed up
+            pl.col("Last").cast(pl.Float64, strict=False),
+            unix_us(pl.lit(dt), pl.col("Trading time").cast(pl.String))
+            .map_batches(unix_ms, return_dtype=pl.Int64)
+            .alias("Timestamp"),
+        )
+        .cast(SCHEMA)
+    )
+
+
+def convert_day(file: str, output: str | None = None) -> str:
+    """
+    Converts a day of DEBS CSV data to a typed Parquet file. The file is sorted by exchange and ID
+    with small row groups, so scans filtered on either only read a few row groups. Both string
+    columns are dictionary encoded by Parquet, `ID` stays a string so it hashes to the same
+    partitions as the CSV.
+    """
+    start = time.time()
+    output = output or store_path(file)
+    df = _scan_csv(file).sort("Exchange", "ID", "Row", nulls_last=True).collect()
+    df.write_parquet(
+        output + ".tmp",
+        compression="zstd",
+        statistics=True,
+        row_group_size=ROW_GROUP_SIZE,
+    )
+    os.replace(output + ".tmp", output)
+    print(f"Converted {file} to {output} in {round(time.time() - start, 2)} seconds")
+    return output
+
+
+def stored_day(file: str) -> str | None:
+    """Path of the store file of `file`, `None` when it was not converted or is older than the CSV."""
+    if file.endswith(STORE_SUFFIX):
+        return file
+    output = store_path(file)
+    if os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(file):
+        return output
+    return None
+
+
+def scan_day(
+    file: str, entity: str | None = None, exchange: str | None = None
+) -> pl.LazyFrame:
+    """
+    Lazy scan of a day, `entity` and `exchange` filters are pushed down to the Parquet reader.
+    Days that were not converted with `convert_day` are parsed from the CSV instead.
+    """
+    path = stored_day(file)
+    if path:
+        q = pl.scan_parquet(path)
+    else:
+        print(f"{file} was not converted, `main.py convert` makes reading it faster")
+        q = _scan_csv(file)
+    if exchange:
+        q = q.filter(pl.col("Exchange") == exchange)
+    if entity:
+        q = q.filter(pl.col("ID") == entity)
+    return q
+
+
+def load_day(file: str, entity: str | None = None) -> pl.DataFrame:
+    """
+    Store version of `preprocess_csv_file`, events in CSV order with `Timestamp` instead of
+    the `Trading time` string. Accepts the CSV, read from its store file once converted, or the
+    store file itself.
+    """
+    start = time.time()
+    print(f"Reading file {file}")
+    df = (
+        scan_day(file, entity)
+        .sort("Row")
+        .select("ID", "SecType", "Last", "Timestamp")
+        .with_columns(pl.lit(trading_date(file)).alias("Trading date"))
+        .collect()
+    )
+    end = time.time()
+    print(f"Read {file} in {round(end - start, 2)} seconds, shape: {df.shape}.")
+    return df
@@ -1,9 +1,13 @@
 import datetime
+import os
+import tempfile
 import zoneinfo
 import struct
 import time
 import re
+from collections.abc import Hashable, Iterator
 
+import numpy as np
 import polars as pl
 
 
@@ -48,16 +52,221 @@ def create_nats_message(
     return last_float + date_payload + str_data
 
 
-def preprocess_csv_file(file: str, entity: str | None = None) -> pl.DataFrame:
-    start = time.time()
-    pattern = r".*debs\d{4}-gc-trading-day-(\d{2})-(\d{2})-(\d{2})\.csv"
+def _string_segments(
+    series: pl.Series,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Dictionary encode the column so the Rust `String` header + bytes are only built
+    # once per unique value (~5500 IDs) instead of once per row
+    categorical = series.fill_null("").cast(pl.Categorical)
+    codes = categorical.to_physical().to_numpy()
+    encoded = [
+        struct.pack("<Q", len(value.encode("utf-8"))) + value.encode("utf-8")
+        for value in categorical.cat.get_categories().to_list()
+    ]
+    lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+    segments = np.zeros((len(encoded), int(lengths.max(initial=8))), dtype=np.uint8)
+    for i, e in enumerate(encoded):
+        segments[i, : len(e)] = np.frombuffer(e, dtype=np.uint8)
+    return codes, segments, lengths
+
+
+def _scatter_fixed(buffer: np.ndarray, positions: np.ndarray, values: np.ndarray):
+    # Write fixed width little endian values, one byte column at a time
+    columns = values.view(np.uint8).reshape(len(values), values.itemsize)
+    for k in range(values.itemsize):
+        buffer[positions + k] = columns[:, k]
+
+
+def _scatter_segments(
+    buffer: np.ndarray,
+    positions: np.ndarray,
+    codes: np.ndarray,
+    segments: np.ndarray,
+    lengths: np.ndarray,
+):
+    row_lengths = lengths[codes]
+    shortest = int(lengths.min(initial=0))
+    for k in range(segments.shape[1]):
+        if k < shortest:
+            buffer[positions + k] = segments[codes, k]
+        else:
+            mask = row_lengths > k
+            buffer[positions[mask] + k] = segments[codes[mask], k]
+
+
+def unix_us(date: pl.Expr, time_of_day: pl.Expr) -> pl.Expr:
+    """Unix µs of a trading date and a `Trading time` string."""
+    return (
+        date.cast(pl.Datetime("us")).cast(pl.Int64)
+        + time_of_day.str.strptime(pl.Time, "%H:%M:%S%.f").cast(pl.Int64) // 1000
+    )
+
+
+def unix_ms(unix_us: pl.Series) -> pl.Series:
+    # Same float arithmetic as `int(datetime.timestamp() * 1000)` so rounding matches,
+    # done in NumPy as Polars folds the constants and rounds differently
+    values = (unix_us.fill_null(0).to_numpy().astype(np.float64) / 10**6 * 1000).astype(
+        "<i8"
+    )
+    return pl.Series(unix_us.name, values).set(unix_us.is_null(), None)
+
+
+def frame_timestamps(df: pl.DataFrame) -> pl.Series:
+    """Trading timestamp (unix ms) of every row, null where it is missing."""
+    # Frames read from the store already carry the timestamp as unix ms
+    if "Timestamp" in df.columns:
+        return df["Timestamp"]
+    return unix_ms(
+        df.select(unix_us(pl.col("Trading date"), pl.col("Trading time"))).to_series()
+    )
+
+
+def encode_nats_messages(df: pl.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Columnar version of `create_nats_message` for a whole dataframe from `preprocess_csv_file`
+    or `store.load_day`.
+
+    Returns one contiguous `uint8` buffer holding every message back to back and an
+    `offsets` array of length `len(df) + 1`, message `i` is `buffer[offsets[i]:offsets[i + 1]]`.
+    Every message is byte-identical to `create_nats_message(*row)`.
+    """
+    last = df["Last"].cast(pl.Float64)
+    timestamps = frame_timestamps(df)
+    has_last = last.is_not_null().to_numpy()
+    has_timestamp = timestamps.is_not_null().to_numpy()
+    last = last.fill_null(0.0).to_numpy().astype("<f8")
+    unix_ms_values = timestamps.fill_null(0).to_numpy().astype("<i8")
+    id_codes, id_segments, id_lengths = _string_segments(df["ID"])
+    sec_codes, sec_segments, sec_lengths = _string_segments(df["SecType"])
+
+    last_size = np.where(has_last, 9, 1)
+    timestamp_size = np.where(has_timestamp, 9, 1)
+    offsets = np.zeros(len(df) + 1, dtype=np.int64)
+    np.cumsum(
+        last_size + timestamp_size + id_lengths[id_codes] + sec_lengths[sec_codes],
+        out=offsets[1:],
+    )
+    buffer = np.zeros(int(offsets[-1]), dtype=np.uint8)
+
+    # Option<f64>
+    positions = offsets[:-1].copy()
+    buffer[positions] = has_last
+    _scatter_fixed(buffer, positions[has_last] + 1, last[has_last])
+    positions += last_size
+    # Option<i64>
+    buffer[positions] = has_timestamp
+    _scatter_fixed(buffer, positions[has_timestamp] + 1, unix_ms_values[has_timestamp])
+    positions += timestamp_size
+    # id: String, equity_type: String
+    _scatter_segments(buffer, positions, id_codes, id_segments, id_lengths)
+    positions += id_lengths[id_codes]
+    _scatter_segments(buffer, positions, sec_codes, sec_segments, sec_lengths)
+
+    return buffer, offsets
+
+
+def message_timestamps(
+    buffer: np.ndarray, offsets: np.ndarray, rows: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Reads the trading timestamp (unix ms) back out of encoded messages without decoding them fully.
+    Messages without a timestamp get -1.
+    """
+    starts = offsets[:-1] if rows is None else offsets[rows]
+    # Option<f64> is 1 byte when None and 9 bytes when Some
+    timestamp_tags = starts + 1 + 8 * buffer[starts].astype(np.int64)
+    has_timestamp = buffer[timestamp_tags] == 1
+    timestamps = np.full(len(starts), -1, dtype=np.int64)
+    positions = timestamp_tags[has_timestamp] + 1
+    values = np.zeros(len(positions), dtype=np.uint64)
+    for k in range(8):
+        values |= buffer[positions + k].astype(np.uint64) << np.uint64(8 * k)
+    timestamps[has_timestamp] = values.astype(np.int64)
+    return timestamps
+
+
+def iter_nats_messages(
+    buffer: np.ndarray, offsets: np.ndarray, rows: np.ndarray | None = None
+):
+    """
+    Yields zero-copy slices of the buffer returned by `encode_nats_messages`.
+    If `rows` is given, only those messages are yielded, in the order of `rows`.
+    """
+    payload = memoryview(buffer)
+    if rows is None:
+        starts = offsets[:-1].tolist()
+        ends = offsets[1:].tolist()
+    else:
+        starts = offsets[rows].tolist()
+        ends = offsets[rows + 1].tolist()
+    for start, end in zip(starts, ends):
+        yield payload[start:end]
+
+
+def trading_date(file: str) -> datetime.date:
+    pattern = r".*debs\d{4}-gc-trading-day-(\d{2})-(\d{2})-(\d{2})\.(csv|parquet)"
     re_match = re.search(pattern, file)
     if not re_match:
         raise ValueError(f"No date found in supplied data file {file}")
-    day, month, year = re_match.groups()
-    print(f"Reading file {file}")
+    day, month, year, _ = re_match.groups()
     date_str = f"20{year}-{month}-{day}"  # Assuming 20xx for the year
-    dt = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+    return datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+
+
+def read_csv_batches(
+    file: str, batch_size: int, entity: str | None = None
+) -> Iterator[pl.DataFrame]:
+    """
+    Streaming version of `preprocess_csv_file`, yields frames of at most `batch_size` rows
+    with the same columns so only a bounded part of the file is in memory at once.
+    """
+    dt = trading_date(file)
+    print(f"Streaming file {file} in batches of {batch_size} rows")
+    reader = pl.read_csv_batched(
+        file,
+        comment_prefix="#",
+        separator=",",
+        columns=["ID", "SecType", "Last", "Trading time"],
+        batch_size=batch_size,
+    )
+    while batches := reader.next_batches(1):
+        for df in batches:
+            df = df.select("ID", "SecType", "Last", "Trading time")
+            if entity:
+                df = df.filter(pl.col("ID") == entity)
+            yield df.with_columns(pl.lit(dt).alias("Trading date"))
+
+
+def shared_directory() -> tempfile.TemporaryDirectory:
+    # /dev/shm is RAM backed on Linux, macOS has no equivalent so use the default temp dir there
+    root = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    return tempfile.TemporaryDirectory(prefix="ingester-", dir=root)
+
+
+def share_frames(
+    frames: dict[Hashable, pl.DataFrame], directory: str
+) -> dict[Hashable, tuple[str, int]]:
+    """
+    Writes each frame as an uncompressed Arrow IPC file into `directory`, so worker processes
+    can memory-map it with `read_shared_frame` instead of receiving a pickled copy.
+    Returns the path and row count of every frame.
+    """
+    shared = {}
+    for key, df in frames.items():
+        path = os.path.join(directory, f"{key}.arrow")
+        df.write_ipc(path, compression="uncompressed")
+        shared[key] = (path, len(df))
+    return shared
+
+
+def read_shared_frame(path: str) -> pl.DataFrame:
+    return pl.read_ipc(path, memory_map=True, rechunk=False)
+
+
+def preprocess_csv_file(file: str, entity: str | None = None) -> pl.DataFrame:
+    start = time.time()
+    dt = trading_date(file)
+    print(f"Reading file {file}")
 
     q = pl.scan_csv(file, comment_prefix="#", separator=",").select(
         "ID", "SecType", "Last", "Trading time"
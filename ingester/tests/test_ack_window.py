@@ -0,0 +1,175 @@
+import asyncio
+from types import SimpleNamespace
+
+import nats
+import pytest
+
+from producer import RETRYABLE_ERRORS, AckWindow, AdaptiveTarget, PublishConfig
+
+
+class FakeJetStream:
+    """Acks after `delay` seconds, failing the attempts listed in `failures` per message."""
+
+    def __init__(
+        self, failures: dict[bytes, list[type[Exception]]], delay: float = 0.001
+    ):
+        self.failures = {message: list(errors) for message, errors in failures.items()}
+        self.delay = delay
+        self.attempts: list[bytes] = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.stored: list[bytes] = []
+
+    async def publish(self, subject, payload, headers=None):
+        message = bytes(payload)
+        self.attempts.append(message)
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            # Later messages are acked first now and then
+            await asyncio.sleep(self.delay * (1 + len(self.attempts) % 3))
+            errors = self.failures.get(message)
+            if errors:
+                raise errors.pop(0)()
+            self.stored.append(message)
+            return SimpleNamespace(seq=len(self.stored))
+        finally:
+            self.in_flight -= 1
+
+
+class FakeClient:
+    pending_data_size = 0
+
+    def __init__(self, js: FakeJetStream):
+        self.js = js
+
+    def jetstream(self):
+        return self.js
+
+    async def flush(self):
+        pass
+
+
+def messages(count: int) -> list[memoryview]:
+    return [memoryview(b"m%d" % i) for i in range(count)]
+
+
+def window(js: FakeJetStream, **config) -> AckWindow:
+    return AckWindow(FakeClient(js), "exchange.FR", PublishConfig(**config))
+
+
+async def publish(ack_window: AckWindow, count: int):
+    await ack_window.send(messages(count))
+    await ack_window.finish()
+
+
+@pytest.mark.parametrize("error", RETRYABLE_ERRORS)
+def test_retries_until_acked(monkeypatch, error):
+    monkeypatch.setattr("producer.RETRY_BACKOFF", 0.001)
+    js = FakeJetStream({b"m3": [error, error], b"m7": [error]})
+    ack_window = window(js, window=4, max_retries=3)
+
+    asyncio.run(publish(ack_window, 10))
+
+    assert js.attempts.count(b"m3") == 3 and js.attempts.count(b"m7") == 2
+    assert sorted(js.stored) == sorted(bytes(m) for m in messages(10))
+    assert ack_window.metrics.retries == 3
+    assert ack_window.metrics.messages == 10
+    # Every message is acked, the watermark reached the end
+    assert ack_window.sent == 10
+    assert ack_window.sequence is not None
+
+
+def test_final_failure_is_raised(monkeypatch):
+    monkeypatch.setattr("producer.RETRY_BACKOFF", 0.001)
+    js = FakeJetStream({b"m5": [nats.errors.TimeoutError] * 3})
+    ack_window = window(js, window=2, max_retries=2)
+
+    with pytest.raises(nats.errors.TimeoutError):
+        asyncio.run(publish(ack_window, 50))
+
+    assert js.attempts.count(b"m5") == 3
+    assert ack_window.metrics.retries == 2
+    # Nothing after the failed message counts as sent, and publishing stopped soon after it
+    assert ack_window.sent == 5
+    assert len(set(js.attempts)) < 50
+
+
+def test_other_errors_are_not_retried():
+    js = FakeJetStream({b"m1": [nats.js.errors.BadRequestError]})
+    ack_window = window(js, window=8, max_retries=3)
+
+    with pytest.raises(nats.js.errors.BadRequestError):
+        asyncio.run(publish(ack_window, 5))
+
+    assert js.attempts.count(b"m1") == 1
+    assert ack_window.metrics.retries == 0
+    assert ack_window.sent == 1
+
+
+def test_window_bounds_publishes_in_flight():
+    js = FakeJetStream({})
+    ack_window = window(js, window=5)
+
+    asyncio.run(publish(ack_window, 100))
+
+    assert js.most_in_flight == 5
+    assert ack_window.sent == 100
+
+
+def test_resize_shrinks_and_grows_the_window():
+    js = FakeJetStream({}, delay=0.002)
+    ack_window = window(js, window=32)
+
+    async def run():
+        await ack_window.send(messages(64))
+        # Up to 32 publishes are in flight, shrinking withholds their permits as they complete
+        await ack_window._resize(4)
+        await ack_window.drain()
+        withheld = ack_window._withheld
+        js.most_in_flight = 0
+        await ack_window.send(messages(64))
+        shrunk = js.most_in_flight
+        await ack_window._resize(12)
+        js.most_in_flight = 0
+        await ack_window.send(messages(64))
+        await ack_window.finish()
+        return withheld, shrunk
+
+    withheld, shrunk = asyncio.run(run())
+
+    # The permits of the publishes that were in flight are paid back as they complete
+    assert withheld == 0
+    assert shrunk == 4
+    assert js.most_in_flight == 12
+    assert ack_window.window == 12
+    assert ack_window._withheld == 0
+    assert ack_window.sent == 192
+
+
+def test_adaptive_window_stays_within_bounds():
+    js = FakeJetStream({})
+    ack_window = window(js, window=64, adaptive=AdaptiveTarget.LATENCY)
+    controller = ack_window.controller
+    controller.period = 0
+    assert (controller.minimum, controller.maximum) == (16, 1 << 16)
+
+    async def run():
+        # Every ack is over the target, the window shrinks to its lower bound and stays there
+        controller.target_latency = 1e-9
+        await ack_window.send(messages(200))
+        await ack_window.drain()
+        shrunk = ack_window.window
+        # Every ack is well under the target, the window grows but never past the upper bound
+        controller.target_latency = 60.0
+        controller.maximum = 40
+        await ack_window.send(messages(400))
+        await ack_window.finish()
+        return shrunk
+
+    assert asyncio.run(run()) == 16
+    assert controller.low == 16
+    assert ack_window.window == 40
+    assert controller.high == 64
+    assert ack_window.sent == 600
+    assert ack_window.metrics.tuning[-1]["final"] == 40
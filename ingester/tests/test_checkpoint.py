@@ -0,0 +1,141 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from checkpoint import Checkpoint, SentRows
+from partitioner import id_hashes, stripe
+
+RUN = {"mode": "jetstream", "partition": "multi", "consumer_count": 3}
+
+
+@pytest.fixture
+def frame() -> pl.DataFrame:
+    rng = np.random.default_rng(11)
+    ids = [f"ID{i}.ETR" for i in rng.integers(0, 50, 3000)]
+    return pl.DataFrame({"ID": ids}).with_row_index("row")
+
+
+def unsent_rows(df: pl.DataFrame, sent: list[int]) -> list[int]:
+    # Every connection sends its stripe in order, the first `sent[c]` rows of stripe `c` went out
+    stripes = stripe(id_hashes(df), len(sent))
+    seen = [0] * len(sent)
+    rows = []
+    for row, connection in zip(df["row"].to_list(), stripes.tolist()):
+        seen[connection] += 1
+        if seen[connection] > sent[connection]:
+            rows.append(row)
+    return rows
+
+
+@pytest.mark.parametrize(
+    "sent", [[0], [1234], [5000], [0, 0, 0], [400, 0, 250], [2000, 2000, 2000]]
+)
+@pytest.mark.parametrize("batch_size", [3000, 700, 1])
+def test_skip_across_batches(frame: pl.DataFrame, sent: list[int], batch_size: int):
+    rows = SentRows(sent)
+    kept = pl.concat(
+        rows.skip(frame.slice(start, batch_size))
+        for start in range(0, len(frame), batch_size)
+    )
+    assert kept["row"].to_list() == unsent_rows(frame, sent)
+
+
+@pytest.mark.parametrize("sent", [[1234], [400, 0, 250], [2000, 2000, 2000]])
+@pytest.mark.parametrize("batch_size", [3000, 700])
+def test_mask_matches_skip(frame: pl.DataFrame, sent: list[int], batch_size: int):
+    # Replays mask rows by their ID hashes, data files skip rows of frames
+    rows = SentRows(sent)
+    id_hash = id_hashes(frame)
+    kept = []
+    for start in range(0, len(frame), batch_size):
+        mask = rows.mask(id_hash[start : start + batch_size])
+        batch = np.arange(start, min(start + batch_size, len(frame)))
+        kept.extend((batch if mask is None else batch[mask]).tolist())
+    assert kept == unsent_rows(frame, sent)
+
+
+def test_nothing_sent_keeps_every_row(frame: pl.DataFrame):
+    assert SentRows([0, 0]).mask(id_hashes(frame)) is None
+    assert SentRows([0, 0]).skip(frame) is frame
+
+
+def test_record_and_complete(tmp_path):
+    state = Checkpoint(str(tmp_path / "checkpoint.json"))
+    state.start(RUN, resume=False)
+    assert state.sent("day.csv", "0", 2) == [0, 0]
+
+    state.record("day.csv", "0", [10, 20], [5, None])
+    state.record("day.csv", "0", [30, 40], [None, 9])
+    assert state.sent("day.csv", "0", 2) == [30, 40]
+    assert state.sent("day.csv", "1", 2) == [0, 0]
+    assert not state.completed("day.csv")
+
+    state.complete("day.csv")
+    assert state.completed("day.csv")
+    assert state.sent("day.csv", "0", 2) == [0, 0]
+
+
+def test_sequences_of_interrupted_run_are_kept(tmp_path):
+    state = Checkpoint(str(tmp_path / "checkpoint.json"))
+    state.start(RUN, resume=False)
+    state.record("day.csv", "0", [10, 20], [5, 7])
+    # Nothing acked yet after resuming
+    state.record("day.csv", "0", [12, 20], [None, None])
+    (entry,) = state.load()["files"].values()
+    assert entry["partitions"]["0"] == {"sent": [12, 20], "sequences": [5, 7]}
+
+
+def test_resume_keeps_progress(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    Checkpoint(path).start(RUN, resume=False)
+    Checkpoint(path).record("day.csv", "0", [10], [10])
+    Checkpoint(path).complete("other.csv")
+
+    state = Checkpoint(path)
+    state.start(RUN, resume=True)
+    assert state.sent("day.csv", "0", 1) == [10]
+    assert state.completed("other.csv")
+
+
+def test_start_over_clears_progress(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    Checkpoint(path).start(RUN, resume=False)
+    Checkpoint(path).complete("day.csv")
+
+    state = Checkpoint(path)
+    state.start({**RUN, "consumer_count": 5}, resume=False)
+    assert not state.completed("day.csv")
+    assert state.load()["run"]["consumer_count"] == 5
+
+
+def test_resume_stale_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    Checkpoint(path).start(RUN, resume=False)
+    Checkpoint(path).record("day.csv", "0", [10], [10])
+
+    # Partitions of another consumer count hold other messages
+    with pytest.raises(ValueError, match="other settings"):
+        Checkpoint(path).start({**RUN, "consumer_count": 5}, resume=True)
+    assert Checkpoint(path).sent("day.csv", "0", 1) == [10]
+
+
+@pytest.mark.parametrize("content", ["", '{"run": {"mode"', "[1, 2]"])
+def test_corrupt_checkpoint(tmp_path, content: str):
+    path = tmp_path / "checkpoint.json"
+    path.write_text(content)
+
+    with pytest.raises(ValueError, match="not a checkpoint"):
+        Checkpoint(str(path)).start(RUN, resume=True)
+    assert path.read_text() == content
+
+    # Starting over replaces it
+    state = Checkpoint(str(path))
+    state.start(RUN, resume=False)
+    assert state.load() == {"run": RUN, "files": {}}
+
+
+def test_resume_without_checkpoint(tmp_path):
+    state = Checkpoint(str(tmp_path / "checkpoint.json"))
+    state.start(RUN, resume=True)
+    assert not state.completed("day.csv")
+    assert state.sent("day.csv", "0", 3) == [0, 0, 0]
@@ -0,0 +1,165 @@
+import datetime
+from fractions import Fraction
+
+import polars as pl
+import pytest
+
+from engine import SCHEMA, breakouts, windows
+
+DAY = datetime.datetime(2021, 11, 8, tzinfo=datetime.UTC)
+MIDNIGHT_MS = int(DAY.timestamp() * 1000)
+# 08:00, a multiple of the 5 minute windows
+T0 = MIDNIGHT_MS + 8 * 60 * 60 * 1000
+MINUTE = 60 * 1000
+
+
+def at(ms: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(ms / 1000, datetime.UTC)
+
+
+def ticks(rows: list[tuple[str, float | None, int]]) -> pl.DataFrame:
+    return pl.DataFrame(
+        [(id, "E", last, timestamp) for id, last, timestamp in rows],
+        schema={
+            "ID": pl.String,
+            "SecType": pl.String,
+            "Last": pl.Float64,
+            "Timestamp": pl.Int64,
+        },
+        orient="row",
+    )
+
+
+@pytest.fixture
+def fixture() -> pl.DataFrame:
+    return ticks(
+        [
+            # Negative EMAs for B, a crossover on the first window of A would be bullish
+            ("B.ETR", -1.0, T0),
+            ("B.ETR", -1.0, T0 + 6 * MINUTE),
+            # Ignored, stamped at midnight or without a price
+            ("A.FR", 50.0, MIDNIGHT_MS + 500),
+            ("A.FR", None, T0 + 2 * MINUTE),
+            # Rounded up to the window at 08:05, the first tick opens it but is no movement
+            ("A.FR", 5.0, T0 + 3 * MINUTE),
+            ("A.FR", 7.0, T0 + 6 * MINUTE),
+            # Older than the start of the window, dropped
+            ("A.FR", 100.0, T0 + 4 * MINUTE),
+            # Exactly at the end still belongs to the window
+            ("A.FR", 6.0, T0 + 10 * MINUTE),
+            # 1 ms later tumbles it and opens the window at 08:10
+            ("A.FR", 10.0, T0 + 10 * MINUTE + 1),
+            ("A.FR", 11.0, T0 + 12 * MINUTE),
+            # 08:17:40 rounds to the window at 08:20
+            ("A.FR", -10.0, T0 + 17 * MINUTE + 40_000),
+            ("A.FR", 12.0, T0 + 21 * MINUTE),
+            ("A.FR", 10.0, T0 + 26 * MINUTE),
+            # Tumbles a window without movements, opens the last one that is never written
+            ("A.FR", 9.0, T0 + 31 * MINUTE),
+        ]
+    )
+
+
+# EMA_j = price * 2 / (1 + j) + EMA_j' * (1 - 2 / (1 + j)), starting from 0 and fed the price
+# of the tick tumbling each window: 10, -10, 10 and 9 for A, -1 for B
+EXPECTED = [
+    ("B.ETR", T0, -1.0, -1.0, -1.0, -1.0, 1, Fraction(-2, 39), Fraction(-2, 101), None),
+    (
+        "A.FR",
+        T0 + 5 * MINUTE,
+        5.0,
+        6.0,
+        7.0,
+        5.0,
+        2,
+        Fraction(20, 39),
+        Fraction(20, 101),
+        None,
+    ),
+    (
+        "A.FR",
+        T0 + 10 * MINUTE,
+        10.0,
+        11.0,
+        11.0,
+        10.0,
+        1,
+        Fraction(-40, 1521),
+        Fraction(-40, 10201),
+        "bearish",
+    ),
+    (
+        "A.FR",
+        T0 + 20 * MINUTE,
+        -10.0,
+        12.0,
+        12.0,
+        -10.0,
+        1,
+        Fraction(28940, 59319),
+        Fraction(200060, 1030301),
+        "bullish",
+    ),
+    (
+        "A.FR",
+        T0 + 25 * MINUTE,
+        10.0,
+        10.0,
+        10.0,
+        10.0,
+        0,
+        Fraction(2138522, 2313441),
+        Fraction(38351358, 104060401),
+        None,
+    ),
+]
+
+
+def test_windows(fixture: pl.DataFrame):
+    df = windows(fixture)
+
+    assert df.schema == pl.Schema(SCHEMA)
+    assert df.drop("EMA38", "EMA100").rows() == [
+        (id, "E", at(start), first, last, high, low, movements, breakout)
+        for id, start, first, last, high, low, movements, _, _, breakout in EXPECTED
+    ]
+    assert df["EMA38"].to_list() == pytest.approx(
+        [float(row[7]) for row in EXPECTED], rel=1e-12
+    )
+    assert df["EMA100"].to_list() == pytest.approx(
+        [float(row[8]) for row in EXPECTED], rel=1e-12
+    )
+
+
+def test_breakouts(fixture: pl.DataFrame):
+    df = breakouts(windows(fixture))
+
+    assert df.select("ID", "window_start", "Breakout").rows() == [
+        ("A.FR", at(T0 + 10 * MINUTE), "bearish"),
+        ("A.FR", at(T0 + 20 * MINUTE), "bullish"),
+    ]
+
+
+def test_first_window_never_breaks_out(fixture: pl.DataFrame):
+    # Alone, A starts with EMA38 > EMA100 and there is no previous window to cross
+    df = windows(fixture.filter(pl.col("ID") == "A.FR"))
+
+    assert df["Breakout"].to_list() == [None, "bearish", "bullish", None]
+
+
+def test_single_window_is_never_written():
+    df = windows(ticks([("A.FR", 1.0, T0), ("A.FR", 2.0, T0 + MINUTE)]))
+
+    assert df.is_empty()
+    assert df.schema == pl.Schema(SCHEMA)
+
+
+def test_tick_rounded_down_into_first_window():
+    # 08:02 rounds down to 08:00, so the first tick is also the first movement
+    df = windows(
+        ticks([("A.FR", 3.0, T0 + 2 * MINUTE), ("A.FR", 4.0, T0 + 8 * MINUTE)])
+    )
+
+    assert df.select("window_start", "First", "Last", "Movements").rows() == [
+        (at(T0), 3.0, 3.0, 1)
+    ]
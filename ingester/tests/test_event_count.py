@@ -0,0 +1,77 @@
+import polars as pl
+import pytest
+import typer
+
+from analysis import main as analysis
+
+HEADER = "# Comment lines are skipped\nID,SecType,Date,Time,Ask,Last,Trading time,Trading date\n"
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    days = {
+        # The first row of a day is always at midnight and is not counted in windows
+        "08-11-21": [
+            ("ALE.FR", "00:00:00.000"),
+            ("ALE.FR", "09:00:00.100"),
+            ("ALE.FR", "09:00:00.900"),
+            ("B.ETR", "09:00:01.500"),
+            ("ONLY.NL", "10:00:00.000"),
+        ],
+        "09-11-21": [
+            ("ALE.FR", "00:00:00.000"),
+            ("B.ETR", "09:00:00.200"),
+            ("B.ETR", "09:00:59.000"),
+            ("ALE.FR", "11:00:00.000"),
+        ],
+    }
+    for day, rows in days.items():
+        lines = [f"{id},E,{day},x,1,1.0,{time}," for id, time in rows]
+        path = tmp_path / f"debs2022-gc-trading-day-{day}.csv"
+        path.write_text(HEADER + "\n".join(lines) + "\n")
+    return str(tmp_path)
+
+
+def printed_frames(monkeypatch) -> list:
+    printed = []
+    monkeypatch.setattr("builtins.print", lambda value, *_, **__: printed.append(value))
+    return printed
+
+
+def test_ids_without_events_on_every_day_are_left_out(data_dir, monkeypatch):
+    printed = printed_frames(monkeypatch)
+    analysis.print_event_count(data_dir=data_dir)
+    counts = next(p for p in printed if isinstance(p, pl.DataFrame))
+    assert counts.rows() == [("ALE.FR", 5), ("B.ETR", 3)]
+
+    # Answered from the cached summaries the second time
+    printed.clear()
+    analysis.print_event_count(data_dir=data_dir)
+    assert not any("Summarising" in str(p) for p in printed)
+
+
+def test_windows_without_events_on_every_day_are_left_out(data_dir, monkeypatch):
+    printed = printed_frames(monkeypatch)
+    analysis.print_event_count_window(window="1m", data_dir=data_dir)
+    counts = next(p for p in printed if isinstance(p, pl.DataFrame))
+    assert [(str(start), events) for start, events in counts.rows()] == [
+        ("09:00:00", 5)
+    ]
+
+    printed.clear()
+    analysis.print_event_count_window(window="1s", data_dir=data_dir)
+    counts = next(p for p in printed if isinstance(p, pl.DataFrame))
+    assert [(str(start), events) for start, events in counts.rows()] == [
+        ("09:00:00", 3)
+    ]
+
+
+@pytest.mark.parametrize("window", ["500ms", "1500ms", "0s", "10", "5 m", "1x"])
+def test_windows_under_whole_seconds_are_rejected(data_dir, window: str):
+    with pytest.raises(typer.BadParameter, match="whole seconds"):
+        analysis.print_event_count_window(window=window, data_dir=data_dir)
+
+
+@pytest.mark.parametrize("window", ["1s", "1000ms", "90s", "1m30s", "5m", "1h", "1d"])
+def test_whole_second_windows(window: str):
+    assert analysis._whole_seconds(window)
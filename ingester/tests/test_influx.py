@@ -0,0 +1,153 @@
+import polars as pl
+import pytest
+import requests
+
+from influx import InfluxQueryClient, InfluxQueryError
+
+ANNOTATED = (
+    b"#datatype,string,long,dateTime:RFC3339,double,string\r\n"
+    b"#group,false,false,false,false,true\r\n"
+    b"#default,_result,,,,\r\n"
+)
+FIRST_TABLE = (
+    b",result,table,_time,_value,id\r\n"
+    b",_result,0,2021-11-08T08:00:00Z,1.5,ALE.FR\r\n"
+    b",_result,0,2021-11-08T08:05:00Z,2.25,ALE.FR\r\n"
+    b"\r\n"
+)
+SECOND_TABLE = (
+    b",result,table,_time,_value,id\r\n"
+    b",_result,1,2021-11-08T08:00:00Z,10.0,IEBBB.FR\r\n"
+    b"\r\n"
+)
+OTHER_COLUMNS = (
+    b",result,table,id,crossovers\r\n,counts,2,ALE.FR,3\r\n,counts,2,IEBBB.FR,0\r\n"
+)
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, chunk_size: int, status_code: int = 200):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.status_code = status_code
+        self.text = body.decode()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size: int):
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start : start + self.chunk_size]
+
+
+class FakeSession:
+    def __init__(self, response: FakeResponse):
+        self.response = response
+        self.requests: list[dict] = []
+
+    def post(self, url: str, **kwargs) -> FakeResponse:
+        self.requests.append({"url": url, **kwargs})
+        return self.response
+
+
+def client(body: bytes, chunk_size: int = 1 << 16, **kwargs) -> InfluxQueryClient:
+    client = InfluxQueryClient(**kwargs)
+    client.session = FakeSession(FakeResponse(body, chunk_size))
+    return client
+
+
+def values(frames: list[pl.DataFrame]) -> list[tuple]:
+    return [row for frame in frames for row in frame.rows()]
+
+
+def test_query_sends_flux():
+    influx = client(FIRST_TABLE)
+
+    influx.query('from(bucket: "b")')
+
+    (request,) = influx.session.requests
+    assert request["url"].endswith("/api/v2/query")
+    assert request["json"]["query"] == 'from(bucket: "b")'
+    assert request["stream"]
+
+
+def test_tables_with_same_columns():
+    frames = list(client(FIRST_TABLE + SECOND_TABLE).query_batches(""))
+
+    assert [f.columns for f in frames] == [["_time", "_value", "id"]]
+    assert values(frames) == [
+        ("2021-11-08T08:00:00Z", 1.5, "ALE.FR"),
+        ("2021-11-08T08:05:00Z", 2.25, "ALE.FR"),
+        ("2021-11-08T08:00:00Z", 10.0, "IEBBB.FR"),
+    ]
+
+
+def test_tables_with_other_columns():
+    frames = list(client(FIRST_TABLE + OTHER_COLUMNS).query_batches(""))
+
+    assert [f.columns for f in frames] == [
+        ["_time", "_value", "id"],
+        ["id", "crossovers"],
+    ]
+    assert frames[1].rows() == [("ALE.FR", 3), ("IEBBB.FR", 0)]
+
+
+def test_annotation_rows_are_skipped():
+    body = ANNOTATED + FIRST_TABLE + ANNOTATED + SECOND_TABLE
+
+    frames = list(client(body).query_batches(""))
+
+    assert [f.columns for f in frames] == [["_time", "_value", "id"]]
+    assert len(values(frames)) == 3
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 31, 64])
+def test_rows_split_across_chunks(chunk_size: int):
+    body = ANNOTATED + FIRST_TABLE + SECOND_TABLE + OTHER_COLUMNS
+    whole = list(client(body).query_batches(""))
+
+    split = list(client(body, chunk_size).query_batches(""))
+
+    assert [f.columns for f in split] == [f.columns for f in whole]
+    assert values(split) == values(whole)
+
+
+def test_last_row_without_newline():
+    frames = list(client(OTHER_COLUMNS.rstrip(), chunk_size=5).query_batches(""))
+
+    assert values(frames) == [("ALE.FR", 3), ("IEBBB.FR", 0)]
+
+
+def test_batches_of_batch_bytes():
+    rows = b"".join(
+        b",_result,0,2021-11-08T08:00:%02dZ,%d.5,ALE.FR\r\n" % (i, i) for i in range(50)
+    )
+    body = b",result,table,_time,_value,id\r\n" + rows
+
+    frames = list(client(body, chunk_size=100, batch_bytes=200).query_batches(""))
+
+    assert len(frames) > 1
+    assert pl.concat(frames)["_value"].to_list() == [i + 0.5 for i in range(50)]
+
+
+def test_schema_overrides():
+    df = client(FIRST_TABLE).query("", schema_overrides={"_value": pl.Float32})
+
+    assert df.schema["_value"] == pl.Float32
+
+
+def test_empty_result():
+    assert client(b"\r\n").query("").is_empty()
+
+
+def test_error_status():
+    influx = client(b"bad query")
+    influx.session.response.status_code = 400
+
+    with pytest.raises(InfluxQueryError, match="Status 400") as error:
+        influx.query("")
+    assert isinstance(error.value, requests.RequestException)
+    assert error.value.response.status_code == 400
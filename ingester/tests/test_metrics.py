@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import metrics as metrics_module
+from metrics import (
+    MetricsConfig,
+    MetricsExport,
+    MetricsExporter,
+    PublisherMetrics,
+    collect_reports,
+)
+
+
+@pytest.fixture
+def published() -> PublisherMetrics:
+    published = PublisherMetrics()
+    published.sent(10, 250)
+    published.flush_latency.record(0.002)
+    return published
+
+
+def exporter(
+    tmp_path, published: PublisherMetrics, export: MetricsExport
+) -> MetricsExporter:
+    config = MetricsConfig(
+        run="test", directory=str(tmp_path), export=export, interval=0.01
+    )
+    return MetricsExporter(config, "exchange.FR", lambda: published, total=20)
+
+
+def test_prometheus_export_and_report(tmp_path, published: PublisherMetrics):
+    metrics = exporter(tmp_path, published, MetricsExport.PROMETHEUS)
+
+    async def run():
+        metrics.start_exporting()
+        await asyncio.sleep(0.05)
+        await metrics.stop()
+
+    asyncio.run(run())
+
+    prom = (tmp_path / f"{metrics.worker}.prom").read_text()
+    assert 'ingester_messages_total{run="test",subject="exchange.FR"' in prom
+    assert "ingester_progress_ratio" in prom
+    assert not list(tmp_path.glob("*.tmp"))
+    (report,) = collect_reports(str(tmp_path))
+    assert report["messages"] == 10 and report["bytes"] == 250 and report["total"] == 20
+    assert collect_reports(str(tmp_path)) == []
+
+
+def test_writes_off_the_event_loop(tmp_path, published: PublisherMetrics, monkeypatch):
+    threads = []
+    for name in ("_write_prometheus", "_write_report"):
+        write = getattr(MetricsExporter, name)
+
+        def recorded(self, *args, write=write):
+            threads.append(threading.current_thread())
+            write(self, *args)
+
+        monkeypatch.setattr(MetricsExporter, name, recorded)
+    metrics = exporter(tmp_path, published, MetricsExport.PROMETHEUS)
+
+    async def run():
+        metrics.start_exporting()
+        await metrics.export()
+        await metrics.stop()
+
+    asyncio.run(run())
+
+    assert len(threads) == 3
+    assert threading.main_thread() not in threads
+
+
+def test_influx_failure_gives_up(tmp_path, published: PublisherMetrics, monkeypatch):
+    calls = []
+
+    def post(*args, **kwargs):
+        calls.append(kwargs["data"])
+        raise metrics_module.requests.exceptions.ConnectionError("down")
+
+    monkeypatch.setattr(metrics_module.requests, "post", post)
+    metrics = exporter(tmp_path, published, MetricsExport.INFLUX)
+
+    async def run():
+        await metrics.export()
+        await metrics.export()
+
+    asyncio.run(run())
+
+    assert len(calls) == 1
+    assert calls[0].startswith("ingestion,run=test,subject=exchange.FR")
+
+
+def test_stop_waits_for_write_in_flight(
+    tmp_path, published: PublisherMetrics, monkeypatch
+):
+    write = MetricsExporter._write_prometheus
+    written = []
+
+    def slow(self, text):
+        time.sleep(0.05)
+        write(self, text)
+        written.append(text)
+
+    monkeypatch.setattr(MetricsExporter, "_write_prometheus", slow)
+    metrics = exporter(tmp_path, published, MetricsExport.PROMETHEUS)
+
+    async def run():
+        metrics.start_exporting()
+        # The first periodic export is still writing when the run ends
+        await asyncio.sleep(0.02)
+        published.sent(5, 100)
+        await metrics.stop()
+
+    asyncio.run(run())
+
+    assert len(written) == 2
+    assert (tmp_path / f"{metrics.worker}.prom").read_text() == written[-1]
+    assert 'exchange.FR",worker=' in written[-1] and "} 15\n" in written[-1]
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import numpy as np
+import polars as pl
+import pytest
+
+from pacing import DUE_COLUMN, Pacer, Timeline, scheduled_offsets
+from partitioner import hash_key, split_frame
+
+DAY = 1_636_358_400_000
+
+
+@pytest.fixture
+def frame() -> pl.DataFrame:
+    rng = np.random.default_rng(3)
+    # A quiet night, then the market opens and trades pause for a minute around noon
+    timestamps = np.sort(
+        np.concatenate(
+            [
+                DAY + rng.integers(0, 5_000, 20),
+                DAY + 8 * 3_600_000 + rng.integers(0, 60_000, 500),
+                DAY + 9 * 3_600_000 + rng.integers(0, 60_000, 500),
+            ]
+        )
+    )
+    ids = [f"ID{i}.ETR" for i in rng.integers(0, 40, len(timestamps))]
+    return pl.DataFrame({"ID": ids, "Timestamp": timestamps})
+
+
+def test_partitions_share_the_schedule(frame: pl.DataFrame):
+    scheduled = Timeline(max_gap_ms=1_000).schedule(frame)
+    parts = split_frame(scheduled, hash_key(2), range(2))
+    assert all(len(part) for part in parts.values())
+    # The same trading timestamp is due at the same offset in every partition
+    due = [
+        dict(zip(part["Timestamp"].to_list(), part[DUE_COLUMN].to_list()))
+        for part in parts.values()
+    ]
+    shared = due[0].keys() & due[1].keys()
+    assert shared
+    for timestamp in shared:
+        assert due[0][timestamp] == due[1][timestamp]
+    # Partitions keep the offsets of the day, they are not anchored on their own first message
+    first = min(parts.values(), key=lambda part: part["Timestamp"][0])
+    later = max(parts.values(), key=lambda part: part["Timestamp"][0])
+    if first["Timestamp"][0] != later["Timestamp"][0]:
+        assert later[DUE_COLUMN][0] > 0
+
+
+def test_long_gaps_are_shortened(frame: pl.DataFrame):
+    offsets = Timeline(max_gap_ms=1_000).offsets(frame["Timestamp"].to_numpy())
+    gaps = np.diff(offsets, prepend=0)
+    assert offsets[0] == 0
+    assert gaps.max() == 1_000
+    # Both idle periods of hours are a second long
+    assert (gaps == 1_000).sum() >= 2
+    assert offsets[-1] < 4 * 60_000
+
+    kept = Timeline().offsets(frame["Timestamp"].to_numpy())
+    assert kept[-1] == frame["Timestamp"][-1] - frame["Timestamp"][0]
+
+
+def test_batches_continue_the_day(frame: pl.DataFrame):
+    timestamps = frame["Timestamp"].to_numpy()
+    timeline = Timeline(max_gap_ms=1_000)
+    batches = np.concatenate(
+        [
+            timeline.offsets(timestamps[i : i + 97])
+            for i in range(0, len(timestamps), 97)
+        ]
+    )
+    assert batches.tolist() == Timeline(1_000).offsets(timestamps).tolist()
+
+
+def test_missing_and_out_of_order_timestamps():
+    timestamps = np.array([-1, 1_000, 1_500, 1_200, -1, 2_000])
+    # Sent together with the message before them
+    assert Timeline().offsets(timestamps).tolist() == [0, 0, 500, 500, 500, 1_000]
+
+
+def test_frames_without_schedule():
+    assert scheduled_offsets(pl.DataFrame({"ID": ["A.ETR"]})) is None
+
+
+def test_pacer_releases_slices_when_due():
+    pacer = Pacer(speed=100, slice_ms=10)
+    sent = []
+
+    async def send(due: slice):
+        sent.append((due.start, due.stop, time.monotonic()))
+
+    async def replay():
+        start = time.monotonic()
+        await pacer.run(np.array([0, 0, 1_500, 1_505, 3_000]), send)
+        return start
+
+    start = asyncio.run(replay())
+    assert [(first, stop) for first, stop, _ in sent] == [(0, 2), (2, 4), (4, 5)]
+    # At 100x, 3 seconds of the day take 30 ms
+    assert sent[-1][2] - start >= 0.029
+    assert len(pacer.lags) == 3
@@ -0,0 +1,117 @@
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+import numpy as np
+import polars as pl
+import pytest
+
+from partitioner import exchange_key, hash_key, id_hashes, split_frame, stripe
+
+IDS = [
+    f"{name}.{exchange}"
+    for name in ("A", "BB", "CCC", "ÄÖ")
+    for exchange in ("ETR", "FR", "NL")
+]
+
+
+@pytest.fixture
+def frame() -> pl.DataFrame:
+    rng = np.random.default_rng(7)
+    ids = [*rng.choice(IDS, 2000).tolist(), "UNKNOWN.XX", "B.FR"]
+    return pl.DataFrame({"ID": ids}).with_row_index("row")
+
+
+def assert_partitioned(parts: dict, kept: pl.DataFrame):
+    # Every kept row lands in exactly one partition, no ID is spread over two
+    rows = pl.concat(parts.values())["row"]
+    assert sorted(rows.to_list()) == kept["row"].to_list()
+    owners = {}
+    for key, part in parts.items():
+        for id in part["ID"].unique():
+            assert owners.setdefault(id, key) == key
+        # Rows keep their original order, within every ID too
+        assert part["row"].is_sorted()
+
+
+@pytest.mark.parametrize("consumer_count", [1, 3, 5])
+def test_split_by_hash(frame: pl.DataFrame, consumer_count: int):
+    parts = split_frame(frame, hash_key(consumer_count), range(consumer_count))
+
+    assert list(parts) == list(range(consumer_count))
+    assert_partitioned(parts, frame)
+    hashes = id_hashes(frame)
+    for key, part in parts.items():
+        assert (hashes[part["row"].to_numpy()] % consumer_count == key).all()
+
+
+def test_split_by_exchange(frame: pl.DataFrame):
+    parts = split_frame(frame, exchange_key())
+
+    assert set(parts) == {"ETR", "FR", "NL"}
+    # IDs of unknown exchanges are dropped
+    assert_partitioned(parts, frame.filter(pl.col("ID") != "UNKNOWN.XX"))
+    for exchange, part in parts.items():
+        assert part["ID"].str.ends_with(exchange).all()
+
+
+def test_split_missing_partitions(frame: pl.DataFrame):
+    only_fr = frame.filter(pl.col("ID").str.ends_with("FR"))
+
+    parts = split_frame(only_fr, exchange_key(), ["ETR", "FR", "NL"])
+
+    assert parts["FR"].equals(only_fr)
+    assert parts["ETR"].is_empty() and parts["NL"].is_empty()
+    assert parts["ETR"].schema == only_fr.schema
+
+
+def test_split_by_function(frame: pl.DataFrame):
+    parts = split_frame(frame, lambda df: pl.Series(id_hashes(df) % 2))
+
+    assert_partitioned(parts, frame)
+
+
+@pytest.mark.parametrize("count", [1, 2, 4, 7])
+def test_stripe(frame: pl.DataFrame, count: int):
+    hashes = id_hashes(frame)
+
+    stripes = stripe(hashes, count)
+
+    assert stripes.dtype == np.int64
+    assert ((stripes >= 0) & (stripes < count)).all()
+    # One stripe per ID
+    per_id = pl.DataFrame({"ID": frame["ID"], "stripe": stripes}).group_by("ID")
+    assert (per_id.agg(pl.col("stripe").n_unique())["stripe"] == 1).all()
+
+
+def test_stripe_balanced_within_partition():
+    hashes = id_hashes(pl.DataFrame({"ID": [f"ID{i}.FR" for i in range(20_000)]}))
+    partition = hashes[hashes % 5 == 2]
+
+    counts = np.bincount(stripe(partition, 4), minlength=4)
+
+    assert counts.min() > 0.9 * len(partition) / 4
+
+
+def test_stripe_deterministic_across_processes():
+    # Workers of other processes and replay files must agree on hashes and stripes
+    script = (
+        "import json, polars as pl; "
+        "from partitioner import id_hashes, stripe; "
+        f"hashes = id_hashes(pl.DataFrame({{'ID': {IDS!r}}})); "
+        "print(json.dumps([hashes.tolist(), stripe(hashes, 4).tolist()]))"
+    )
+    ingester = pathlib.Path(__file__).resolve().parent.parent / "ingester"
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=ingester,
+        capture_output=True,
+        check=True,
+        text=True,
+        env={**os.environ, "PYTHONHASHSEED": "random"},
+    ).stdout
+
+    hashes = id_hashes(pl.DataFrame({"ID": IDS}))
+    assert json.loads(output) == [hashes.tolist(), stripe(hashes, 4).tolist()]
@@ -0,0 +1,228 @@
+import asyncio
+
+import nats
+import numpy as np
+import polars as pl
+import pytest
+
+from partitioner import id_hashes, stripe
+from producer import (
+    AdaptiveTarget,
+    ConnectionPool,
+    CoreBatchWriter,
+    CorePublisher,
+    FrameWriter,
+    PublishConfig,
+    nats_core_publisher,
+)
+from utils import encode_nats_messages, iter_nats_messages
+
+
+class RecordingPublisher:
+    def __init__(self):
+        self.sent: list[bytes] = []
+        self.calls = 0
+
+    async def send(self, messages, bar=None):
+        self.calls += 1
+        for message in messages:
+            self.sent.append(bytes(message))
+            if bar:
+                bar()
+
+
+class FakeCoreClient:
+    pending_data_size = 0
+
+    def __init__(self):
+        self.published: list[tuple[str, bytes, dict | None]] = []
+        self.flushed: list[int] = []
+
+    async def publish(self, subject, payload, headers=None):
+        self.published.append((subject, bytes(payload), headers))
+
+    async def flush(self):
+        self.flushed.append(len(self.published))
+
+
+@pytest.fixture
+def encoded() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    ids = [f"ID{i % 37}.FR" for i in range(500)]
+    df = pl.DataFrame(
+        {
+            "ID": ids,
+            "SecType": ["E"] * len(ids),
+            "Last": np.arange(len(ids), dtype=np.float64),
+            "Timestamp": np.arange(len(ids), dtype=np.int64),
+        }
+    )
+    buffer, offsets = encode_nats_messages(df)
+    return buffer, offsets, id_hashes(df)
+
+
+@pytest.mark.parametrize("rows", [None, np.arange(499, -1, -3)])
+def test_pool_sends_every_stripe_in_order(encoded, rows):
+    buffer, offsets, id_hash = encoded
+    publishers = [RecordingPublisher() for _ in range(3)]
+    pool = ConnectionPool([], publishers)
+    stripes = pool.stripes(id_hash, rows)
+    counted = []
+
+    asyncio.run(pool.send(buffer, offsets, rows, stripes, lambda: counted.append(1)))
+
+    selected = np.arange(len(offsets) - 1) if rows is None else rows
+    messages = [bytes(m) for m in iter_nats_messages(buffer, offsets, selected)]
+    assert len(counted) == len(selected)
+    for connection, publisher in enumerate(publishers):
+        assert publisher.calls == 1
+        assert publisher.sent == [
+            message
+            for message, c in zip(messages, stripe(id_hash[selected], 3))
+            if c == connection
+        ]
+
+
+def test_pool_single_connection(encoded):
+    buffer, offsets, id_hash = encoded
+    publisher = RecordingPublisher()
+    pool = ConnectionPool([], [publisher])
+
+    asyncio.run(pool.send(buffer, offsets, None, pool.stripes(id_hash)))
+
+    assert pool.stripes(id_hash) is None
+    assert publisher.sent == [bytes(m) for m in iter_nats_messages(buffer, offsets)]
+
+
+def test_pool_skips_empty_stripes(encoded):
+    buffer, offsets, _ = encoded
+    publishers = [RecordingPublisher() for _ in range(2)]
+    pool = ConnectionPool([], publishers)
+    rows = np.arange(10)
+
+    asyncio.run(pool.send(buffer, offsets, rows, np.zeros(10, dtype=np.int64)))
+
+    assert len(publishers[0].sent) == 10
+    assert publishers[1].calls == 0
+
+
+@pytest.mark.parametrize(
+    ("nats_version", "supported"),
+    [
+        ("2.9.0", True),
+        ("2.16.1", True),
+        ("2.8.0", False),
+        ("2.17.0", False),
+        ("3.0.0", False),
+        ("0.0.0", False),
+        ("main", False),
+    ],
+)
+def test_frame_writer_version_guard(nats_version: str, supported: bool):
+    assert FrameWriter.supported(nats_version) == supported
+
+
+def test_installed_nats_supports_frame_writer():
+    assert FrameWriter.supported()
+
+
+def test_core_publishes_through_nc_publish_by_default():
+    publisher = nats_core_publisher(FakeCoreClient(), "exchange", PublishConfig())
+    assert isinstance(publisher, CorePublisher)
+
+
+def test_unsupported_nats_publishes_one_at_a_time(monkeypatch):
+    config = PublishConfig(batch_messages=100)
+    assert isinstance(
+        nats_core_publisher(FakeCoreClient(), "exchange", config), CoreBatchWriter
+    )
+
+    monkeypatch.setattr(FrameWriter, "supported", classmethod(lambda cls: False))
+
+    assert isinstance(
+        nats_core_publisher(FakeCoreClient(), "exchange", config), CorePublisher
+    )
+
+
+def test_batch_writer_delivers_frames(encoded):
+    buffer, offsets, _ = encoded
+    messages = [bytes(m) for m in iter_nats_messages(buffer, offsets)]
+
+    async def run():
+        try:
+            nc = await nats.connect(
+                "nats://localhost:4222", connect_timeout=1, max_reconnect_attempts=0
+            )
+        except Exception:
+            pytest.skip("No NATS server on localhost:4222")
+        received = []
+        done = asyncio.Event()
+
+        async def receive(msg):
+            received.append(msg)
+            if len(received) == len(messages):
+                done.set()
+
+        await nc.subscribe("test.frames", cb=receive)
+        await nc.flush()
+        writer = CoreBatchWriter(
+            nc, "test.frames", PublishConfig(batch_messages=64, stamp_every=10)
+        )
+        await writer.send(iter_nats_messages(buffer, offsets))
+        await writer.finish()
+        await asyncio.wait_for(done.wait(), 5)
+        stats = dict(nc.stats)
+        await nc.close()
+        return writer, received, stats
+
+    writer, received, stats = asyncio.run(run())
+
+    assert [msg.data for msg in received] == messages
+    assert [msg.headers is not None for msg in received] == [
+        (i + 1) % 10 == 0 for i in range(len(messages))
+    ]
+    assert writer.sent == len(messages)
+    assert stats["out_msgs"] == len(messages)
+    assert stats["out_bytes"] == sum(map(len, messages))
+
+
+def test_controller_limit_follows_pending_size():
+    config = PublishConfig(adaptive=AdaptiveTarget.LATENCY, pending_size=1 << 16)
+
+    controller = config.controller("window", 1000, 16, 1 << 16)
+
+    assert controller.pending_limit == 1 << 15
+    assert PublishConfig().controller("window", 1000, 16, 1 << 16) is None
+
+
+@pytest.mark.parametrize("stamp_every", [0, 4])
+def test_core_publisher_flushes_and_stamps(stamp_every: int):
+    nc = FakeCoreClient()
+    publisher = CorePublisher(
+        nc, "exchange.FR", PublishConfig(flush_interval=9, stamp_every=stamp_every)
+    )
+    messages = [memoryview(b"m%d" % i) for i in range(25)]
+    counted = []
+
+    asyncio.run(publisher.send(messages, lambda: counted.append(1)))
+
+    assert [payload for _, payload, _ in nc.published] == [bytes(m) for m in messages]
+    assert {subject for subject, _, _ in nc.published} == {"exchange.FR"}
+    stamped = [headers is not None for _, _, headers in nc.published]
+    assert stamped == [bool(stamp_every) and (i + 1) % 4 == 0 for i in range(25)]
+    # Flushed once more than `flush_interval` messages are waiting, and at the end
+    assert nc.flushed == [10, 20, 25]
+    assert publisher.sent == 25 and len(counted) == 25
+
+
+def test_core_publisher_follows_controller():
+    nc = FakeCoreClient()
+    config = PublishConfig(flush_interval=4, adaptive=AdaptiveTarget.LATENCY)
+    publisher = CorePublisher(nc, "exchange.FR", config)
+    publisher.controller.period = 0
+    # Every flush is over the target latency, so the interval shrinks to its minimum
+    publisher.controller.target_latency = -1.0
+
+    asyncio.run(publisher.send([memoryview(b"m")] * 40))
+
+    assert nc.flushed[:3] == [5, 16, 27]
+    assert publisher.controller.value == publisher.controller.minimum
@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+
+import nats
+import numpy as np
+import pytest
+
+import producer
+from main import IngestionMode, IngestRun, Partition, prepare_day, publish_days
+from utils import (
+    create_nats_message,
+    encode_nats_messages,
+    preprocess_csv_file,
+    read_shared_frame,
+)
+
+IDS = ["ALE.FR", "B.ETR", "ÉTÉ€.NL", "C.NL", "D.FR", "E.ETR"]
+DAYS = ["08-11-21", "09-11-21", "10-11-21"]
+
+
+def write_day(directory, day: str, seed: int) -> str:
+    rng = np.random.default_rng(seed)
+    lines = ["ID,SecType,Date,Time,Ask,Last,Trading time,Trading date"]
+    for i in range(400):
+        lines.append(
+            f"{IDS[rng.integers(len(IDS))]},E,{day},x,1,{i / 8},"
+            f"09:{i // 60:02}:{i % 60:02}.{seed:03},"
+        )
+    path = directory / f"debs2022-gc-trading-day-{day}.csv"
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def ingest_run(tmp_path, parallel_days: int) -> IngestRun:
+    return IngestRun(
+        mode=IngestionMode.NATS_CORE,
+        partition=Partition.MULTI,
+        config=producer.PublishConfig(),
+        state=None,
+        metrics_dir=str(tmp_path),
+        consumer_count=2,
+        preload_days=1,
+        parallel_days=parallel_days,
+    )
+
+
+def messages(file: str) -> collections.Counter:
+    df = preprocess_csv_file(file).select(
+        "ID", "SecType", "Last", "Trading time", "Trading date"
+    )
+    return collections.Counter(create_nats_message(*row) for row in df.iter_rows())
+
+
+async def publish_received(
+    run: IngestRun, files: list[str], subject: str
+) -> list[tuple[str, bytes]]:
+    """Runs `publish_days` and returns the messages a subscriber to `subject` received."""
+    try:
+        nc = await nats.connect(
+            "nats://localhost:4222", connect_timeout=1, max_reconnect_attempts=0
+        )
+    except Exception:
+        pytest.skip("No NATS server on localhost:4222")
+    received = []
+
+    async def handler(msg):
+        received.append((msg.subject, msg.data))
+
+    await nc.subscribe(subject, cb=handler)
+    await nc.flush()
+    loop = asyncio.get_running_loop()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            await loop.run_in_executor(executor, publish_days, run, files)
+    finally:
+        expected = sum(sum(messages(file).values()) for file in files)
+        for _ in range(100):
+            if len(received) >= expected:
+                break
+            await asyncio.sleep(0.05)
+        await nc.close()
+    return received
+
+
+def test_parallel_days_publish_every_row_once(tmp_path):
+    files = [write_day(tmp_path, day, seed) for seed, day in enumerate(DAYS)]
+    run = ingest_run(tmp_path, parallel_days=2)
+
+    received = asyncio.run(publish_received(run, files, "*.exchange.*"))
+
+    assert run.message_count == 3 * 400
+    assert sorted(r["file"] for r in run.runs) == sorted(files)
+    for file, day in zip(files, ["2021-11-08", "2021-11-09", "2021-11-10"]):
+        # Days published side by side go to subjects of their own
+        sent = collections.Counter(
+            data for subject, data in received if subject.startswith(day)
+        )
+        assert sent == messages(file)
+        assert {subject for subject, _ in received if subject.startswith(day)} == {
+            f"{day}.exchange.0",
+            f"{day}.exchange.1",
+        }
+
+
+def test_loader_failures_propagate(tmp_path):
+    files = [
+        write_day(tmp_path, DAYS[0], 0),
+        str(tmp_path / f"debs2022-gc-trading-day-{DAYS[1]}.csv"),
+    ]
+    run = ingest_run(tmp_path, parallel_days=1)
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(publish_received(run, files, "exchange.*"))
+    # The day loaded before the missing one is still published in full
+    assert [r["file"] for r in run.runs] == files[:1]
+    assert run.message_count == 400
+
+
+def test_first_day_failing_to_load_stops_the_run(tmp_path):
+    missing = str(tmp_path / f"debs2022-gc-trading-day-{DAYS[0]}.csv")
+    files = [missing, write_day(tmp_path, DAYS[1], 1)]
+    run = ingest_run(tmp_path, parallel_days=2)
+
+    # Raised before any publisher is started, no NATS server needed
+    with pytest.raises(FileNotFoundError):
+        publish_days(run, files)
+    assert run.runs == []
+    assert run.message_count == 0
+
+
+def test_prepared_partitions_cover_the_day(tmp_path):
+    file = write_day(tmp_path, DAYS[0], 0)
+
+    day = prepare_day(file, Partition.MULTI, 3, prefix="2021-11-08")
+    try:
+        assert day.message_count == 400
+        assert day.subjects == {i: f"2021-11-08.exchange.{i}" for i in range(3)}
+        sent = collections.Counter()
+        for path, _ in day.partitions.values():
+            buffer, offsets = encode_nats_messages(read_shared_frame(path))
+            sent.update(
+                buffer[start:end].tobytes()
+                for start, end in itertools.pairwise(offsets)
+            )
+        assert sent == messages(file)
+    finally:
+        day.shared.cleanup()
@@ -0,0 +1,118 @@
+import datetime
+import json
+import os
+import struct
+
+import numpy as np
+import polars as pl
+import pytest
+
+import replay
+from partitioner import HASH_SEED, id_hashes
+from replay import ALIGNMENT, MAGIC, ReplayFile, compile_replay_file
+from utils import create_nats_message
+
+DATE = datetime.date(2021, 11, 8)
+
+
+@pytest.fixture
+def frame() -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "ID": ["ALE.FR", "B.ETR", "ÉTÉ€.NL", "ALE.FR", "UNKNOWN.XX", "C.NL"],
+            "SecType": ["E", "I", "E", "E", "", "E"],
+            "Last": [1.5, None, 42.125, -3.25, 0.0, 7.0],
+            "Trading time": [
+                "08:00:00.000",
+                "08:00:01.123",
+                None,
+                "12:34:56.789",
+                "23:59:59.999",
+                "00:00:00.001",
+            ],
+            "Trading date": [DATE] * 6,
+        },
+        schema_overrides={"Last": pl.Float64},
+    )
+
+
+@pytest.fixture
+def path(frame: pl.DataFrame, tmp_path) -> str:
+    output = str(tmp_path / "day.replay")
+    size = compile_replay_file(frame, output)
+    assert size == os.path.getsize(output)
+    return output
+
+
+def test_round_trip(frame: pl.DataFrame, path: str):
+    with open(path, "rb") as f:
+        assert f.read(len(MAGIC)) == MAGIC
+
+    file = ReplayFile(path)
+    assert file.date == str(DATE)
+    assert file.message_count == len(frame)
+    for name, section in file.header["sections"].items():
+        assert section["offset"] % ALIGNMENT == 0, name
+
+    expected = [create_nats_message(*row) for row in frame.iter_rows()]
+    assert file.offsets[0] == 0
+    assert file.offsets[-1] == len(file.payloads)
+    assert [
+        file.payloads[start:end].tobytes()
+        for start, end in zip(file.offsets[:-1], file.offsets[1:])
+    ] == expected
+
+    assert file.id_hash.tolist() == id_hashes(frame).tolist()
+    assert file.exchange.tolist() == [1, 0, 2, 1, replay.UNKNOWN_EXCHANGE, 2]
+    assert file.exchange_rows("FR").tolist() == [0, 3]
+    assert sorted(
+        np.concatenate([file.hash_rows(3, i) for i in range(3)]).tolist()
+    ) == list(range(len(frame)))
+
+
+def test_empty_frame(frame: pl.DataFrame, tmp_path):
+    output = str(tmp_path / "empty.replay")
+    compile_replay_file(frame.clear(), output)
+    file = ReplayFile(output)
+    assert file.message_count == 0
+    assert file.date is None
+    assert file.offsets.tolist() == [0]
+
+
+def rewrite_header(path: str, **changes):
+    with open(path, "r+b") as f:
+        data = f.read()
+        (length,) = struct.unpack_from("<Q", data, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(data[start : start + length])
+        header.update(changes)
+        encoded = json.dumps(header).encode("utf-8")
+        # The header has reserved room to grow into
+        f.seek(len(MAGIC))
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+
+
+def test_hashes_of_another_polars_version_are_rejected(path: str):
+    rewrite_header(path, hash_probe=12345, polars="0.1.0")
+    with pytest.raises(ValueError, match="hashes IDs differently"):
+        ReplayFile(path)
+
+
+def test_other_hash_seed_is_rejected(path: str):
+    rewrite_header(path, hash_seed=HASH_SEED + 1)
+    with pytest.raises(ValueError, match="compile it again"):
+        ReplayFile(path)
+
+
+def test_older_version_is_rejected(path: str):
+    rewrite_header(path, version=1)
+    with pytest.raises(ValueError, match="Unsupported replay file version 1"):
+        ReplayFile(path)
+
+
+def test_not_a_replay_file(tmp_path):
+    path = tmp_path / "day.csv"
+    path.write_bytes(b"ID,SecType\n" * 10)
+    with pytest.raises(ValueError, match="not a replay file"):
+        ReplayFile(str(path))
@@ -0,0 +1,89 @@
+import os
+
+import polars as pl
+import pytest
+
+from store import convert_day, load_day, scan_day, store_path, stored_day
+from utils import create_nats_message, encode_nats_messages, preprocess_csv_file
+
+CSV = """\
+# Comment lines are skipped
+ID,SecType,Date,Time,Ask,Last,Trading time,Trading date
+ALE.FR,E,08-11-2021,x,1,1.5,08:00:00.000,
+IEBBB.FR,I,08-11-2021,x,1,,08:00:01.123,
+ÉTÉ€.NL,E,08-11-2021,x,1,42.125,,
+ALE.FR,E,08-11-2021,x,1,-3.25,12:34:56.789,
+UNKNOWN.XX,E,08-11-2021,x,1,0.0,23:59:59.999,
+B.ETR,E,08-11-2021,x,1,7,00:00:00.001,
+ALE.FR,E,08-11-2021,x,1,2.0,12:34:56.790,
+"""
+
+
+@pytest.fixture
+def day(tmp_path) -> str:
+    path = tmp_path / "debs2022-gc-trading-day-08-11-21.csv"
+    path.write_text(CSV)
+    return str(path)
+
+
+def expected(file: str, entity: str | None = None) -> list[bytes]:
+    df = preprocess_csv_file(file, entity)
+    return [
+        create_nats_message(*row)
+        for row in df.select(
+            "ID", "SecType", "Last", "Trading time", "Trading date"
+        ).iter_rows()
+    ]
+
+
+def messages(df: pl.DataFrame) -> list[bytes]:
+    buffer, offsets = encode_nats_messages(df)
+    return [
+        buffer[offsets[i] : offsets[i + 1]].tobytes() for i in range(len(offsets) - 1)
+    ]
+
+
+def test_csv_is_read_without_converting(day: str):
+    assert messages(load_day(day)) == expected(day)
+    assert not os.path.exists(store_path(day))
+
+
+def test_converted_day_round_trips(day: str):
+    output = convert_day(day)
+    assert output == store_path(day)
+    assert stored_day(day) == output
+
+    assert messages(load_day(day)) == expected(day)
+    assert messages(load_day(output)) == expected(day)
+
+
+def test_store_is_sorted_by_exchange_and_id(day: str):
+    stored = pl.read_parquet(convert_day(day))
+    assert stored["Exchange"].to_list() == ["ETR", "FR", "FR", "FR", "FR", "NL", None]
+    assert stored["ID"].dtype == pl.String
+    # Events of an ID keep their CSV order
+    assert stored.filter(pl.col("ID") == "ALE.FR")["Row"].to_list() == [0, 3, 6]
+
+
+@pytest.mark.parametrize("convert", [False, True])
+def test_entity_and_exchange_filters(day: str, convert: bool):
+    if convert:
+        convert_day(day)
+    assert messages(load_day(day, entity="ALE.FR")) == expected(day, "ALE.FR")
+    assert scan_day(day, exchange="FR").sort("Row").collect()["ID"].to_list() == [
+        "ALE.FR",
+        "IEBBB.FR",
+        "ALE.FR",
+        "ALE.FR",
+    ]
+
+
+def test_stale_store_is_not_read(day: str):
+    output = convert_day(day)
+    with open(day, "a") as f:
+        f.write("C.NL,E,08-11-2021,x,1,3.0,13:00:00.000,\n")
+    stat = os.stat(output)
+    os.utime(day, (stat.st_atime, stat.st_mtime + 10))
+
+    assert stored_day(day) is None
+    assert messages(load_day(day)) == expected(day)
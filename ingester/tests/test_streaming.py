@@ -0,0 +1,172 @@
+import asyncio
+import concurrent.futures
+import itertools
+
+import nats
+import numpy as np
+import polars as pl
+import pytest
+
+import producer
+from main import (
+    IngestionMode,
+    IngestRun,
+    Partition,
+    _put,
+    _queued_batches,
+    mp_context,
+    partition_subjects,
+    route_batch,
+    stream_consumer,
+)
+from partitioner import HASH_SEED, exchange_key
+from utils import create_nats_message, preprocess_csv_file, read_csv_batches
+
+IDS = ["ALE.FR", "B.ETR", "ÉTÉ€.NL", "C.NL", "D.FR", "E.ETR", "UNKNOWN.XX"]
+
+
+@pytest.fixture
+def day(tmp_path) -> str:
+    rng = np.random.default_rng(5)
+    lines = [
+        "# Comment lines are skipped",
+        "ID,SecType,Date,Time,Ask,Last,Trading time,Trading date",
+    ]
+    for i in range(600):
+        id = IDS[rng.integers(len(IDS))]
+        last = "" if i % 50 == 0 else f"{i / 4}"
+        lines.append(
+            f"{id},E,08-11-2021,x,1,{last},08:{i // 60:02}:{i % 60:02}.{i % 1000:03},"
+        )
+    path = tmp_path / "debs2022-gc-trading-day-08-11-21.csv"
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def expected(df: pl.DataFrame) -> list[bytes]:
+    return [
+        create_nats_message(*row)
+        for row in df.select(
+            "ID", "SecType", "Last", "Trading time", "Trading date"
+        ).iter_rows()
+    ]
+
+
+def expected_partitions(
+    file: str, partition: Partition, consumer_count: int
+) -> dict[str, list[bytes]]:
+    df = preprocess_csv_file(file)
+    if partition == Partition.EXCHANGE:
+        key = exchange_key()
+    else:
+        key = pl.col("ID").hash(HASH_SEED) % consumer_count
+    subjects = partition_subjects(partition, consumer_count)
+    return {subject: expected(df.filter(key == id)) for id, subject in subjects.items()}
+
+
+@pytest.mark.parametrize("batch_size", [1, 64, 1000])
+def test_batches_concatenate_to_csv(day: str, batch_size: int):
+    batches = list(read_csv_batches(day, batch_size))
+    if batch_size < 600:
+        assert len(batches) > 1
+    assert pl.concat(batches).equals(preprocess_csv_file(day))
+
+
+def test_batches_of_an_entity(day: str):
+    batches = list(read_csv_batches(day, 64, "ALE.FR"))
+    streamed = pl.concat(batches)
+    assert set(streamed["ID"]) == {"ALE.FR"}
+    assert streamed.equals(preprocess_csv_file(day, "ALE.FR"))
+
+
+class Alive:
+    name = "worker"
+
+    def is_alive(self) -> bool:
+        return True
+
+
+async def drain(batches) -> list[bytes]:
+    messages = []
+    async for buffer, offsets, id_hash, due_ms in _queued_batches(batches):
+        assert len(id_hash) == len(offsets) - 1
+        assert due_ms is None
+        messages += [
+            buffer[start:end].tobytes() for start, end in itertools.pairwise(offsets)
+        ]
+    return messages
+
+
+@pytest.mark.parametrize(
+    ("partition", "consumer_count"),
+    [(Partition.MULTI, 3), (Partition.EXCHANGE, 1), (Partition.SINGLE, 1)],
+)
+def test_queue_hand_off_keeps_id_order(
+    day: str, partition: Partition, consumer_count: int
+):
+    subjects = partition_subjects(partition, consumer_count)
+    # Large enough for the whole file, the consumer only starts after the last batch
+    queues = {key: mp_context.Queue() for key in subjects}
+    for df in read_csv_batches(day, 64):
+        for key, part in route_batch(df, partition, consumer_count).items():
+            if not part.is_empty():
+                _put(queues[key], part, Alive())
+    for batches in queues.values():
+        _put(batches, None, Alive())
+
+    async def consume():
+        return {subjects[key]: await drain(batches) for key, batches in queues.items()}
+
+    assert asyncio.run(consume()) == expected_partitions(day, partition, consumer_count)
+
+
+def test_stream_consumer_publishes_every_partition(day: str, tmp_path):
+    run = IngestRun(
+        mode=IngestionMode.NATS_CORE,
+        partition=Partition.MULTI,
+        config=producer.PublishConfig(connections=2),
+        state=None,
+        metrics_dir=str(tmp_path),
+        consumer_count=2,
+        batch_size=64,
+        queue_depth=2,
+    )
+    expected_messages = expected_partitions(day, Partition.MULTI, 2)
+
+    async def main():
+        try:
+            nc = await nats.connect(
+                "nats://localhost:4222", connect_timeout=1, max_reconnect_attempts=0
+            )
+        except Exception:
+            pytest.skip("No NATS server on localhost:4222")
+        received = {subject: [] for subject in expected_messages}
+
+        async def handler(msg):
+            received[msg.subject].append(msg.data)
+
+        await nc.subscribe("exchange.*", cb=handler)
+        await nc.flush()
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            # Spawns the streaming workers, which publish from their own processes
+            await loop.run_in_executor(executor, stream_consumer, run, day)
+        total = sum(map(len, expected_messages.values()))
+        for _ in range(100):
+            if sum(map(len, received.values())) >= total:
+                break
+            await asyncio.sleep(0.05)
+        await nc.close()
+        return received
+
+    received = asyncio.run(main())
+    assert run.message_count == 600
+    # Connections are striped by ID hash, the order only holds between events of an ID
+    df = preprocess_csv_file(day)
+    ids = dict(zip(expected(df), df["ID"]))
+    for subject, messages in expected_messages.items():
+        assert sorted(received[subject]) == sorted(messages)
+        for id in set(map(ids.get, messages)):
+            assert [m for m in received[subject] if ids[m] == id] == [
+                m for m in messages if ids[m] == id
+            ]
@@ -0,0 +1,124 @@
+import datetime
+
+import numpy as np
+import polars as pl
+import pytest
+
+from utils import (
+    create_nats_message,
+    encode_nats_messages,
+    iter_nats_messages,
+    message_timestamps,
+)
+
+DATE = datetime.date(2021, 11, 8)
+
+
+@pytest.fixture
+def frame() -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "ID": ["ALE.FR", "ALE.FR", "IEBBB.FR", "ÉTÉ€.DE", "", "IEBBB.FR"],
+            "SecType": ["E", "E", "I", "E", "", "I"],
+            "Last": [1.5, None, float("nan"), 42.125, 0.0, -3.25],
+            "Trading time": [
+                "08:00:00.000",
+                "08:00:01.123",
+                None,
+                "12:34:56.789",
+                "23:59:59.999",
+                "00:00:00.001",
+            ],
+            "Trading date": [DATE] * 6,
+        },
+        schema_overrides={"Last": pl.Float64},
+    )
+
+
+def expected(df: pl.DataFrame) -> list[bytes]:
+    return [
+        create_nats_message(*row)
+        for row in df.select(
+            "ID", "SecType", "Last", "Trading time", "Trading date"
+        ).iter_rows()
+    ]
+
+
+def messages(buffer: np.ndarray, offsets: np.ndarray) -> list[bytes]:
+    return [
+        buffer[offsets[i] : offsets[i + 1]].tobytes() for i in range(len(offsets) - 1)
+    ]
+
+
+def test_encode_matches_create_nats_message(frame: pl.DataFrame):
+    buffer, offsets = encode_nats_messages(frame)
+
+    assert offsets[0] == 0 and offsets[-1] == len(buffer)
+    assert messages(buffer, offsets) == expected(frame)
+
+
+def test_encode_stored_timestamps(frame: pl.DataFrame):
+    # Frames from the store carry the unix ms timestamp instead of the trading time
+    row_bytes = expected(frame)
+    timestamps = [
+        None
+        if time is None
+        else int(
+            datetime.datetime.combine(
+                DATE,
+                datetime.datetime.strptime(time, "%H:%M:%S.%f").time(),
+                tzinfo=datetime.UTC,
+            ).timestamp()
+            * 1000
+        )
+        for time in frame["Trading time"]
+    ]
+    stored = frame.drop("Trading time").with_columns(
+        pl.Series("Timestamp", timestamps, dtype=pl.Int64)
+    )
+
+    assert messages(*encode_nats_messages(stored)) == row_bytes
+
+
+def test_encode_empty_frame(frame: pl.DataFrame):
+    buffer, offsets = encode_nats_messages(frame.clear())
+
+    assert len(buffer) == 0
+    assert offsets.tolist() == [0]
+
+
+def test_message_timestamps(frame: pl.DataFrame):
+    buffer, offsets = encode_nats_messages(frame)
+    midnight = int(
+        datetime.datetime.combine(DATE, datetime.time(), datetime.UTC).timestamp()
+        * 1000
+    )
+
+    timestamps = message_timestamps(buffer, offsets)
+
+    assert (timestamps - midnight).tolist() == [
+        28_800_000,
+        28_801_123,
+        -1 - midnight,
+        45_296_789,
+        86_399_999,
+        1,
+    ]
+    rows = np.array([5, 2, 0])
+    assert message_timestamps(buffer, offsets, rows).tolist() == [
+        timestamps[5],
+        -1,
+        timestamps[0],
+    ]
+
+
+def test_iter_nats_messages(frame: pl.DataFrame):
+    buffer, offsets = encode_nats_messages(frame)
+    row_bytes = expected(frame)
+
+    assert [bytes(m) for m in iter_nats_messages(buffer, offsets)] == row_bytes
+    rows = np.array([3, 0, 5, 3])
+    assert [bytes(m) for m in iter_nats_messages(buffer, offsets, rows)] == [
+        row_bytes[i] for i in rows
+    ]
+    assert list(iter_nats_messages(buffer, offsets, np.array([], dtype=np.int64))) == []
@@ -0,0 +1,160 @@
+import datetime
+
+import polars as pl
+import pytest
+import typer
+
+from analysis import main as analysis
+from engine import windows
+
+DAY = datetime.datetime(2021, 11, 8, 8, tzinfo=datetime.UTC)
+T0 = int(DAY.timestamp() * 1000)
+MINUTE = 60 * 1000
+
+
+@pytest.fixture
+def ticks() -> pl.DataFrame:
+    # The prices tumbling the windows of ALE.FR change sign, its EMAs cross over
+    rows = [
+        (id, last, T0 + minute * MINUTE)
+        for id, prices in [
+            ("ALE.FR", [10.0, 10.0, -10.0, 10.0, -10.0, 9.0]),
+            ("B.ETR", [-1.0, 3.0, 2.5, -1.0, 3.0, 2.5]),
+        ]
+        for minute, last in zip([0, 6, 12, 13, 21, 34], prices)
+    ]
+    return pl.DataFrame(
+        [(id, "E", last, timestamp) for id, last, timestamp in rows],
+        schema={
+            "ID": pl.String,
+            "SecType": pl.String,
+            "Last": pl.Float64,
+            "Timestamp": pl.Int64,
+        },
+        orient="row",
+    )
+
+
+def influx_output(reference: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """The windows and breakouts as the Flux queries of `load_consumer_windows` return them."""
+    time = pl.col("window_start").dt.strftime("%Y-%m-%dT%H:%M:%SZ").alias("_time")
+    windows = reference.select(
+        time,
+        pl.col("ID").alias("id"),
+        pl.col("First").alias("first"),
+        pl.col("Last").alias("last"),
+        pl.col("Max").alias("max"),
+        pl.col("Min").alias("min"),
+        pl.col("Movements").alias("movements"),
+        pl.col("EMA38").alias("calc_38"),
+        pl.col("EMA100").alias("calc_100"),
+    )
+    breakouts = reference.filter(pl.col("Breakout").is_not_null()).select(
+        time, pl.col("ID").alias("id"), pl.col("Breakout").alias("tags")
+    )
+    return windows, breakouts
+
+
+class FakeInflux:
+    def __init__(self, windows: pl.DataFrame, breakouts: pl.DataFrame):
+        self.windows = windows
+        self.breakouts = breakouts
+
+    def query(self, flux: str, schema_overrides: dict | None = None) -> pl.DataFrame:
+        if '"breakout"' in flux:
+            return self.breakouts
+        return self.windows
+
+
+@pytest.fixture
+def consumer(ticks: pl.DataFrame, monkeypatch):
+    """Serves the windows the reference engine computes for `ticks` as the consumer's."""
+    reference = windows(ticks).drop("SecType")
+    assert reference["Breakout"].is_not_null().any()
+    influx = FakeInflux(*influx_output(reference))
+    monkeypatch.setattr(analysis, "influx", lambda: influx)
+    monkeypatch.setattr(analysis, "load_ticks", lambda files: ticks.lazy())
+    return influx
+
+
+FILES = ["debs2022-gc-trading-day-08-11-21.csv"]
+
+
+def test_consumer_windows_round_trip(ticks: pl.DataFrame, consumer):
+    reference = windows(ticks).drop("SecType")
+    loaded = analysis.load_consumer_windows(FILES)
+    assert loaded.sort("ID", "window_start").equals(reference)
+    assert not analysis.compare_windows(reference, loaded)["mismatch"].any()
+
+
+def test_matching_windows_pass(consumer, capsys):
+    analysis.verify(FILES)
+    assert "All windows match" in capsys.readouterr().out
+
+
+def test_mismatches_are_flagged(ticks: pl.DataFrame, consumer, tmp_path):
+    first_window = pl.col("_time") == pl.col("_time").min()
+    consumer.windows = consumer.windows.with_columns(
+        pl.when((pl.col("id") == "ALE.FR") & first_window)
+        .then(pl.col("max") + 1)
+        .otherwise(pl.col("max"))
+        .alias("max")
+    ).filter(~((pl.col("id") == "B.ETR") & first_window))
+
+    joined = analysis.compare_windows(
+        windows(ticks).drop("SecType"), analysis.load_consumer_windows(FILES)
+    )
+    mismatches = joined.filter("mismatch").sort("ID")
+    # The maximum of the first window of ALE.FR differs, B.ETR lacks its first window
+    assert mismatches.select("ID", *analysis.MISMATCH_FLAGS).rows() == [
+        ("ALE.FR", False, False, False, False, True, False, False, False, False, False),
+        ("B.ETR", False, True, False, False, False, False, False, False, False, False),
+    ]
+
+    output = tmp_path / "mismatches.csv"
+    with pytest.raises(typer.Exit) as exit:
+        analysis.verify(FILES, output=str(output))
+    assert exit.value.exit_code == 1
+    assert sorted(pl.read_csv(output)["ID"]) == ["ALE.FR", "B.ETR"]
+
+
+def test_windows_only_the_consumer_wrote(ticks: pl.DataFrame, consumer):
+    extra = consumer.windows.head(1).with_columns(
+        pl.lit("2021-11-08T23:55:00Z").alias("_time")
+    )
+    consumer.windows = pl.concat([consumer.windows, extra])
+
+    joined = analysis.compare_windows(
+        windows(ticks).drop("SecType"), analysis.load_consumer_windows(FILES)
+    )
+    mismatches = joined.filter("mismatch")
+    assert mismatches["missing_in_reference"].to_list() == [True]
+    assert mismatches["window_start"].dt.hour().to_list() == [23]
+    with pytest.raises(typer.Exit):
+        analysis.verify(FILES)
+
+
+@pytest.mark.parametrize("suffix", ["csv", "parquet"])
+def test_reference_is_written(ticks: pl.DataFrame, consumer, tmp_path, suffix: str):
+    expected = windows(ticks)
+    output = str(tmp_path / f"reference.{suffix}")
+    analysis.reference(FILES, output)
+    read = pl.read_parquet if suffix == "parquet" else pl.read_csv
+    assert len(read(output)) == len(expected)
+
+    analysis.reference(FILES, output, breakouts_only=True)
+    assert len(read(output)) == expected["Breakout"].is_not_null().sum()
+
+
+def test_influx_client_is_created_on_first_use(monkeypatch):
+    created = []
+    monkeypatch.setattr(
+        analysis, "InfluxQueryClient", lambda: created.append("client") or created
+    )
+    analysis.influx.cache_clear()
+    try:
+        assert created == []
+        assert analysis.influx() is analysis.influx()
+        assert created == ["client"]
+    finally:
+        analysis.influx.cache_clear()
@@ -0,0 +1,409 @@
+import asyncio
+import contextlib
+import uuid
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+
+import nats
+import pytest
+from nats.js import api
+from nats.js.errors import NotFoundError
+
+import watcher
+from watcher import (
+    BREAKOUT_STREAM,
+    Breakout,
+    Selection,
+    _jetstream_consumer,
+    watch_core,
+    watch_jetstream,
+)
+
+
+@dataclass
+class Message:
+    subject: str
+    data: bytes
+    header: dict | None = None
+    num_pending: int = 0
+    acks: list = field(default_factory=list)
+
+    @property
+    def metadata(self):
+        return SimpleNamespace(num_pending=self.num_pending)
+
+    async def ack(self):
+        self.acks.append(self.subject)
+
+
+def breakout(id: str, kind: str = "Bullish", **kwargs) -> Message:
+    return Message(
+        f"breakouts.{id}", f"{kind} event at 2021-11-08 09:05:00 UTC".encode(), **kwargs
+    )
+
+
+def test_subjects_per_exchange_and_id():
+    selection = Selection(
+        frozenset({"RDSA.NL", "ALE15.FR", "2ICEU.FR"}), frozenset({"FR"})
+    )
+    # IDs of a watched exchange are covered by its wildcard
+    assert selection.subjects(100) == ["breakouts.*.FR", "breakouts.RDSA.NL"]
+    assert selection.subjects(2) == ["breakouts.*.FR", "breakouts.RDSA.NL"]
+    assert selection.subjects(1) == ["breakouts.>"]
+    assert Selection(frozenset()).subjects(0) == []
+
+    assert selection.matches("RDSA.NL")
+    assert selection.matches("IEBBB.FR")
+    assert not selection.matches("RDSA.ETR")
+
+
+def test_breakout_from_message():
+    parsed = Breakout.from_message(breakout("ALE15.FR", "Bearish"))
+    assert (parsed.id, parsed.kind, parsed.time) == (
+        "ALE15.FR",
+        "bearish",
+        "2021-11-08 09:05:00 UTC",
+    )
+    assert (
+        str(parsed) == "breakouts.ALE15.FR - Bearish event at 2021-11-08 09:05:00 UTC"
+    )
+    # Consumers from before per-ID subjects publish to `breakouts` with an ID header
+    legacy = Message("breakouts", b"Bullish event at x", header={"ID": "RDSA.NL"})
+    assert Breakout.from_message(legacy).id == "RDSA.NL"
+
+
+class CoreClient:
+    def __init__(self):
+        self.callbacks = {}
+
+    async def subscribe(self, subject, cb):
+        self.callbacks[subject] = cb
+
+
+async def watch_core_with(selection: Selection, max_subjects: int, msgs):
+    nc = CoreClient()
+    batches = []
+    task = asyncio.create_task(watch_core(nc, selection, batches.append, max_subjects))
+    await asyncio.sleep(0)
+    for msg in msgs:
+        # The server only sends the subjects subscribed to, the fallback gets them all
+        cb = nc.callbacks.get(msg.subject) or nc.callbacks.get("breakouts.>")
+        if cb is None:
+            cb = next(
+                cb
+                for subject, cb in nc.callbacks.items()
+                if msg.subject.endswith(subject.rsplit("*", 1)[-1])
+            )
+        await cb(msg)
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    return list(nc.callbacks), batches
+
+
+def test_core_subscribes_per_subject():
+    selection = Selection(frozenset({"RDSA.NL"}), frozenset({"FR"}))
+    subjects, batches = asyncio.run(
+        watch_core_with(selection, 100, [breakout("RDSA.NL"), breakout("ALE15.FR")])
+    )
+    assert subjects == ["breakouts.*.FR", "breakouts.RDSA.NL"]
+    # Both arrived while the sink waited, they go out as one batch
+    assert [[b.id for b in batch] for batch in batches] == [["RDSA.NL", "ALE15.FR"]]
+
+
+def test_core_matches_ids_past_max_subjects():
+    selection = Selection(frozenset({"RDSA.NL", "ALE15.FR"}))
+    msgs = [breakout("RDSA.NL"), breakout("RDSA.ETR"), breakout("ALE15.FR")]
+    subjects, batches = asyncio.run(watch_core_with(selection, 1, msgs))
+    assert subjects == ["breakouts.>"]
+    assert [b.id for batch in batches for b in batch] == ["RDSA.NL", "ALE15.FR"]
+
+
+class Manager:
+    """JetStream management calls of one consumer, `existing` is its config on the server."""
+
+    def __init__(self, existing: api.ConsumerConfig | None = None):
+        self.existing = existing
+        self.added = []
+
+    async def add_stream(self, **kwargs):
+        pass
+
+    async def add_consumer(self, stream, **config):
+        self.added.append(config)
+        return SimpleNamespace(
+            name=config.get("durable_name", "ephemeral"),
+            num_pending=3,
+            num_ack_pending=0,
+        )
+
+    async def consumer_info(self, stream, durable):
+        if self.existing is None:
+            raise NotFoundError
+        return SimpleNamespace(
+            name=durable,
+            config=self.existing,
+            ack_floor=SimpleNamespace(stream_seq=41),
+            num_pending=2,
+            num_waiting=0,
+            num_ack_pending=0,
+        )
+
+
+def test_consumer_acks_batches_by_their_last_message():
+    jsm = Manager()
+    info = asyncio.run(_jetstream_consumer(jsm, ["breakouts.*.FR"], None, 1000))
+    assert info.name == "ephemeral"
+    (config,) = jsm.added
+    assert config["ack_policy"] == api.AckPolicy.ALL
+    assert config["deliver_policy"] == api.DeliverPolicy.LAST_PER_SUBJECT
+    assert config["filter_subjects"] == ["breakouts.*.FR"]
+    assert config["max_ack_pending"] == 1000
+    assert "durable_name" not in config
+
+    info = asyncio.run(_jetstream_consumer(jsm, ["breakouts.*.FR"], "fr", 1000))
+    assert jsm.added[-1]["durable_name"] == "fr"
+
+
+def test_durable_consumer_resumes_on_the_same_subjects():
+    subjects = ["breakouts.RDSA.NL", "breakouts.*.FR"]
+    jsm = Manager(api.ConsumerConfig(filter_subjects=sorted(subjects)))
+    info = asyncio.run(_jetstream_consumer(jsm, subjects, "fr", 1000))
+    assert info.num_pending == 2
+    assert jsm.added == []
+
+    jsm = Manager(api.ConsumerConfig(filter_subject="breakouts.>"))
+    with pytest.raises(ValueError, match="watches other subjects"):
+        asyncio.run(_jetstream_consumer(jsm, subjects, "fr", 1000))
+
+
+def test_unacked_breakouts_are_read_from_the_stream():
+    stream = {
+        4: breakout("RDSA.NL"),
+        5: breakout("RDSA.ETR"),
+        7: breakout("ALE15.FR", "Bearish"),
+    }
+
+    class Stream:
+        async def get_msg(self, name, seq):
+            if seq not in stream:
+                # Removed by the stream limits
+                raise NotFoundError
+            return stream[seq]
+
+    info = SimpleNamespace(
+        ack_floor=SimpleNamespace(stream_seq=3), delivered=SimpleNamespace(stream_seq=7)
+    )
+    selection = Selection(frozenset({"RDSA.NL"}), frozenset({"FR"}))
+    unacked = asyncio.run(watcher._unacked(Stream(), info, selection))
+    assert [(b.id, b.kind) for b in unacked] == [
+        ("RDSA.NL", "bullish"),
+        ("ALE15.FR", "bearish"),
+    ]
+
+
+class PullSubscription:
+    """Hands out scripted batches, a TimeoutError stands for an empty pull."""
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.fetches = []
+        self.unsubscribed = False
+
+    async def fetch(self, batch, timeout):
+        self.fetches.append((batch, timeout))
+        if not self.batches:
+            raise asyncio.CancelledError
+        result = self.batches.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def unsubscribe(self):
+        self.unsubscribed = True
+
+
+def run_jetstream(selection, sub, max_subjects=100, **kwargs):
+    jsm = Manager()
+    nc = SimpleNamespace(
+        jetstream=lambda: SimpleNamespace(
+            pull_subscribe_bind=lambda **_: asyncio.sleep(0, sub)
+        ),
+        jsm=lambda: jsm,
+    )
+    batches = []
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(
+            watch_jetstream(nc, selection, batches.append, max_subjects, **kwargs)
+        )
+    assert sub.unsubscribed
+    return batches
+
+
+def test_jetstream_catches_up_then_tails():
+    acks = []
+    catch_up = [breakout("RDSA.NL", acks=acks, num_pending=1) for _ in range(2)]
+    rest = [breakout("RDSA.NL", acks=acks, num_pending=0)]
+    tail = [breakout("RDSA.NL", acks=acks) for _ in range(4)]
+    sub = PullSubscription([catch_up, rest, nats.errors.TimeoutError(), tail])
+
+    batches = run_jetstream(
+        Selection(frozenset({"RDSA.NL"})),
+        sub,
+        batch_size=10,
+        catch_up_batch_size=2,
+    )
+
+    assert [len(batch) for batch in batches] == [2, 1, 4]
+    # The consumer starts 3 behind, 2 at once then the last one without waiting
+    assert sub.fetches == [(2, 1), (1, 1), (10, 5), (10, 5), (10, 5)]
+    # One ack per batch, on its last message
+    assert len(acks) == 3
+    assert [msg.acks for msg in catch_up] == [acks, acks]
+    assert all(msg.acks is acks for msg in catch_up + rest + tail)
+
+
+def test_jetstream_acks_batches_matched_away():
+    acks = []
+    msgs = [
+        breakout("RDSA.ETR", acks=acks, num_pending=1),
+        breakout("RDSA.ETR", acks=acks, num_pending=0),
+    ]
+    sub = PullSubscription([msgs])
+
+    batches = run_jetstream(Selection(frozenset({"RDSA.NL"})), sub, max_subjects=0)
+
+    # Nothing matched so the sink is not called, the batch is still acked
+    assert batches == []
+    assert acks == ["breakouts.RDSA.ETR"]
+
+
+def test_jetstream_does_not_ack_a_failed_batch():
+    acks = []
+
+    def failing(breakouts):
+        raise OSError("disk full")
+
+    jsm = Manager()
+    sub = PullSubscription([[breakout("RDSA.NL", acks=acks)]])
+    nc = SimpleNamespace(
+        jetstream=lambda: SimpleNamespace(
+            pull_subscribe_bind=lambda **_: asyncio.sleep(0, sub)
+        ),
+        jsm=lambda: jsm,
+    )
+    with pytest.raises(OSError, match="disk full"):
+        asyncio.run(watch_jetstream(nc, Selection(frozenset({"RDSA.NL"})), failing))
+    assert acks == []
+    assert sub.unsubscribed
+
+
+async def jetstream_session(selection, durable, sink, publish=(), limit=1):
+    """
+    Publishes `publish`, then watches until `limit` breakouts were received or the sink
+    failed. Returns them with the consumer info once the watcher stopped.
+    """
+    try:
+        nc = await nats.connect(
+            "nats://localhost:4222", connect_timeout=1, max_reconnect_attempts=0
+        )
+    except Exception:
+        pytest.skip("No NATS server on localhost:4222")
+    try:
+        try:
+            await nc.jsm().add_stream(
+                name=BREAKOUT_STREAM, subjects=[f"{watcher.BREAKOUT_SUBJECT}.>"]
+            )
+        except Exception:
+            pytest.skip("JetStream is not enabled on localhost:4222")
+        for subject, data in publish:
+            await nc.jetstream().publish(subject, data)
+        received = []
+        done = asyncio.Event()
+
+        def collect(breakouts):
+            sink(breakouts)
+            received.extend(breakouts)
+            if len(received) >= limit:
+                done.set()
+
+        task = asyncio.create_task(
+            watch_jetstream(nc, selection, collect, durable=durable, batch_size=2)
+        )
+        waiting = asyncio.create_task(done.wait())
+        await asyncio.wait({task, waiting}, timeout=5, return_when="FIRST_COMPLETED")
+        waiting.cancel()
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, OSError):
+            await task
+        # The ack of the last batch is not waited for
+        await nc.flush()
+        return received, await nc.jsm().consumer_info(BREAKOUT_STREAM, durable)
+    finally:
+        await nc.close()
+
+
+async def delete_consumer(durable: str):
+    nc = await nats.connect("nats://localhost:4222")
+    try:
+        await nc.jsm().delete_consumer(BREAKOUT_STREAM, durable)
+    finally:
+        await nc.close()
+
+
+def test_durable_consumer_resumes_after_acked_breakouts():
+    id = f"T{uuid.uuid4().hex[:8].upper()}.FR"
+    durable = f"test-{uuid.uuid4().hex[:8]}"
+    selection = Selection(frozenset({id}))
+
+    def events(kind: str, hour: int, count: int):
+        return [
+            (f"breakouts.{id}", f"{kind} event at {hour}:0{i}:00".encode())
+            for i in range(count)
+        ]
+
+    def failing(breakouts):
+        raise OSError("output closed")
+
+    try:
+        # A new consumer starts from the last breakout of the ID
+        first, info = asyncio.run(
+            jetstream_session(selection, durable, print, events("Bullish", 9, 5))
+        )
+        assert [b.time for b in first] == ["9:04:00"]
+        assert info.num_ack_pending == 0
+        acked = info.ack_floor.stream_seq
+
+        # Only the breakouts published since are delivered after a restart
+        resumed, info = asyncio.run(
+            jetstream_session(
+                selection, durable, print, events("Bearish", 10, 3), limit=3
+            )
+        )
+        assert [b.time for b in resumed] == ["10:00:00", "10:01:00", "10:02:00"]
+        assert [b.kind for b in resumed] == ["bearish"] * 3
+        assert info.ack_floor.stream_seq == acked + 3
+        assert info.num_ack_pending == 0
+
+        # A batch the sink failed on is left unacked
+        failed, info = asyncio.run(
+            jetstream_session(selection, durable, failing, events("Bullish", 11, 2))
+        )
+        assert failed == []
+        assert info.ack_floor.stream_seq == acked + 3
+        # Sent to the failed watcher or still waiting in the stream
+        assert info.num_ack_pending + info.num_pending == 2
+
+        # and handed to the next watcher first, without waiting for its redelivery
+        restarted, info = asyncio.run(
+            jetstream_session(
+                selection, durable, print, events("Bearish", 12, 1), limit=3
+            )
+        )
+        assert [b.time for b in restarted] == ["11:00:00", "11:01:00", "12:00:00"]
+        assert info.ack_floor.stream_seq == acked + 6
+        assert info.num_ack_pending == 0
+    finally:
+        with contextlib.suppress(Exception):
+            asyncio.run(delete_consumer(durable))
@@ -0,0 +1 @@
+../ingester/event_loop.py
\ No newline at end of file
@@ -1,9 +1,11 @@
-import asyncio
-
 import typer
 import nats
 from enum import Enum
 
+# Links to the ingester's module, which has no dependencies so the watcher stays light
+from event_loop import EventLoop, run
+from watcher import FileSink, Selection, print_sink, watch_core, watch_jetstream
+
 app = typer.Typer(pretty_exceptions_enable=False)
 
 NATS_SERVER = "nats://localhost:4222"
@@ -15,53 +17,71 @@ class ServerMode(Enum):
 
 
 @app.command()
-def watch(mode: ServerMode, ids: list[str]):
-    async def nats_core_events(ids: list[str]):
-        nc = await nats.connect(NATS_SERVER)
-
-        sub = await nc.subscribe("breakouts")
+def watch(
+    mode: ServerMode,
+    ids: list[str] | None = typer.Argument(None),
+    exchange: list[str] | None = None,
+    ids_file: str | None = None,
+    output: str | None = None,
+    batch_size: int = 1000,
+    catch_up_batch_size: int = 10_000,
+    durable: str | None = None,
+    max_subjects: int = 100,
+    event_loop: EventLoop = EventLoop.ASYNCIO,
+):
+    """
+    Watches the breakouts of IDs given as arguments, one per line in --ids-file, or of whole
+    exchanges with --exchange FR. --output appends them as JSON lines instead of printing them.
+    In JetStream mode --durable NAME keeps the position of the watcher on the server, a restart
+    with the same name only receives the breakouts it missed.
+    """
+    ids = set(ids or [])
+    if ids_file:
+        with open(ids_file) as f:
+            ids.update(line.strip() for line in f if line.strip())
+    selection = Selection(frozenset(ids), frozenset(exchange or []))
+    if not selection.ids and not selection.exchanges:
+        raise typer.BadParameter("Give at least one ID or --exchange")
+    if durable and mode != ServerMode.JETSTREAM:
+        raise typer.BadParameter("--durable needs the jetstream mode")
+    sink = FileSink(output) if output else print_sink
 
-        async for msg in sub.messages:
-            if msg.header and msg.header["ID"] in ids:
-                print(f"{msg.subject} - {msg.data.decode('utf-8')}")
-
-    async def jetstream_events(ids: list[str]):
+    async def events():
         nc = await nats.connect(NATS_SERVER)
-        js = nc.jetstream()
-        jsm = nc.jsm()
-
-        stream_name = "breakout-events"
-        # https://github.com/nats-io/nats.py/commit/eb7da73b2a94f2053b4de43770f051ce222745b5#diff-0c442047748b79f60c3b3eacde0aca291c2c9b2494224adafb5714a9a6447c6bR820
-        await jsm.add_stream(name=stream_name, subjects=["breakouts.>"])
-        # Create an ephemeral consumer
-        # https://docs.nats.io/using-nats/developer/develop_jetstream/consumers#ephemeral-consumers
-        await jsm.add_consumer(
-            stream_name,
-            deliver_policy="last_per_subject",
-            ack_policy="explicit",
-            filter_subjects=[f"breakouts.{id}" for id in ids],
-        )
-        sub = await js.pull_subscribe("breakouts.>")
-
         try:
-            while True:
-                msg = (await sub.fetch(timeout=None))[0]
-                print(f"{msg.subject} - {msg.data.decode('utf-8')}")
-                await msg.ack_sync()
-        except KeyboardInterrupt:
-            print("Tearing down...")
-        await sub.unsubscribe()
-        await nc.drain()
+            if mode == ServerMode.CORE:
+                await watch_core(nc, selection, sink, max_subjects)
+            elif mode == ServerMode.JETSTREAM:
+                await watch_jetstream(
+                    nc,
+                    selection,
+                    sink,
+                    max_subjects,
+                    batch_size,
+                    durable,
+                    catch_up_batch_size,
+                )
+            else:
+                raise ValueError("Invalid server mode")
+        finally:
+            await nc.drain()
 
-    print("Listening to breakout messages for the following IDs")
-    for id in ids:
+    print(
+        f"Listening to breakout messages on the {event_loop.value} event loop for "
+        f"{len(selection.ids)} IDs and the exchanges {sorted(selection.exchanges)}"
+    )
+    for id in sorted(selection.ids)[:10]:
         print(f"- {id}")
-    if mode == ServerMode.CORE:
-        asyncio.run(nats_core_events(ids))
-    elif mode == ServerMode.JETSTREAM:
-        asyncio.run(jetstream_events(ids))
-    else:
-        raise ValueError("Invalid server mode")
+    if len(selection.ids) > 10:
+        print(f"- ... and {len(selection.ids) - 10} more")
+    try:
+        run(events(), event_loop)
+    except KeyboardInterrupt:
+        print("Tearing down...")
+    finally:
+        if output:
+            sink.close()
+            print(f"Breakouts written to {output}")
 
 
 if __name__ == "__main__":
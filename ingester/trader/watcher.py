@@ -0,0 +1,252 @@
+import asyncio
+import json
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+
+import nats
+from nats.js import api
+from nats.js.errors import NotFoundError
+
+BREAKOUT_SUBJECT = "breakouts"
+BREAKOUT_STREAM = "breakout-events"
+# Seconds a pull of the caught up watcher stays open on the server
+TAIL_TIMEOUT = 5
+
+
+@dataclass(frozen=True)
+class Breakout:
+    id: str
+    # "bullish" or "bearish"
+    kind: str
+    # Start of the window that broke out, as the consumer formats it
+    time: str
+    subject: str
+    # Unix time in seconds at which the watcher received it
+    received: float
+
+    @classmethod
+    def from_message(cls, msg) -> "Breakout":
+        # "Bullish event at 2021-11-08 09:05:00 UTC", published to breakouts.<ID>
+        kind, _, at = msg.data.decode("utf-8").partition(" event at ")
+        if msg.subject.startswith(f"{BREAKOUT_SUBJECT}."):
+            id = msg.subject[len(BREAKOUT_SUBJECT) + 1 :]
+        else:
+            # Consumers from before per-ID subjects only set the ID header
+            id = msg.header["ID"]
+        return cls(
+            id=id,
+            kind=kind.lower(),
+            time=at,
+            subject=msg.subject,
+            received=time.time(),
+        )
+
+    def __str__(self) -> str:
+        return f"{self.subject} - {self.kind.capitalize()} event at {self.time}"
+
+
+# Receives the breakouts of one batch, in the order they arrived
+Sink = Callable[[list[Breakout]], None]
+
+
+def print_sink(breakouts: list[Breakout]):
+    for breakout in breakouts:
+        print(breakout)
+
+
+class FileSink:
+    """Appends breakouts as JSON lines, one write and flush per batch."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "a")  # noqa: SIM115
+
+    def __call__(self, breakouts: list[Breakout]):
+        self.file.write(
+            "".join(json.dumps(asdict(breakout)) + "\n" for breakout in breakouts)
+        )
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+@dataclass(frozen=True)
+class Selection:
+    """The IDs and whole exchanges to watch, e.g. ALE15.FR and every ID of ETR."""
+
+    ids: frozenset[str]
+    exchanges: frozenset[str] = frozenset()
+
+    def subjects(self, max_subjects: int) -> list[str]:
+        """
+        Subjects to filter on in the server, one per exchange and ID. Past `max_subjects`
+        the watcher takes every breakout and matches them itself.
+        """
+        subjects = [
+            f"{BREAKOUT_SUBJECT}.*.{exchange}" for exchange in sorted(self.exchanges)
+        ]
+        subjects += [
+            f"{BREAKOUT_SUBJECT}.{id}"
+            for id in sorted(self.ids)
+            if id.rsplit(".", 1)[-1] not in self.exchanges
+        ]
+        if len(subjects) > max_subjects:
+            return [f"{BREAKOUT_SUBJECT}.>"]
+        return subjects
+
+    def matches(self, id: str) -> bool:
+        return id in self.ids or id.rsplit(".", 1)[-1] in self.exchanges
+
+
+async def watch_core(
+    nc: nats.NATS, selection: Selection, sink: Sink, max_subjects: int = 100
+):
+    subjects = selection.subjects(max_subjects)
+    filtered = subjects != [f"{BREAKOUT_SUBJECT}.>"]
+    pending: list[Breakout] = []
+    ready = asyncio.Event()
+
+    async def received(msg):
+        breakout = Breakout.from_message(msg)
+        if filtered or selection.matches(breakout.id):
+            pending.append(breakout)
+            ready.set()
+
+    for subject in subjects:
+        await nc.subscribe(subject, cb=received)
+    # Whatever arrived while the sink was busy goes out as the next batch
+    while True:
+        await ready.wait()
+        ready.clear()
+        batch = pending.copy()
+        pending.clear()
+        sink(batch)
+
+
+async def _jetstream_consumer(
+    jsm, subjects: list[str], durable: str | None, max_ack_pending: int
+) -> api.ConsumerInfo:
+    """
+    A new consumer starts from the last breakout of every subject, the state of the watched IDs.
+    A durable consumer that already exists keeps its position: the server resumes it after the
+    last acknowledged breakout, whatever happened to the watcher in between.
+    """
+    config = {
+        # Acking the last message of a batch acks all of it
+        "ack_policy": api.AckPolicy.ALL,
+        "filter_subjects": subjects,
+        "max_ack_pending": max_ack_pending,
+    }
+    if durable is None:
+        # https://docs.nats.io/using-nats/developer/develop_jetstream/consumers#ephemeral-consumers
+        return await jsm.add_consumer(
+            BREAKOUT_STREAM, deliver_policy=api.DeliverPolicy.LAST_PER_SUBJECT, **config
+        )
+    try:
+        info = await jsm.consumer_info(BREAKOUT_STREAM, durable)
+    except NotFoundError:
+        return await jsm.add_consumer(
+            BREAKOUT_STREAM,
+            durable_name=durable,
+            deliver_policy=api.DeliverPolicy.LAST_PER_SUBJECT,
+            **config,
+        )
+    existing = info.config.filter_subjects or [info.config.filter_subject]
+    if sorted(existing) != sorted(subjects):
+        raise ValueError(
+            f"Durable consumer {durable} watches other subjects ({len(existing)}), "
+            f"pick another name or delete it with `nats consumer rm {BREAKOUT_STREAM} {durable}`"
+        )
+    # The last pull of a watcher that just stopped stays open until it expires, the breakouts
+    # delivered to it are picked up by `_unacked` once it did
+    for _ in range(TAIL_TIMEOUT * 10 + 10):
+        if not info.num_waiting:
+            break
+        await asyncio.sleep(0.1)
+        info = await jsm.consumer_info(BREAKOUT_STREAM, durable)
+    else:
+        print(f"{durable} is still pulled from, is another watcher using it?")
+    print(
+        f"Resuming {durable} after stream sequence {info.ack_floor.stream_seq}, "
+        f"{info.num_pending} breakouts missed"
+    )
+    return info
+
+
+async def _unacked(jsm, info: api.ConsumerInfo, selection: Selection) -> list[Breakout]:
+    """
+    Breakouts a stopped watcher was sent but never acked. The first ack of this watcher acks
+    every breakout before it, so they are read from the stream instead of waiting for their
+    redelivery. Left without an ack until the next batch, they may still be redelivered.
+    """
+    breakouts = []
+    for seq in range(info.ack_floor.stream_seq + 1, info.delivered.stream_seq + 1):
+        try:
+            msg = await jsm.get_msg(BREAKOUT_STREAM, seq)
+        except NotFoundError:
+            continue
+        breakout = Breakout.from_message(msg)
+        if selection.matches(breakout.id):
+            breakouts.append(breakout)
+    return breakouts
+
+
+async def watch_jetstream(
+    nc: nats.NATS,
+    selection: Selection,
+    sink: Sink,
+    max_subjects: int = 100,
+    batch_size: int = 1000,
+    durable: str | None = None,
+    catch_up_batch_size: int = 10_000,
+):
+    """
+    Pulls the breakouts in batches, the next batch is only requested once the sink is done
+    with the previous one and it is acked. While behind the stream (at start, after a restart of
+    a durable consumer or a burst) it pulls `catch_up_batch_size` breakouts at once without
+    waiting, once caught up it tails the stream `batch_size` at a time.
+    """
+    js = nc.jetstream()
+    jsm = nc.jsm()
+    subjects = selection.subjects(max_subjects)
+    filtered = subjects != [f"{BREAKOUT_SUBJECT}.>"]
+
+    # https://github.com/nats-io/nats.py/commit/eb7da73b2a94f2053b4de43770f051ce222745b5#diff-0c442047748b79f60c3b3eacde0aca291c2c9b2494224adafb5714a9a6447c6bR820
+    await jsm.add_stream(name=BREAKOUT_STREAM, subjects=[f"{BREAKOUT_SUBJECT}.>"])
+    max_ack_pending = max(batch_size, catch_up_batch_size)
+    info = await _jetstream_consumer(jsm, subjects, durable, max_ack_pending)
+    sub = await js.pull_subscribe_bind(stream=BREAKOUT_STREAM, name=info.name)
+    pending = info.num_pending
+    caught_up = pending == 0
+    started = time.time()
+    received = 0
+    try:
+        if info.num_ack_pending and (unacked := await _unacked(jsm, info, selection)):
+            sink(unacked)
+        while True:
+            try:
+                if pending:
+                    msgs = await sub.fetch(min(pending, catch_up_batch_size), timeout=1)
+                else:
+                    msgs = await sub.fetch(batch_size, timeout=TAIL_TIMEOUT)
+            except nats.errors.TimeoutError:
+                pending = 0
+                continue
+            breakouts = [Breakout.from_message(msg) for msg in msgs]
+            if not filtered:
+                breakouts = [b for b in breakouts if selection.matches(b.id)]
+            if breakouts:
+                sink(breakouts)
+            # Not waiting for the server to confirm the ack, it is sent before the next pull
+            await msgs[-1].ack()
+            received += len(msgs)
+            pending = msgs[-1].metadata.num_pending
+            if not caught_up and not pending:
+                caught_up = True
+                print(
+                    f"Caught up on {received} breakouts in "
+                    f"{round(time.time() - started, 2)} seconds, tailing the stream"
+                )
+    finally:
+        await sub.unsubscribe()
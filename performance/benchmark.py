@@ -0,0 +1,457 @@
+import argparse
+import datetime
+import json
+import pathlib
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+import polars as pl
+
+import latency
+import profiler
+
+ROOT = pathlib.Path(__file__).parent.parent
+INGESTER = ROOT / "ingester" / "ingester"
+CONSUMER = ROOT / "consumer"
+RESULTS = pathlib.Path(__file__).parent / "results"
+
+# Bumped whenever the layout of a result changes, plots only read results of the current version
+RESULTS_VERSION = 1
+
+MODES = ["nats_core", "jetstream"]
+PARTITIONS = ["single", "exchange", "multi"]
+CONSUMER_BINARIES = {
+    "nats_core": "nats-core-consumer",
+    "jetstream": "jetstream-consumer",
+}
+CONSUMER_PARTITIONS = {"single": "single", "exchange": "by-exchange", "multi": "multi"}
+# One consumer for the single stream and one per exchange, only multi runs --consumer-counts
+FIXED_CONSUMER_COUNTS = {"single": 1, "exchange": 3}
+CONSUMER_COUNTS = [3, 5, 7]
+
+# Runs the ingester against a fresh NATS server and consumer for every mode × partition × consumer count
+# and stores throughput, latency percentiles, CPU and RSS of every run in one results file
+# Needs `nats-server` on the PATH and InfluxDB running, e.g. `docker compose -f docker/docker-compose.yml up influxdb`
+#
+# The ingester runs in its own uv project like the justfile recipes, --ingester-python picks another interpreter
+#
+# python benchmark.py ../data/debs2022-gc-trading-day-08-11-21.csv --consumer-counts 3 5 7
+# python benchmark.py --plot results/2024-12-01T10-00-00-1a2b3c4.json
+
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("localhost", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"Nothing is listening on port {port} after {timeout}s")
+
+
+def stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def start_nats(mode: str, nats_server: str, directory: str) -> subprocess.Popen:
+    with socket.socket() as s:
+        if s.connect_ex(("localhost", 4222)) == 0:
+            raise RuntimeError(
+                "A NATS server is already running on port 4222, stop it first"
+            )
+    command = [nats_server, "-p", "4222", "-m", "8222"]
+    if mode == "jetstream":
+        command += ["-js", "-sd", directory]
+    process = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    wait_for_port(4222)
+    return process
+
+
+def start_consumer(
+    mode: str, partition: str, count: int, args: argparse.Namespace, log
+) -> subprocess.Popen:
+    command = [
+        str(CONSUMER / "target" / "release" / CONSUMER_BINARIES[mode]),
+        "-b",
+        str(args.batch_size),
+        "-f",
+        str(args.flush_period),
+        CONSUMER_PARTITIONS[partition],
+    ]
+    if partition == "multi":
+        command += ["-n", str(count)]
+    return subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+
+
+def ingester_command(python: str | None = None) -> list[str]:
+    """
+    Starts the ingester with `python` when given, otherwise through uv in the ingester's project
+    the way the justfile recipes do, falling back to this interpreter when uv is not installed.
+    """
+    if python:
+        return [python, "main.py"]
+    if shutil.which("uv"):
+        return ["uv", "run", "main.py"]
+    return [sys.executable, "main.py"]
+
+
+def ingest(
+    mode: str, partition: str, count: int, args: argparse.Namespace, directory: str
+) -> tuple[dict, pl.DataFrame]:
+    summary = pathlib.Path(directory) / "summary.json"
+    command = [
+        *ingester_command(args.ingester_python),
+        "ingest",
+        mode,
+        partition,
+        *[str(pathlib.Path(file).resolve()) for file in args.files],
+        "--summary",
+        str(summary),
+        "--stamp-every",
+        str(args.stamp_every),
+        *args.extra,
+    ]
+    if partition == "multi":
+        command += ["--consumer-count", str(count)]
+    process = subprocess.Popen(command, cwd=INGESTER, stdout=subprocess.DEVNULL)
+    sampler = profiler.Profiler(process.pid, args.rate)
+    sampler.start()
+    if process.wait() != 0:
+        raise RuntimeError(f"Ingester failed with exit code {process.returncode}")
+    return json.loads(summary.read_text()), sampler.stop()
+
+
+def latencies(start: datetime.datetime) -> dict | None:
+    try:
+        perf = latency.query_perf(start.strftime("%Y-%m-%dT%H:%M:%SZ"), "now()")
+    except Exception as e:
+        print(f"Could not query latencies from InfluxDB: {e}")
+        return None
+    if perf.is_empty():
+        return None
+    table = latency.percentiles(latency.stage_latencies(perf), ["stage"])
+    return {row.pop("stage"): row for row in table.iter_rows(named=True)}
+
+
+def benchmark(
+    mode: str,
+    partition: str,
+    count: int,
+    args: argparse.Namespace,
+    samples: pathlib.Path,
+) -> dict:
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        open(pathlib.Path(directory) / "consumer.log", "w+") as log,
+    ):
+        nats = start_nats(mode, args.nats_server, directory)
+        consumer = start_consumer(mode, partition, count, args, log)
+        try:
+            nats_sampler = profiler.Profiler(nats.pid, args.rate)
+            consumer_sampler = profiler.Profiler(consumer.pid, args.rate)
+            nats_sampler.start()
+            consumer_sampler.start()
+            # The JetStream consumer (re)creates the stream before it subscribes
+            time.sleep(args.warmup)
+            if consumer.poll() is not None:
+                log.seek(0)
+                raise RuntimeError(
+                    f"Consumer exited with code {consumer.returncode}:\n{log.read()}"
+                )
+
+            start = datetime.datetime.now(datetime.UTC)
+            summary, ingester = ingest(mode, partition, count, args, directory)
+            # Give the consumer time to work through its backlog and flush the last windows
+            time.sleep(args.drain)
+            components = {
+                "ingester": ingester,
+                "consumer": consumer_sampler.stop(),
+                "nats": nats_sampler.stop(),
+            }
+        finally:
+            stop(consumer)
+            stop(nats)
+
+    # Every sample of every process, for cpu.py and mem.py or a closer look
+    pl.concat(
+        [
+            frame.with_columns(pl.lit(component).alias("component"))
+            for component, frame in components.items()
+        ]
+    ).write_parquet(samples)
+
+    return {
+        "mode": mode,
+        "partition": partition,
+        "consumer_count": count,
+        "messages": summary["messages"],
+        "seconds": summary["seconds"],
+        "messages_per_second": summary["messages_per_second"],
+        "publishers": summary.get("report"),
+        "latency": latencies(start),
+        "resources": {
+            component: profiler.summary(frame)
+            for component, frame in components.items()
+        },
+        "samples": f"{samples.parent.name}/{samples.name}",
+    }
+
+
+def matrix(args: argparse.Namespace) -> list[tuple[str, str, int]]:
+    """Every mode × partition × consumer count to run, counts a partition cannot run with are rejected."""
+    if args.consumer_counts is not None:
+        if "multi" not in args.partitions:
+            raise ValueError(
+                "--consumer-counts only applies to the multi partition, "
+                + ", ".join(
+                    f"{partition} always runs {count}"
+                    for partition, count in FIXED_CONSUMER_COUNTS.items()
+                )
+            )
+        if any(count < 1 for count in args.consumer_counts):
+            raise ValueError(
+                f"Consumer counts must be at least 1, got {args.consumer_counts}"
+            )
+    runs = []
+    for mode in args.modes:
+        for partition in args.partitions:
+            if partition in FIXED_CONSUMER_COUNTS:
+                counts = [FIXED_CONSUMER_COUNTS[partition]]
+            else:
+                counts = args.consumer_counts or CONSUMER_COUNTS
+            runs += [(mode, partition, count) for count in counts]
+    return runs
+
+
+def git_commit() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        check=False,
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip() or "unknown"
+
+
+def label(result: dict) -> str:
+    if result["partition"] == "multi":
+        return f"multi {result['consumer_count']}"
+    return result["partition"]
+
+
+def load_results(path: pathlib.Path) -> dict:
+    document = json.loads(path.read_text())
+    if document.get("version") != RESULTS_VERSION:
+        raise ValueError(
+            f"{path} has results version {document.get('version')}, expected {RESULTS_VERSION}"
+        )
+    return document
+
+
+def results_document(
+    output: pathlib.Path, commit: str, created: datetime.datetime, files, arguments
+) -> dict:
+    """
+    The results to add the runs of this benchmark to. An existing results file of the same version
+    is continued, e.g. to add consumer counts or finish an interrupted benchmark.
+    """
+    if output.exists():
+        document = load_results(output)
+        if document["commit"] != commit:
+            print(f"{output} was measured at {document['commit']}, now at {commit}")
+        return document
+    return {
+        "version": RESULTS_VERSION,
+        "commit": commit,
+        "created": created.isoformat(),
+        "files": files,
+        "arguments": arguments,
+        "results": [],
+    }
+
+
+def add_result(document: dict, result: dict, output: pathlib.Path):
+    """Adds or replaces the result of a run and writes the results file."""
+    key = (result["mode"], result["partition"], result["consumer_count"])
+    document["results"] = [
+        r
+        for r in document["results"]
+        if (r["mode"], r["partition"], r["consumer_count"]) != key
+    ]
+    document["results"].append(result)
+    # Written after every run so an interrupted benchmark keeps what it measured
+    output.write_text(json.dumps(document, indent=2))
+
+
+def plot(path: pathlib.Path):
+    document = load_results(path)
+    results = document["results"]
+    labels = list(dict.fromkeys(label(r) for r in results))
+    modes = list(dict.fromkeys(r["mode"] for r in results))
+
+    def value(mode: str, name: str, get) -> float:
+        matches = [r for r in results if r["mode"] == mode and label(r) == name]
+        try:
+            return get(matches[0]) if matches else 0.0
+        except (KeyError, TypeError):
+            return 0.0
+
+    charts = {
+        "throughput": ("Messages/Second", lambda r: r["messages_per_second"]),
+        "latency-p50": (
+            "p50 end to end latency (ms)",
+            lambda r: r["latency"]["end_to_end"]["p50"],
+        ),
+        "latency-p99": (
+            "p99 end to end latency (ms)",
+            lambda r: r["latency"]["end_to_end"]["p99"],
+        ),
+        "cpu": ("Ingester CPU %", lambda r: r["resources"]["ingester"]["cpu_percent"]),
+        "rss": (
+            "Peak ingester RSS (MB)",
+            lambda r: r["resources"]["ingester"]["rss_max_mb"],
+        ),
+    }
+    x = np.arange(len(labels))
+    width = 0.8 / len(modes)
+    for name, (ylabel, get) in charts.items():
+        fig, ax = plt.subplots(figsize=(10, 6))
+        for i, mode in enumerate(modes):
+            bars = ax.bar(
+                x + (i - (len(modes) - 1) / 2) * width,
+                [value(mode, name_, get) for name_ in labels],
+                width,
+                label=mode,
+            )
+            ax.bar_label(bars, fmt="%.0f", padding=3)
+        ax.set_xlabel("Partition")
+        ax.set_ylabel(ylabel)
+        ax.set_title(f"{ylabel} at {document['commit']}")
+        ax.set_xticks(x)
+        ax.set_xticklabels(labels)
+        ax.legend()
+        plt.tight_layout()
+        plt.savefig(path.with_name(f"{path.stem}-{name}.pdf"))
+        plt.close(fig)
+    print(f"Plots written next to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument(
+        "--partitions", nargs="+", choices=PARTITIONS, default=PARTITIONS
+    )
+    parser.add_argument(
+        "--consumer-counts",
+        nargs="+",
+        type=int,
+        default=None,
+        help=f"Consumers of the multi partition, {' '.join(map(str, CONSUMER_COUNTS))} by default",
+    )
+    parser.add_argument("--nats-server", default="nats-server")
+    parser.add_argument(
+        "--ingester-python",
+        default=None,
+        help="Interpreter with the ingester's dependencies, `uv run` in its project by default",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="Consumer Influx batch size"
+    )
+    parser.add_argument(
+        "--flush-period",
+        type=int,
+        default=500,
+        help="Consumer Influx flush period in ms",
+    )
+    parser.add_argument("--stamp-every", type=int, default=100)
+    parser.add_argument(
+        "--rate", type=float, default=0.5, help="Resource sampling period in seconds"
+    )
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--drain", type=float, default=5.0)
+    parser.add_argument("--output", default=None)
+    parser.add_argument(
+        "--plot", default=None, help="Only regenerate the plots of a results file"
+    )
+    args, args.extra = parser.parse_known_args()
+
+    if args.plot:
+        plot(pathlib.Path(args.plot))
+        return
+    if not args.files:
+        parser.error("the files to ingest are required unless --plot is given")
+    try:
+        runs = matrix(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if shutil.which(args.nats_server) is None:
+        parser.error(f"{args.nats_server} not found")
+    for mode in args.modes:
+        if not (CONSUMER / "target" / "release" / CONSUMER_BINARIES[mode]).exists():
+            subprocess.run(["cargo", "build", "--release"], cwd=CONSUMER, check=True)
+            break
+
+    created = datetime.datetime.now(datetime.UTC)
+    commit = git_commit()
+    output = pathlib.Path(
+        args.output
+        or RESULTS / f"{created.strftime('%Y-%m-%dT%H-%M-%S')}-{commit}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        document = results_document(output, commit, created, args.files, args.extra)
+    except ValueError as e:
+        parser.error(str(e))
+    samples = output.with_suffix("")
+    samples.mkdir(exist_ok=True)
+    for mode, partition, count in runs:
+        result = benchmark(
+            mode,
+            partition,
+            count,
+            args,
+            samples / f"{mode}-{partition}-{count}.parquet",
+        )
+        end_to_end = (result["latency"] or {}).get("end_to_end")
+        print(
+            f"{mode:>9} {partition:>8} {count:>2}: {result['messages_per_second']:.0f} message/s, "
+            f"end to end p99 {end_to_end['p99'] if end_to_end else '-'} ms, "
+            f"ingester CPU {result['resources']['ingester']['cpu_percent']}%, "
+            f"RSS {result['resources']['ingester']['rss_max_mb']} MB"
+        )
+        add_result(document, result, output)
+
+    with pl.Config(tbl_rows=-1, tbl_hide_dataframe_shape=True):
+        print(
+            pl.DataFrame(
+                [
+                    {
+                        "mode": r["mode"],
+                        "partition": label(r),
+                        "messages_per_second": r["messages_per_second"],
+                    }
+                    for r in document["results"]
+                ]
+            )
+        )
+    plot(output)
+
+
+if __name__ == "__main__":
+    main()
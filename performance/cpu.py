@@ -1,9 +1,14 @@
+import argparse
+import pathlib
+
 import polars as pl
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator, FuncFormatter
 
+import profiler
 
-def plot_cpu_usage(input: str, output: str):
+
+def load_top_csv(input: str) -> pl.DataFrame:
     df = pl.read_csv(input)
     df = df.with_columns((pl.col("timestamp") * 1000).cast(pl.Datetime(time_unit="ms")))
     df = df.drop("memory")
@@ -11,13 +16,33 @@ def plot_cpu_usage(input: str, output: str):
     # Align timestamps to start from 0
     start_time = df["timestamp"][0]
     df = df.with_columns(((pl.col("timestamp") - start_time) / 1000).cast(pl.Int64))
-    df = df.filter(pl.col("timestamp") >= 0)  # Remove any negative values
+    return df.filter(pl.col("timestamp") >= 0)  # Remove any negative values
+
+
+def load(input: str) -> pl.DataFrame:
+    """Seconds since the start and CPU % of a profiler.py sample file, or of a CSV of the old top-based profiler."""
+    suffix = pathlib.Path(input).suffix
+    if suffix == ".csv":
+        return load_top_csv(input)
+    samples = (
+        pl.read_ipc(input, memory_map=False)
+        if suffix == ".arrow"
+        else pl.read_parquet(input)
+    )
+    return profiler.usage(samples).select(
+        pl.col("seconds").alias("timestamp"), "cpu_percent"
+    )
+
+
+def plot_cpu_usage(input: str, output: str):
+    df = load(input)
 
     plt.figure(figsize=(10, 6))
     plt.plot(df["timestamp"], df["cpu_percent"], "b-")
     plt.ylabel("CPU %")
     plt.title("CPU Usage Over Time")
-    plt.ylim(0, 100)  # Ensure CPU percentage is between 0 and 100
+    # Samples of a process tree go above 100% when it keeps more than one core busy
+    plt.ylim(bottom=0, top=max(100, df["cpu_percent"].max() or 0))
 
     def x_fmt(x, _):
         return f"{int(x)}s"
@@ -46,5 +71,8 @@ def plot_cpu_usage(input: str, output: str):
 
 
 if __name__ == "__main__":
-    plot_cpu_usage("nat-multi-7-profile.csv", "nats-core-multi-7-cpu.pdf")
-    plot_cpu_usage("jetstream-multi-7-profile.csv", "jetstream-multi-7-cpu.pdf")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="Samples written by profiler.py, or a top CSV")
+    parser.add_argument("output")
+    args = parser.parse_args()
+    plot_cpu_usage(args.input, args.output)
@@ -0,0 +1,119 @@
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+INGESTER = pathlib.Path(__file__).parent.parent / "ingester" / "ingester"
+EVENT_LOOPS = ["asyncio", "uvloop"]
+PARTITIONS = ["single", "exchange", "multi"]
+
+# Compares the ingestion rate of the asyncio and uvloop event loops for every partition mode
+# Needs a running NATS server (and consumer), e.g. `just start core`
+#
+# python event_loop.py nats_core ../data/debs2022-gc-trading-day-08-11-21.csv --consumer-count 5
+
+
+def ingest(
+    mode: str,
+    partition: str,
+    event_loop: str,
+    files: list[str],
+    consumer_count: int,
+    extra: list[str],
+) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        summary = pathlib.Path(directory) / "summary.json"
+        command = [
+            sys.executable,
+            "main.py",
+            "ingest",
+            mode,
+            partition,
+            *[str(pathlib.Path(file).resolve()) for file in files],
+            "--event-loop",
+            event_loop,
+            "--summary",
+            str(summary),
+            *extra,
+        ]
+        if partition == "multi":
+            command += ["--consumer-count", str(consumer_count)]
+        subprocess.run(command, cwd=INGESTER, check=True, stdout=subprocess.DEVNULL)
+        return json.loads(summary.read_text())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["nats_core", "jetstream"])
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--consumer-count", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args, extra = parser.parse_known_args()
+
+    results = []
+    for partition in PARTITIONS:
+        for event_loop in EVENT_LOOPS:
+            for i in range(args.repeat):
+                summary = ingest(
+                    args.mode,
+                    partition,
+                    event_loop,
+                    args.files,
+                    args.consumer_count,
+                    extra,
+                )
+                print(
+                    f"{partition:>8} {event_loop:>7} run {i}: {summary['messages_per_second']} message/s"
+                )
+                results.append(summary)
+
+    output = args.output or f"{args.mode}-event-loop.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    rates = {
+        event_loop: [
+            np.median(
+                [
+                    r["messages_per_second"]
+                    for r in results
+                    if r["partition"] == partition and r["event_loop"] == event_loop
+                ]
+            )
+            for partition in PARTITIONS
+        ]
+        for event_loop in EVENT_LOOPS
+    }
+    for partition, asyncio_rate, uvloop_rate in zip(
+        PARTITIONS, rates["asyncio"], rates["uvloop"]
+    ):
+        print(
+            f"{partition:>8}: asyncio {asyncio_rate:.0f} message/s, uvloop {uvloop_rate:.0f} message/s "
+            f"({(uvloop_rate / asyncio_rate - 1) * 100:+.1f}%)"
+        )
+
+    x = np.arange(len(PARTITIONS))
+    width = 0.35
+    fig, ax = plt.subplots(figsize=(10, 6))
+    bars1 = ax.bar(x - width / 2, rates["asyncio"], width, label="asyncio")
+    bars2 = ax.bar(x + width / 2, rates["uvloop"], width, label="uvloop")
+    ax.set_xlabel("Partition")
+    ax.set_ylabel("Messages/Second")
+    ax.set_title(f"Ingestion rate of {args.mode} by event loop")
+    ax.set_xticks(x)
+    ax.set_xticklabels(PARTITIONS)
+    ax.legend()
+    for bars in [bars1, bars2]:
+        ax.bar_label(bars, fmt="%.0f", padding=3)
+    plt.tight_layout()
+    plt.savefig(pathlib.Path(output).with_suffix(".pdf"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,141 +1,230 @@
-from influxdb_client import InfluxDBClient
+import argparse
 import json
-import os
-from collections import defaultdict
-
-# Setup InfluxDB client
-url = "http://localhost:8086"
-token = "token"
-org = "trading-org"
-bucket = "trading_bucket"
-client = InfluxDBClient(url=url, token=token)
-query_api = client.query_api()
-
-# Define the query to execute
-query = """
-from(bucket: "trading_bucket")
-  |> range(start: -15h)
+import pathlib
+import sys
+
+import polars as pl
+
+# The Influx query client is shared with the ingester tooling
+sys.path.append(
+    str(pathlib.Path(__file__).resolve().parent.parent / "ingester" / "ingester")
+)
+from influx import INFLUX_BUCKET, InfluxQueryClient  # noqa: E402
+
+# Pulls the `perf` measurement written by the consumer and reports latency percentiles
+#
+# python latency.py --run nats-multi-5 --partition multi --start -2h --output nats-multi-5-perf.json
+# python latency.py --run nats-multi-5 --partition multi --start 2024-12-01T10:00:00Z --stop 2024-12-01T11:00:00Z --output latency.parquet
+
+FIELDS = [
+    "publish_time",
+    "receive_time",
+    "stamped_publish_time",
+    "stamped_receive_time",
+    "window_creation_start",
+    "window_creation_end",
+    "influx_write_end",
+]
+
+# Stages between two timestamps of the `perf` measurement, in ms
+# nats is timed on the latest tick of a window the ingester stamped (--stamp-every), end_to_end
+# only on windows closed by a stamped tick, about one in N with --stamp-every N
+STAGES = {
+    "nats": ("stamped_publish_time", "stamped_receive_time"),
+    "queue": ("receive_time", "window_creation_start"),
+    "window": ("window_creation_start", "window_creation_end"),
+    "influx": ("window_creation_end", "influx_write_end"),
+    "total": ("window_creation_start", "influx_write_end"),
+    "end_to_end": ("publish_time", "influx_write_end"),
+}
+
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+
+
+def flux_time(value: str) -> str:
+    # Relative durations (-15h) are valid Flux as they are, absolute times need a conversion
+    if value.startswith("-") or value == "now()":
+        return value
+    return f'time(v: "{value}")'
+
+
+def query_perf(start: str, stop: str) -> pl.DataFrame:
+    fields = " or ".join(f'r["_field"] == "{field}"' for field in FIELDS)
+    query = f"""
+from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: {flux_time(start)}, stop: {flux_time(stop)})
   |> filter(fn: (r) => r["_measurement"] == "perf")
-  |> filter(fn: (r) => r["_field"] == "influx_write_end" or r["_field"] == "window_creation_end" or r["_field"] == "window_creation_start")
+  |> filter(fn: (r) => {fields})
+  |> keep(columns: ["_time", "_field", "_value", "id", "window_number"])
 """
-
-
-def query_influxdb():
+    client = InfluxQueryClient()
     try:
-        # Store the results
-        perf = []
-
-        # Query the data
-        result = query_api.query(query, org=org)
-
-        # Process the rows returned by InfluxDB
-        for table in result:
-            for record in table.records:
-                perf.append(record.values)
-
-        # Group the data by 'id' and 'window_number'
-        group_by_id = defaultdict(list)
-        for row in perf:
-            group_by_id[row["id"]].append(row)
-
-        window_creation_time_array = []
-        influx_write_time_array = []
-        total_latency_array = []
-
-        # Group and calculate the necessary values
-        for id, rows in group_by_id.items():
-            group_by_win_num = defaultdict(list)
-            for row in rows:
-                group_by_win_num[row["window_number"]].append(row)
-
-            for wnum, window_rows in group_by_win_num.items():
-                influx_write_end = next(
-                    r["_value"]
-                    for r in window_rows
-                    if r["_field"] == "influx_write_end"
-                )
-                window_creation_end = next(
-                    r["_value"]
-                    for r in window_rows
-                    if r["_field"] == "window_creation_end"
-                )
-                window_creation_start = next(
-                    r["_value"]
-                    for r in window_rows
-                    if r["_field"] == "window_creation_start"
-                )
-
-                window_creation_time = window_creation_end - window_creation_start
-                influx_write_time = influx_write_end - window_creation_end
-                total_latency = window_creation_time + influx_write_time
-
-                window_creation_time_array.append(window_creation_time)
-                influx_write_time_array.append(influx_write_time)
-                total_latency_array.append(total_latency)
-
-        # Calculate averages, min, and max
-        average_window_creation_time = sum(window_creation_time_array) / len(
-            window_creation_time_array
+        perf = client.query(
+            query, schema_overrides={"_value": pl.Int64, "id": pl.String}
         )
-        average_influx_write_time = sum(influx_write_time_array) / len(
-            influx_write_time_array
+    finally:
+        client.close()
+    if perf.is_empty():
+        return pl.DataFrame(
+            schema={
+                "_time": pl.String,
+                "_field": pl.String,
+                "_value": pl.Int64,
+                "id": pl.String,
+                "window_number": pl.Int64,
+            }
+        )
+    return perf.select("_time", "_field", "_value", "id", "window_number")
+
+
+def stage_latencies(perf: pl.DataFrame) -> pl.DataFrame:
+    """One row per window and stage with the latency of that stage in ms."""
+    windows = perf.pivot(
+        on="_field",
+        index=["_time", "id", "window_number"],
+        values="_value",
+        aggregate_function="first",
+    )
+    # Windows written before a field existed have no value for it, missing timestamps are 0
+    for field in FIELDS:
+        if field not in windows.columns:
+            windows = windows.with_columns(pl.lit(None, dtype=pl.Int64).alias(field))
+    windows = windows.with_columns(
+        pl.col("_time").str.to_datetime(time_zone="UTC").alias("time"),
+        # Consumers from before the stamped fields only timed the tick closing the window
+        pl.col("stamped_publish_time").fill_null(pl.col("publish_time")),
+        pl.col("stamped_receive_time").fill_null(pl.col("receive_time")),
+    )
+    return (
+        windows.select(
+            "time",
+            "id",
+            *[
+                pl.when((pl.col(begin) > 0) & (pl.col(end) > 0))
+                .then(pl.col(end) - pl.col(begin))
+                .alias(stage)
+                for stage, (begin, end) in STAGES.items()
+            ],
+        )
+        .unpivot(index=["time", "id"], variable_name="stage", value_name="latency")
+        .drop_nulls("latency")
+    )
+
+
+def end_to_end_share(latencies: pl.DataFrame) -> float:
+    """Share of the windows timed by the window stage that end_to_end covers as well."""
+    counts = dict(latencies.group_by("stage").len().rows())
+    return counts.get("end_to_end", 0) / max(counts.get("window", 0), 1)
+
+
+def percentiles(latencies: pl.LazyFrame | pl.DataFrame, by: list[str]) -> pl.DataFrame:
+    return (
+        latencies.lazy()
+        .group_by(by)
+        .agg(
+            pl.len().alias("count"),
+            pl.col("latency").mean().alias("avg"),
+            pl.col("latency").min().alias("min"),
+            *[
+                pl.col("latency").quantile(q, interpolation="linear").alias(name)
+                for name, q in PERCENTILES.items()
+            ],
+            pl.col("latency").max().alias("max"),
+        )
+        .sort(by)
+        .collect()
+    )
+
+
+def report(latencies: pl.DataFrame, bucket_every: str) -> pl.DataFrame:
+    """Percentiles per stage overall, per ID and per time bucket, as one long table."""
+    overall = percentiles(latencies, ["stage"]).with_columns(
+        pl.lit("all").alias("group"), pl.lit("all").alias("key")
+    )
+    per_id = percentiles(latencies, ["stage", "id"]).select(
+        pl.lit("id").alias("group"), pl.col("id").alias("key"), pl.exclude("id")
+    )
+    per_bucket = percentiles(
+        latencies.with_columns(pl.col("time").dt.truncate(bucket_every)),
+        ["stage", "time"],
+    ).select(
+        pl.lit("bucket").alias("group"),
+        pl.col("time").dt.to_string("%Y-%m-%dT%H:%M:%SZ").alias("key"),
+        pl.exclude("time"),
+    )
+    columns = ["group", "key", "stage", "count", "avg", "min", *PERCENTILES, "max"]
+    return pl.concat(
+        [frame.select(columns) for frame in [overall, per_id, per_bucket]],
+        how="vertical_relaxed",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", required=True, help="Name of the run, e.g. multi-10")
+    parser.add_argument(
+        "--partition",
+        choices=["single", "exchange", "multi"],
+        default=None,
+        help="Partition mode of the run",
+    )
+    parser.add_argument("--start", default="-15h", help="-15h or 2024-12-01T10:00:00Z")
+    parser.add_argument("--stop", default="now()")
+    parser.add_argument("--bucket", default="1m", help="Width of the time buckets")
+    parser.add_argument(
+        "--output",
+        default=None,
+        help=".json writes the overall summary, .csv or .parquet the full report",
+    )
+    args = parser.parse_args()
+
+    perf = query_perf(args.start, args.stop)
+    if perf.is_empty():
+        print("No perf data found in the time range")
+        return
+    latencies = stage_latencies(perf)
+    table = report(latencies, args.bucket).with_columns(
+        pl.lit(args.run).alias("run"), pl.lit(args.partition).alias("partition")
+    )
+
+    overall = table.filter(pl.col("group") == "all")
+    with pl.Config(tbl_rows=-1, tbl_hide_dataframe_shape=True):
+        print(overall.drop("group", "key", "run", "partition"))
+    if not overall["stage"].is_in(["nats"]).any():
+        print("No stamped messages found, run the ingester with --stamp-every")
+    elif (sampled := end_to_end_share(latencies)) < 1:
+        print(
+            f"end_to_end covers {round(sampled * 100, 1)}% of the windows, those closed by a "
+            "stamped tick, --stamp-every 1 times all of them"
         )
-        average_total_latency = sum(total_latency_array) / len(total_latency_array)
-
-        max_window_creation_time = max(window_creation_time_array)
-        max_influx_write_time = max(influx_write_time_array)
-        max_total_latency = max(total_latency_array)
-
-        min_window_creation_time = min(window_creation_time_array)
-        min_influx_write_time = min(influx_write_time_array)
-        min_total_latency = min(total_latency_array)
-
-        # Print results
-        print(f"Average Window Creation Time: {average_window_creation_time:.3f}")
-        print(f"Average Influx Write Time: {average_influx_write_time:.3f}")
-        print(f"Average Total Latency: {average_total_latency:.3f}")
-        print(f"Max Window Creation Time: {max_window_creation_time}")
-        print(f"Max Influx Write Time: {max_influx_write_time}")
-        print(f"Max Total Latency: {max_total_latency}")
-        print(f"Min Window Creation Time: {min_window_creation_time}")
-        print(f"Min Influx Write Time: {min_influx_write_time}")
-        print(f"Min Total Latency: {min_total_latency}")
-
-        return {
-            "influx": {
-                "avg": average_influx_write_time,
-                "min": min_influx_write_time,
-                "max": max_influx_write_time,
-            },
-            "window": {
-                "avg": average_window_creation_time,
-                "min": min_window_creation_time,
-                "max": max_window_creation_time,
-            },
-            "total": {
-                "avg": average_window_creation_time + average_influx_write_time,
-                "min": min_window_creation_time + min_influx_write_time,
-                "max": max_window_creation_time + max_influx_write_time,
-            },
-        }
-    except Exception as e:
-        print(f"Error executing query: {e}")
-        return None
-
 
-def get_data(filename):
-    try:
-        data = query_influxdb()
-        if data:
-            # Write the data to a JSON file
-            with open(f"{filename}.json", "w") as f:
-                json.dump(data, f, indent=2)
-            print(f"File written successfully as {filename}.json")
+    output = pathlib.Path(args.output or f"{args.run}-perf.json")
+    if output.suffix == ".json":
+        summary = {
+            row["stage"]: {
+                key: row[key] for key in ["count", "avg", "min", *PERCENTILES, "max"]
+            }
+            for row in overall.iter_rows(named=True)
+        }
+        output.write_text(json.dumps(summary, indent=2))
+    else:
+        # Reports of several runs (e.g. one per partition mode) can share one file
+        if output.exists():
+            previous = (
+                pl.read_parquet(output)
+                if output.suffix == ".parquet"
+                else pl.read_csv(output)
+            )
+            table = pl.concat(
+                [previous.filter(pl.col("run") != args.run), table],
+                how="vertical_relaxed",
+            )
+        if output.suffix == ".parquet":
+            table.write_parquet(output)
         else:
-            print("No data returned from InfluxDB.")
-    except Exception as e:
-        print(f"Error in get_data: {e}")
+            table.write_csv(output)
+    print(f"File written successfully as {output}")
 
 
-# Call the function to get data and write it to a file
-get_data("multi-10")
+if __name__ == "__main__":
+    main()
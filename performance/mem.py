@@ -1,7 +1,12 @@
+import argparse
+import pathlib
+
 import polars as pl
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator, FuncFormatter
 
+import profiler
+
 
 def clean_memory_data(memory_str: str) -> int:
     memory_str = memory_str.rstrip("+-")
@@ -14,7 +19,7 @@ def clean_memory_data(memory_str: str) -> int:
         return int(memory_str)
 
 
-def plot_mem_usage(input: str, output: str):
+def load_top_csv(input: str) -> pl.DataFrame:
     df = pl.read_csv(input)
     df = df.with_columns((pl.col("timestamp") * 1000).cast(pl.Datetime(time_unit="ms")))
     df = df.with_columns(
@@ -25,7 +30,27 @@ def plot_mem_usage(input: str, output: str):
     # Align timestamps to start from 0
     start_time = df["timestamp"][0]
     df = df.with_columns(((pl.col("timestamp") - start_time) / 1000).cast(pl.Int64))
-    df = df.filter(pl.col("timestamp") >= 0)  # Remove any negative values
+    return df.filter(pl.col("timestamp") >= 0)  # Remove any negative values
+
+
+def load(input: str) -> pl.DataFrame:
+    """Seconds since the start and RSS in KB of a profiler.py sample file, or of a CSV of the old top-based profiler."""
+    suffix = pathlib.Path(input).suffix
+    if suffix == ".csv":
+        return load_top_csv(input)
+    samples = (
+        pl.read_ipc(input, memory_map=False)
+        if suffix == ".arrow"
+        else pl.read_parquet(input)
+    )
+    return profiler.usage(samples).select(
+        pl.col("seconds").alias("timestamp"),
+        (pl.col("rss_bytes") // 1000).alias("memory"),
+    )
+
+
+def plot_mem_usage(input: str, output: str):
+    df = load(input)
 
     plt.figure(figsize=(10, 6))
     plt.plot(df["timestamp"], df["memory"], "b-")
@@ -54,5 +79,8 @@ def plot_mem_usage(input: str, output: str):
 
 
 if __name__ == "__main__":
-    plot_mem_usage("nat-multi-7-profile.csv", "nats-core-multi-7-mem.pdf")
-    plot_mem_usage("jetstream-multi-7-profile.csv", "jetstream-multi-7-mem.pdf")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="Samples written by profiler.py, or a top CSV")
+    parser.add_argument("output")
+    args = parser.parse_args()
+    plot_mem_usage(args.input, args.output)
@@ -0,0 +1,261 @@
+import argparse
+import os
+import pathlib
+import threading
+import time
+
+import polars as pl
+
+# Samples CPU time, RSS, context switches and I/O of a process and all of its children from /proc
+# and writes one row per process and sample to a Parquet file, which cpu.py and mem.py plot
+#
+# python profiler.py --name nats-core-consumer --output nats-core-multi-7.parquet
+# python profiler.py --pid 1234 --rate 0.1 --output ingester.parquet
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+SCHEMA = {
+    "timestamp": pl.Datetime("ms"),
+    "pid": pl.Int32,
+    "ppid": pl.Int32,
+    "name": pl.Categorical,
+    # Cumulative since the process started
+    "cpu_seconds": pl.Float64,
+    "rss_bytes": pl.Int64,
+    "voluntary_ctxt_switches": pl.Int64,
+    "nonvoluntary_ctxt_switches": pl.Int64,
+    # Bytes passed to read/write-like syscalls, sockets included
+    "read_bytes": pl.Int64,
+    "write_bytes": pl.Int64,
+    # Totals of the network namespace of the process, Linux does not account network bytes per process
+    "net_rx_bytes": pl.Int64,
+    "net_tx_bytes": pl.Int64,
+}
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _parents() -> dict[int, int]:
+    parents = {}
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        stat = _read(f"/proc/{entry.name}/stat")
+        if stat:
+            parents[int(entry.name)] = int(stat.rsplit(")", 1)[1].split()[1])
+    return parents
+
+
+def process_tree(pid: int) -> list[int]:
+    """`pid` and all of its descendants, such as the workers of a process pool."""
+    children: dict[int, list[int]] = {}
+    for child, parent in _parents().items():
+        children.setdefault(parent, []).append(child)
+    pids, pending = [], [pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending += children.get(pid, [])
+    return pids
+
+
+def _net_bytes(pid: int) -> tuple[int, int]:
+    rx, tx = 0, 0
+    for line in (_read(f"/proc/{pid}/net/dev") or "").splitlines()[2:]:
+        # Loopback included, local benchmarks never leave it
+        fields = line.split(":", 1)[1].split()
+        rx += int(fields[0])
+        tx += int(fields[8])
+    return rx, tx
+
+
+def sample_process(pid: int) -> dict | None:
+    stat = _read(f"/proc/{pid}/stat")
+    if stat is None:
+        return None
+    # The command name may contain spaces, the fields after it do not
+    name, fields = stat.split("(", 1)[1].rsplit(")", 1)
+    fields = fields.split()
+    # Exited but not reaped yet
+    if fields[0] == "Z":
+        return None
+    # Context switches in /proc/<pid>/status are those of the main thread only
+    switches = [0, 0]
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return None
+    for task in tasks:
+        for line in (_read(f"/proc/{pid}/task/{task}/status") or "").splitlines():
+            if line.startswith("voluntary_ctxt_switches:"):
+                switches[0] += int(line.split(":", 1)[1])
+            elif line.startswith("nonvoluntary_ctxt_switches:"):
+                switches[1] += int(line.split(":", 1)[1])
+    io = dict(
+        line.split(": ", 1)
+        for line in (_read(f"/proc/{pid}/io") or "").splitlines()
+        if ": " in line
+    )
+    net_rx, net_tx = _net_bytes(pid)
+    return {
+        "pid": pid,
+        "ppid": int(fields[1]),
+        "name": name,
+        "cpu_seconds": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        "rss_bytes": int(fields[21]) * PAGE_SIZE,
+        "voluntary_ctxt_switches": switches[0],
+        "nonvoluntary_ctxt_switches": switches[1],
+        "read_bytes": int(io.get("rchar", 0)),
+        "write_bytes": int(io.get("wchar", 0)),
+        "net_rx_bytes": net_rx,
+        "net_tx_bytes": net_tx,
+    }
+
+
+class Profiler(threading.Thread):
+    """Samples the process tree of `pid` every `rate` seconds until `stop` is called or the process exits."""
+
+    def __init__(self, pid: int, rate: float):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.rate = rate
+        self.rows: list[dict] = []
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            now = int(time.time() * 1000)
+            rows = [sample_process(pid) for pid in process_tree(self.pid)]
+            if rows[0] is None:
+                break
+            for row in rows:
+                if row is not None:
+                    row["timestamp"] = now
+                    self.rows.append(row)
+            self._done.wait(self.rate)
+
+    def stop(self) -> pl.DataFrame:
+        self._done.set()
+        self.join()
+        return self.samples()
+
+    def samples(self) -> pl.DataFrame:
+        if not self.rows:
+            return pl.DataFrame(schema=SCHEMA)
+        return (
+            pl.DataFrame(self.rows)
+            .with_columns(pl.col("timestamp").cast(pl.Datetime("ms")))
+            .select([pl.col(column).cast(dtype) for column, dtype in SCHEMA.items()])
+        )
+
+
+def usage(samples: pl.DataFrame) -> pl.DataFrame:
+    """CPU % (100 = one core) and RSS of the whole process tree per sample."""
+    return (
+        samples.sort("timestamp")
+        .with_columns(
+            # Processes that came and went between two samples only count while they were sampled
+            pl.col("cpu_seconds").diff().over("pid").fill_null(0).clip(0).alias("cpu")
+        )
+        .group_by("timestamp", maintain_order=True)
+        .agg(
+            pl.col("cpu").sum(), pl.col("rss_bytes").sum(), pl.len().alias("processes")
+        )
+        .with_columns(
+            (
+                pl.col("cpu")
+                / pl.col("timestamp").diff().dt.total_milliseconds()
+                * 100_000
+            )
+            .fill_null(0)
+            .alias("cpu_percent"),
+            (pl.col("timestamp") - pl.col("timestamp").first())
+            .dt.total_milliseconds()
+            .truediv(1000)
+            .alias("seconds"),
+        )
+        .drop("cpu")
+    )
+
+
+def summary(samples: pl.DataFrame) -> dict:
+    if samples.is_empty():
+        return {
+            "cpu_seconds": 0.0,
+            "cpu_percent": 0.0,
+            "rss_max_mb": 0.0,
+            "context_switches": 0,
+            "processes": 0,
+        }
+    per_pid = samples.group_by("pid").agg(
+        pl.col("cpu_seconds").max() - pl.col("cpu_seconds").min(),
+        pl.col("voluntary_ctxt_switches").max()
+        - pl.col("voluntary_ctxt_switches").min(),
+        pl.col("nonvoluntary_ctxt_switches").max()
+        - pl.col("nonvoluntary_ctxt_switches").min(),
+    )
+    tree = usage(samples)
+    seconds = max(tree["seconds"].max(), 1e-9)
+    cpu_seconds = per_pid["cpu_seconds"].sum()
+    return {
+        "cpu_seconds": round(cpu_seconds, 3),
+        "cpu_percent": round(cpu_seconds / seconds * 100, 2),
+        "rss_max_mb": round(tree["rss_bytes"].max() / 1e6, 2),
+        "context_switches": int(
+            per_pid["voluntary_ctxt_switches"].sum()
+            + per_pid["nonvoluntary_ctxt_switches"].sum()
+        ),
+        "processes": samples["pid"].n_unique(),
+    }
+
+
+def find_pid(name: str) -> int:
+    for entry in os.scandir("/proc"):
+        if (
+            entry.name.isdigit()
+            and (_read(f"/proc/{entry.name}/comm") or "").strip() == name[:15]
+        ):
+            return int(entry.name)
+    raise ProcessLookupError(f"No process named {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--pid", type=int)
+    target.add_argument("--name", help="Name of the process, like pgrep")
+    parser.add_argument(
+        "--rate", type=float, default=0.5, help="Sampling period in seconds"
+    )
+    parser.add_argument("--output", required=True, help=".parquet or .arrow")
+    args = parser.parse_args()
+
+    pid = args.pid or find_pid(args.name)
+    profiler = Profiler(pid, args.rate)
+    print(f"Sampling {pid} and its children every {args.rate}s, Ctrl-C to stop")
+    profiler.start()
+    try:
+        while profiler.is_alive():
+            profiler.join(1)
+    except KeyboardInterrupt:
+        pass
+    samples = profiler.stop()
+
+    output = pathlib.Path(args.output)
+    if output.suffix == ".arrow":
+        samples.write_ipc(output, compression="zstd")
+    else:
+        samples.write_parquet(output)
+    print(summary(samples))
+    print(f"File written successfully as {output}")
+
+
+if __name__ == "__main__":
+    main()
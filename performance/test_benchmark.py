@@ -0,0 +1,70 @@
+import datetime
+import json
+import sys
+
+import pytest
+
+import benchmark
+
+CREATED = datetime.datetime(2024, 12, 1, 10, tzinfo=datetime.UTC)
+
+
+def result(mode: str, partition: str, count: int, rate: float) -> dict:
+    return {
+        "mode": mode,
+        "partition": partition,
+        "consumer_count": count,
+        "messages_per_second": rate,
+    }
+
+
+def test_results_are_versioned_and_merged(tmp_path):
+    output = tmp_path / "results.json"
+    document = benchmark.results_document(output, "1a2b3c4", CREATED, ["day.csv"], [])
+    benchmark.add_result(document, result("jetstream", "multi", 3, 100.0), output)
+    benchmark.add_result(document, result("jetstream", "multi", 5, 200.0), output)
+
+    written = benchmark.load_results(output)
+    assert written["version"] == benchmark.RESULTS_VERSION
+    assert written["commit"] == "1a2b3c4"
+    assert written["created"] == CREATED.isoformat()
+    assert [r["consumer_count"] for r in written["results"]] == [3, 5]
+
+    # A second benchmark into the same file reruns one count and adds another
+    later = CREATED + datetime.timedelta(hours=1)
+    document = benchmark.results_document(output, "1a2b3c4", later, ["day.csv"], [])
+    benchmark.add_result(document, result("jetstream", "multi", 5, 250.0), output)
+    benchmark.add_result(document, result("nats_core", "multi", 5, 300.0), output)
+
+    merged = benchmark.load_results(output)
+    assert merged["created"] == CREATED.isoformat()
+    assert [
+        (r["mode"], r["consumer_count"], r["messages_per_second"])
+        for r in merged["results"]
+    ] == [
+        ("jetstream", 3, 100.0),
+        ("jetstream", 5, 250.0),
+        ("nats_core", 5, 300.0),
+    ]
+
+
+def test_results_of_another_version_are_rejected(tmp_path):
+    output = tmp_path / "results.json"
+    output.write_text(
+        json.dumps({"version": benchmark.RESULTS_VERSION + 1, "results": []})
+    )
+    with pytest.raises(ValueError, match="results version"):
+        benchmark.results_document(output, "1a2b3c4", CREATED, [], [])
+    with pytest.raises(ValueError, match="results version"):
+        benchmark.plot(output)
+
+
+def test_ingester_command(monkeypatch):
+    assert benchmark.ingester_command("/opt/venv/bin/python") == [
+        "/opt/venv/bin/python",
+        "main.py",
+    ]
+    monkeypatch.setattr(benchmark.shutil, "which", lambda name: f"/usr/bin/{name}")
+    assert benchmark.ingester_command() == ["uv", "run", "main.py"]
+    monkeypatch.setattr(benchmark.shutil, "which", lambda name: None)
+    assert benchmark.ingester_command() == [sys.executable, "main.py"]
@@ -0,0 +1,69 @@
+import polars as pl
+
+import latency
+
+WINDOW = {
+    "window_creation_start": 1_000,
+    "window_creation_end": 1_002,
+    "influx_write_end": 1_010,
+}
+
+
+def perf(windows: list[dict]) -> pl.DataFrame:
+    """`perf` fields of the windows as the Flux query returns them, one row per field."""
+    return pl.DataFrame(
+        [
+            ("2021-11-08T09:00:00Z", field, value, f"ID{number}", number)
+            for number, fields in enumerate(windows)
+            for field, value in fields.items()
+        ],
+        schema=["_time", "_field", "_value", "id", "window_number"],
+        orient="row",
+    )
+
+
+def stages(windows: list[dict]) -> dict[str, list[int]]:
+    latencies = latency.stage_latencies(perf(windows)).sort("id")
+    return {
+        stage: df["latency"].to_list()
+        for (stage,), df in latencies.group_by("stage", maintain_order=True)
+    }
+
+
+def test_nats_is_timed_on_the_latest_stamped_tick():
+    closed_by_stamp = {
+        "publish_time": 900,
+        "receive_time": 990,
+        "stamped_publish_time": 900,
+        "stamped_receive_time": 990,
+        **WINDOW,
+    }
+    stamped_earlier = {
+        "publish_time": 0,
+        "receive_time": 995,
+        "stamped_publish_time": 500,
+        "stamped_receive_time": 504,
+        **WINDOW,
+    }
+    unstamped = {
+        "publish_time": 0,
+        "receive_time": 999,
+        "stamped_publish_time": 0,
+        "stamped_receive_time": 0,
+        **WINDOW,
+    }
+    result = stages([closed_by_stamp, stamped_earlier, unstamped])
+    assert result["nats"] == [90, 4]
+    assert result["end_to_end"] == [110]
+    assert result["window"] == [2, 2, 2]
+
+    latencies = latency.stage_latencies(
+        perf([closed_by_stamp, stamped_earlier, unstamped])
+    )
+    assert latency.end_to_end_share(latencies) == 1 / 3
+
+
+def test_windows_of_older_consumers():
+    # Written before the stamped fields existed
+    old = {"publish_time": 900, "receive_time": 990, **WINDOW}
+    assert stages([old])["nats"] == [90]